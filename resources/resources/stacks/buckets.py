@@ -11,10 +11,18 @@ class BucketsStack(cdk.NestedStack):
         super().__init__(scope, id, **kwargs)
         self.stage = self.node.try_get_context("stage")
 
-        # Bucket for storing files to extract data from
+        # Bucket for storing files to extract data from. Rendered pages are content
+        # addressed and listed by a manifest per document, the manifests expire a day
+        # before the pages so a cached manifest never points at expired pages. Documents
+        # queued by reference are kept as long as the batch queue keeps its messages
         self.files = s3.Bucket(
             self,
             "FilesBucket",
+            lifecycle_rules=[
+                s3.LifecycleRule(prefix="manifests/", expiration=cdk.Duration.days(7)),
+                s3.LifecycleRule(prefix="pages/", expiration=cdk.Duration.days(8)),
+                s3.LifecycleRule(prefix="documents/", expiration=cdk.Duration.days(14)),
+            ],
         )
 
         self.files_param = ssm.StringParameter(
@@ -52,7 +60,7 @@ class BucketsStack(cdk.NestedStack):
         role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=[self.files_param.parameter_arn],
             )
         )
@@ -6,18 +6,32 @@ from aws_cdk import aws_sqs as sqs
 from aws_cdk import aws_ssm as ssm
 from constructs import Construct
 
+# Deliveries of a batch record before it is moved to the dead-letter queue
+BATCH_MAX_RECEIVE_COUNT = 3
+
 
 class QueuesStack(cdk.NestedStack):
     def __init__(self, scope: Construct, id: str, **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
         self.stage = self.node.try_get_context("stage")
 
+        # Queue for the batch requests that failed on every delivery
+        self.batch_data_dlq = sqs.Queue(
+            self,
+            "ExtractDataBatchDLQ",
+            visibility_timeout=cdk.Duration.seconds(300),
+            retention_period=cdk.Duration.days(14),
+        )
+
         # Queue for processing batch requests
         self.batch_data = sqs.Queue(
             self,
             "ExtractDataBatchQueue",
             visibility_timeout=cdk.Duration.seconds(300),
             retention_period=cdk.Duration.days(14),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=BATCH_MAX_RECEIVE_COUNT, queue=self.batch_data_dlq
+            ),
         )
 
         self.batch_data_param = ssm.StringParameter(
@@ -47,15 +61,27 @@ class QueuesStack(cdk.NestedStack):
         role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=[self.batch_data_param.parameter_arn],
             )
         )
 
     def add_batch_data_as_event_source(self, fn: _lambda.Function):
+        fn.add_environment("BATCH_MAX_RECEIVE_COUNT", str(BATCH_MAX_RECEIVE_COUNT))
         fn.add_event_source(
             lambda_event_sources.SqsEventSource(
                 self.batch_data,
                 batch_size=10,
+                report_batch_item_failures=True,
+            )
+        )
+
+    def add_batch_data_dlq_as_event_source(self, fn: _lambda.Function):
+        fn.add_environment("BATCH_MAX_RECEIVE_COUNT", str(BATCH_MAX_RECEIVE_COUNT))
+        fn.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                self.batch_data_dlq,
+                batch_size=10,
+                report_batch_item_failures=True,
             )
         )
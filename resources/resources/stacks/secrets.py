@@ -50,7 +50,7 @@ class SecretsStack(cdk.NestedStack):
         role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=[self.openai_param.parameter_arn],
             )
         )
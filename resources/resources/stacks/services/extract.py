@@ -51,12 +51,32 @@ class ExtractServiceStack(cdk.NestedStack):
             layers_stack=layers_stack,
         )
 
+        self.__add_extract_data_batch_failed(
+            tables_stack=tables_stack,
+            queues_stack=queues_stack,
+            layers_stack=layers_stack,
+        )
+
+        self.__add_extract_data_bulk(
+            tables_stack=tables_stack,
+            buckets_stack=buckets_stack,
+            queues_stack=queues_stack,
+            layers_stack=layers_stack,
+            api_stack=api_stack,
+        )
+
         self.__add_get_result(
             tables_stack=tables_stack,
             layers_stack=layers_stack,
             api_stack=api_stack,
         )
 
+        self.__add_get_job(
+            tables_stack=tables_stack,
+            layers_stack=layers_stack,
+            api_stack=api_stack,
+        )
+
     def __add_extract_data(
         self,
         tables_stack: TablesStack,
@@ -87,6 +107,16 @@ class ExtractServiceStack(cdk.NestedStack):
             self.extract_data.role,
             ["dynamodb:PutItem"],
         )
+        tables_stack.add_access_to_cache_table(
+            self.extract_data.fn,
+            self.extract_data.role,
+            ["dynamodb:GetItem", "dynamodb:PutItem"],
+        )
+        tables_stack.add_access_to_rate_limit_table(
+            self.extract_data.fn,
+            self.extract_data.role,
+            ["dynamodb:GetItem", "dynamodb:PutItem"],
+        )
         buckets_stack.add_access_to_files_bucket(
             self.extract_data.fn,
             self.extract_data.role,
@@ -130,6 +160,11 @@ class ExtractServiceStack(cdk.NestedStack):
             self.extract_data_batch.role,
             ["dynamodb:PutItem"],
         )
+        tables_stack.add_access_to_cache_table(
+            self.extract_data_batch.fn,
+            self.extract_data_batch.role,
+            ["dynamodb:GetItem", "dynamodb:PutItem"],
+        )
         buckets_stack.add_access_to_files_bucket(
             self.extract_data_batch.fn,
             self.extract_data_batch.role,
@@ -143,6 +178,87 @@ class ExtractServiceStack(cdk.NestedStack):
         layers_stack.add_docai_layer(self.extract_data_batch.fn)
         api_stack.add_endpoint(self.extract_data_batch.fn, "POST", "extract-data-batch")
 
+    def __add_extract_data_batch_failed(
+        self,
+        tables_stack: TablesStack,
+        queues_stack: QueuesStack,
+        layers_stack: LayersStack,
+    ):
+        self.extract_data_batch_failed = FunctionWithRoleAndDLQ(
+            self,
+            "ExtractDataBatchFailed",
+            service=SERVICE,
+            namespace=NAMESPACE,
+            asset_suffix="functions/extract_data_batch_failed",
+        )
+        tables_stack.add_access_to_result_table(
+            self.extract_data_batch_failed.fn,
+            self.extract_data_batch_failed.role,
+            ["dynamodb:PutItem"],
+        )
+        tables_stack.add_access_to_monitor_table(
+            self.extract_data_batch_failed.fn,
+            self.extract_data_batch_failed.role,
+            ["dynamodb:PutItem"],
+        )
+        tables_stack.add_access_to_job_table(
+            self.extract_data_batch_failed.fn,
+            self.extract_data_batch_failed.role,
+            ["dynamodb:PutItem"],
+        )
+        layers_stack.add_docai_layer(self.extract_data_batch_failed.fn)
+        queues_stack.add_batch_data_dlq_as_event_source(
+            self.extract_data_batch_failed.fn
+        )
+
+    def __add_extract_data_bulk(
+        self,
+        tables_stack: TablesStack,
+        buckets_stack: BucketsStack,
+        queues_stack: QueuesStack,
+        layers_stack: LayersStack,
+        api_stack: APIStack,
+    ):
+        self.extract_data_bulk = FunctionWithRoleAndDLQ(
+            self,
+            "ExtractDataBulk",
+            service=SERVICE,
+            namespace=NAMESPACE,
+            asset_suffix="functions/extract_data_bulk",
+        )
+        tables_stack.add_access_to_schema_table(
+            self.extract_data_bulk.fn,
+            self.extract_data_bulk.role,
+            ["dynamodb:GetItem"],
+        )
+        tables_stack.add_access_to_result_table(
+            self.extract_data_bulk.fn,
+            self.extract_data_bulk.role,
+            ["dynamodb:PutItem", "dynamodb:BatchWriteItem"],
+        )
+        tables_stack.add_access_to_monitor_table(
+            self.extract_data_bulk.fn,
+            self.extract_data_bulk.role,
+            ["dynamodb:PutItem", "dynamodb:BatchWriteItem"],
+        )
+        tables_stack.add_access_to_job_table(
+            self.extract_data_bulk.fn,
+            self.extract_data_bulk.role,
+            ["dynamodb:PutItem"],
+        )
+        buckets_stack.add_access_to_files_bucket(
+            self.extract_data_bulk.fn,
+            self.extract_data_bulk.role,
+            ["s3:*Object", "s3:ListBucket"],
+        )
+        queues_stack.add_access_to_batch_data_queue(
+            self.extract_data_bulk.fn,
+            self.extract_data_bulk.role,
+            ["sqs:SendMessage", "sqs:GetQueueUrl"],
+        )
+        layers_stack.add_docai_layer(self.extract_data_bulk.fn)
+        api_stack.add_endpoint(self.extract_data_bulk.fn, "POST", "extract-data-bulk")
+
     def __add_extract_data_batch_run(
         self,
         tables_stack: TablesStack,
@@ -158,6 +274,11 @@ class ExtractServiceStack(cdk.NestedStack):
             namespace=NAMESPACE,
             asset_suffix="functions/extract_data_batch_run",
         )
+        tables_stack.add_access_to_schema_table(
+            self.extract_data_batch_run.fn,
+            self.extract_data_batch_run.role,
+            ["dynamodb:GetItem"],
+        )
         tables_stack.add_access_to_result_table(
             self.extract_data_batch_run.fn,
             self.extract_data_batch_run.role,
@@ -168,6 +289,21 @@ class ExtractServiceStack(cdk.NestedStack):
             self.extract_data_batch_run.role,
             ["dynamodb:PutItem"],
         )
+        tables_stack.add_access_to_cache_table(
+            self.extract_data_batch_run.fn,
+            self.extract_data_batch_run.role,
+            ["dynamodb:GetItem", "dynamodb:PutItem"],
+        )
+        tables_stack.add_access_to_rate_limit_table(
+            self.extract_data_batch_run.fn,
+            self.extract_data_batch_run.role,
+            ["dynamodb:GetItem", "dynamodb:PutItem"],
+        )
+        tables_stack.add_access_to_job_table(
+            self.extract_data_batch_run.fn,
+            self.extract_data_batch_run.role,
+            ["dynamodb:PutItem"],
+        )
         buckets_stack.add_access_to_files_bucket(
             self.extract_data_batch_run.fn,
             self.extract_data_batch_run.role,
@@ -206,3 +342,24 @@ class ExtractServiceStack(cdk.NestedStack):
         )
         layers_stack.add_docai_layer(self.get_result.fn)
         api_stack.add_endpoint(self.get_result.fn, "POST", "get-result")
+
+    def __add_get_job(
+        self,
+        tables_stack: TablesStack,
+        layers_stack: LayersStack,
+        api_stack: APIStack,
+    ):
+        self.get_job = FunctionWithRoleAndDLQ(
+            self,
+            "GetJob",
+            service=SERVICE,
+            namespace=NAMESPACE,
+            asset_suffix="functions/get_job",
+        )
+        tables_stack.add_access_to_job_table(
+            self.get_job.fn,
+            self.get_job.role,
+            ["dynamodb:GetItem", "dynamodb:Query"],
+        )
+        layers_stack.add_docai_layer(self.get_job.fn)
+        api_stack.add_endpoint(self.get_job.fn, "POST", "get-job")
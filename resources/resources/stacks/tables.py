@@ -73,6 +73,68 @@ class TablesStack(cdk.NestedStack):
         self.monitor_param_arn = self.monitor_param.parameter_arn
         self.monitor_param_name = self.monitor_param.parameter_name
 
+        # Table for caching extraction results of identical requests
+        self.cache = dynamodb.Table(
+            self,
+            "CacheTable",
+            partition_key=dynamodb.Attribute(
+                name="cache_key", type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="expires_at",
+        )
+
+        self.cache_param = ssm.StringParameter(
+            self,
+            "CacheTableName",
+            parameter_name=f"/{self.stage}/table/cache_table_name",
+            string_value=self.cache.table_name,
+        )
+        self.cache_arn = self.cache.table_arn
+        self.cache_param_arn = self.cache_param.parameter_arn
+        self.cache_param_name = self.cache_param.parameter_name
+
+        # Table for the rate limits of the OpenAI API shared by all the functions
+        self.rate_limit = dynamodb.Table(
+            self,
+            "RateLimitTable",
+            partition_key=dynamodb.Attribute(
+                name="limit_key", type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="expires_at",
+        )
+
+        self.rate_limit_param = ssm.StringParameter(
+            self,
+            "RateLimitTableName",
+            parameter_name=f"/{self.stage}/table/rate_limit_table_name",
+            string_value=self.rate_limit.table_name,
+        )
+        self.rate_limit_arn = self.rate_limit.table_arn
+        self.rate_limit_param_arn = self.rate_limit_param.parameter_arn
+        self.rate_limit_param_name = self.rate_limit_param.parameter_name
+
+        # Table for the progress of bulk extraction jobs and their documents
+        self.job = dynamodb.Table(
+            self,
+            "JobTable",
+            partition_key=dynamodb.Attribute(
+                name="job_id", type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="item_id", type=dynamodb.AttributeType.STRING
+            ),
+        )
+
+        self.job_param = ssm.StringParameter(
+            self,
+            "JobTableName",
+            parameter_name=f"/{self.stage}/table/job_table_name",
+            string_value=self.job.table_name,
+        )
+        self.job_arn = self.job.table_arn
+        self.job_param_arn = self.job_param.parameter_arn
+        self.job_param_name = self.job_param.parameter_name
+
     def add_access_to_schema_table(
         self,
         fn: _lambda.Function,
@@ -92,7 +154,7 @@ class TablesStack(cdk.NestedStack):
         role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=[self.schema_param.parameter_arn],
             )
         )
@@ -116,7 +178,7 @@ class TablesStack(cdk.NestedStack):
         role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=[self.result_param.parameter_arn],
             )
         )
@@ -140,7 +202,77 @@ class TablesStack(cdk.NestedStack):
         role.add_to_policy(
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=[self.monitor_param.parameter_arn],
             )
         )
+
+    def add_access_to_cache_table(
+        self,
+        fn: _lambda.Function,
+        role: iam.Role,
+        actions: list[str],
+    ):
+        fn.add_environment(
+            "CACHE_TABLE_PARAMETER_NAME", self.cache_param.parameter_name
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=actions,
+                resources=[self.cache.table_arn],
+            )
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
+                resources=[self.cache_param.parameter_arn],
+            )
+        )
+
+    def add_access_to_rate_limit_table(
+        self,
+        fn: _lambda.Function,
+        role: iam.Role,
+        actions: list[str],
+    ):
+        fn.add_environment(
+            "RATE_LIMIT_TABLE_PARAMETER_NAME", self.rate_limit_param.parameter_name
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=actions,
+                resources=[self.rate_limit.table_arn],
+            )
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
+                resources=[self.rate_limit_param.parameter_arn],
+            )
+        )
+
+    def add_access_to_job_table(
+        self,
+        fn: _lambda.Function,
+        role: iam.Role,
+        actions: list[str],
+    ):
+        fn.add_environment("JOB_TABLE_PARAMETER_NAME", self.job_param.parameter_name)
+        role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=actions,
+                resources=[self.job.table_arn],
+            )
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
+                resources=[self.job_param.parameter_arn],
+            )
+        )
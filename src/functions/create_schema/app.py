@@ -8,12 +8,15 @@ class RequestModel(BaseModel):
     schema_name: str = Field(..., min_length=4, max_length=64)
     schema_description: str = Field(..., min_length=8, max_length=1028)
     schema_definition: dict
+    encoding_profile: str | None = Field(default=None, min_length=1, max_length=32)
 
 
 logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap()
+
 resources = utils.Resources()
 schema_table = resources.get_table("SCHEMA_TABLE_PARAMETER_NAME")
 
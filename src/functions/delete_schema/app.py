@@ -14,6 +14,8 @@ logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap()
+
 resources = utils.Resources()
 schema_table = resources.get_table("SCHEMA_TABLE_PARAMETER_NAME")
 
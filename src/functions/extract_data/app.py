@@ -1,8 +1,13 @@
+import functools
+
 from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.utilities.parser import BaseModel, Field
 
+from docai import cache
+from docai import constants as c
+from docai import deadline as dl
 from docai import exceptions as exc
-from docai import llm, middleware, stream, utils
+from docai import llm, middleware, ratelimit, relevance, schemas, stream, utils
 
 
 class RequestModel(BaseModel):
@@ -10,23 +15,33 @@ class RequestModel(BaseModel):
     schema_version: str = Field(..., length=10)
     content: str = Field(..., min_length=1, max_length=10000000)
     mime_type: str = Field(..., min_length=1, max_length=64)
+    encoding_profile: str | None = Field(default=None, min_length=1, max_length=32)
+    bypass_cache: bool = False
 
 
 logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap(["OPENAI_API_KEY_PARAMETER_NAME"])
+
 config = utils.Config()
 bucket_name = config("FILES_BUCKET_PARAMETER_NAME")
 
 resources = utils.Resources()
 s3_client = resources.get_s3()
 schema_table = resources.get_table("SCHEMA_TABLE_PARAMETER_NAME")
+schema_cache = schemas.SchemaCache(schema_table)
 result_table = resources.get_table("RESULT_TABLE_PARAMETER_NAME")
 monitor_table = resources.get_table("MONITOR_TABLE_PARAMETER_NAME")
+result_cache = cache.ResultCache(resources.get_table("CACHE_TABLE_PARAMETER_NAME"))
 
 secrets = utils.Secrets()
-openai_client = llm.LLMClient(secrets("OPENAI_API_KEY_PARAMETER_NAME"))
+rate_limit_table = resources.get_table("RATE_LIMIT_TABLE_PARAMETER_NAME")
+rate_limiter = ratelimit.RateLimiter(ratelimit.DynamoDBStore(rate_limit_table))
+openai_client = llm.LLMClient(
+    secrets("OPENAI_API_KEY_PARAMETER_NAME"), rate_limiter=rate_limiter
+)
 
 params = {
     "validation_model": RequestModel,
@@ -44,20 +59,50 @@ params = {
 
 
 @tracer.capture_method
-def extract_data(request_id: str, req: dict):
-    document = dict(content=req["content"], mime_type=req["mime_type"])
+def extract_data(request_id: str, req: dict, deadline: dl.Deadline | None = None):
+    document = dict(
+        content=req["content"],
+        mime_type=req["mime_type"],
+        encoding_profile=req["encoding_profile"],
+    )
     key = dict(schema_name=req["schema_name"], schema_version=req["schema_version"])
-    schema = schema_table.get_item(Key=key).get("Item")
+    entry = schema_cache.get(**key)
 
-    if not schema:
+    if not entry:
         raise exc.SchemaDoesNotExist
 
+    schema = entry.item
+
+    cache_key = cache.result_key(schema, document)
+    data = None if req["bypass_cache"] else result_cache.get(cache_key)
+    cached = data is not None
+
     try:
-        params = stream.prepare_extraction_request(
-            schema, document, s3_client, bucket_name
-        )
-        data = openai_client(**params, s3=s3_client, bucket_name=bucket_name)
-        result_table.put_item(Item=dict(request_id=request_id, **key, **data))
+        if not cached:
+            # Pages of a request extracted right away can be sent inline
+            prepare = functools.partial(
+                stream.prepare_extraction_request,
+                schema,
+                document,
+                s3_client,
+                bucket_name,
+                deadline,
+                inline_limit=c.INLINE_IMAGE_MAX_BYTES,
+            )
+            params = prepare()
+            fallback = functools.partial(prepare, select_pages=False)
+            data = relevance.extract(
+                openai_client,
+                params,
+                fallback,
+                s3=s3_client,
+                bucket_name=bucket_name,
+                validator=entry.validator,
+                deadline=deadline,
+            )
+            result_cache.put(cache_key, data)
+        item = dict(request_id=request_id, **key, **data, cached=cached)
+        result_table.put_item(Item=item)
         state = dict(
             request_id=request_id, status="COMPLETED", created_at=utils.utcnow()
         )
@@ -66,14 +111,17 @@ def extract_data(request_id: str, req: dict):
     except Exception as e:
         error = dict(error_name=e.__class__.__name__, error_message=str(e))
         result_table.put_item(Item=dict(request_id=request_id, **key, error=error))
-        state = dict(request_id=request_id, status="FAILED", created_at=utils.utcnow())
+        status = "TIMEOUT" if dl.is_timeout(e, deadline) else "FAILED"
+        state = dict(request_id=request_id, status=status, created_at=utils.utcnow())
         monitor_table.put_item(Item=state)
         raise e
 
-    return {"request_id": request_id, "data": data["result"]}
+    return {"request_id": request_id, "data": data["result"], "cached": cached}
 
 
 @metrics.log_metrics(capture_cold_start_metric=True)
 @middleware.process_docai(**params)
 def lambda_handler(event, context):
-    return extract_data(event["requestContext"]["requestId"], event["valid_body"])
+    deadline = dl.Deadline.from_context(context)
+    request_id = event["requestContext"]["requestId"]
+    return extract_data(request_id, event["valid_body"], deadline)
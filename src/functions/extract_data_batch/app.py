@@ -1,8 +1,9 @@
 from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.utilities.parser import BaseModel, Field
 
+from docai import cache
 from docai import exceptions as exc
-from docai import middleware, stream, utils
+from docai import middleware, schemas, stream, utils
 
 
 class RequestModel(BaseModel):
@@ -10,12 +11,22 @@ class RequestModel(BaseModel):
     schema_version: str = Field(..., length=10)
     content: str = Field(..., min_length=1, max_length=10000000)
     mime_type: str = Field(..., min_length=1, max_length=64)
+    encoding_profile: str | None = Field(default=None, min_length=1, max_length=32)
+    bypass_cache: bool = False
 
 
 class PayloadModel(BaseModel):
     schema_definition: dict
-    text_data: str
+    text_data: str | None = None
     image_list: list[str] | None = None
+    manifest: str | None = None
+    selected_pages: list[int] | None = None
+
+
+class DocumentReferenceModel(BaseModel):
+    s3_key: str
+    mime_type: str
+    encoding_profile: str | None = None
 
 
 class KeyModel(BaseModel):
@@ -27,6 +38,9 @@ class EventModel(BaseModel):
     request_id: str
     key: KeyModel
     payload: PayloadModel
+    document: DocumentReferenceModel | None = None
+    cache_key: str | None = None
+    bypass_cache: bool = False
     created_at: str = Field(default_factory=utils.utcnow)
 
 
@@ -34,14 +48,18 @@ logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap()
+
 config = utils.Config()
 bucket_name = config("FILES_BUCKET_PARAMETER_NAME")
 
 resources = utils.Resources()
 s3_client = resources.get_s3()
 schema_table = resources.get_table("SCHEMA_TABLE_PARAMETER_NAME")
+schema_cache = schemas.SchemaCache(schema_table)
 result_table = resources.get_table("RESULT_TABLE_PARAMETER_NAME")
 monitor_table = resources.get_table("MONITOR_TABLE_PARAMETER_NAME")
+result_cache = cache.ResultCache(resources.get_table("CACHE_TABLE_PARAMETER_NAME"))
 batch_queue = resources.get_queue("BATCH_DATA_QUEUE_PARAMETER_NAME")
 
 
@@ -60,20 +78,62 @@ params = {
 }
 
 
+def store_document(request_id: str, document: dict) -> str:
+    """Store the document of a request and return its S3 key"""
+    key = f"{stream.DOCUMENTS_PREFIX}/{request_id}"
+    body = stream.document_body(document["content"], document["mime_type"])
+    return stream.save_to_s3(s3_client, bucket_name, body, document["mime_type"], key)
+
+
 @tracer.capture_method
 def queue_batch_extraction(request_id: str, req: dict):
-    document = dict(content=req["content"], mime_type=req["mime_type"])
+    document = dict(
+        content=req["content"],
+        mime_type=req["mime_type"],
+        encoding_profile=req["encoding_profile"],
+    )
     key = dict(schema_name=req["schema_name"], schema_version=req["schema_version"])
-    schema = schema_table.get_item(Key=key).get("Item")
+    entry = schema_cache.get(**key)
 
-    if not schema:
+    if not entry:
         raise exc.SchemaDoesNotExist
 
+    schema = entry.item
+
+    cache_key = cache.result_key(schema, document)
+    data = None if req["bypass_cache"] else result_cache.get(cache_key)
+
     try:
+        if data is not None:
+            # Identical documents were already extracted, so there is nothing to queue
+            item = dict(request_id=request_id, **key, **data, cached=True)
+            result_table.put_item(Item=item)
+            state = dict(
+                request_id=request_id, status="COMPLETED", created_at=utils.utcnow()
+            )
+            monitor_table.put_item(Item=state)
+            return dict(**state, cached=True)
+
         payload = stream.prepare_extraction_request(
-            schema, document, s3_client, bucket_name
+            schema, document, s3_client, bucket_name, reference=True
+        )
+        # The document is stored for the run to render the other pages from, only
+        # if the selected ones turn out not to be enough
+        reference = None
+        if payload.get("selected_pages"):
+            reference = dict(
+                s3_key=store_document(request_id, document),
+                mime_type=document["mime_type"],
+                encoding_profile=document["encoding_profile"],
+            )
+        event = EventModel(
+            request_id=request_id,
+            key=key,
+            payload=payload,
+            document=reference,
+            cache_key=cache_key,
+            bypass_cache=req["bypass_cache"],
         )
-        event = EventModel(request_id=request_id, key=key, payload=payload)
         state = dict(request_id=request_id, status="QUEUED", created_at=utils.utcnow())
         batch_queue.send_message(MessageBody=event.json())
         monitor_table.put_item(Item=state)
@@ -84,7 +144,7 @@ def queue_batch_extraction(request_id: str, req: dict):
         monitor_table.put_item(Item=state)
         raise e
 
-    return state
+    return dict(**state, cached=False)
 
 
 @metrics.log_metrics(capture_cold_start_metric=True)
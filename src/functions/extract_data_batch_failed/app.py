@@ -0,0 +1,64 @@
+import json
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.logging import correlation_paths
+from aws_lambda_powertools.metrics import MetricUnit
+from botocore.exceptions import ClientError
+
+from docai import constants as c
+from docai import jobs, utils
+
+logger = Logger()
+tracer = Tracer()
+metrics = Metrics()
+
+utils.bootstrap()
+
+resources = utils.Resources()
+result_table = resources.get_table("RESULT_TABLE_PARAMETER_NAME")
+monitor_table = resources.get_table("MONITOR_TABLE_PARAMETER_NAME")
+job_tracker = jobs.JobTracker(resources.get_table("JOB_TABLE_PARAMETER_NAME"))
+
+ANNOTATION_KEY = "ExtractDataBatchFailed"
+
+
+@tracer.capture_method
+def fail_extraction(request_id: str, key: dict, job_id: str | None = None, **kwargs):
+    """Mark a batch record that ran out of deliveries as failed"""
+    # The error of the last attempt is kept when there is one, a record may also
+    # have timed out or crashed before it could write any
+    error = dict(
+        error_name="ExtractionFailed",
+        error_message=f"Extraction failed after {c.BATCH_MAX_RECEIVE_COUNT} attempts",
+    )
+    try:
+        result_table.put_item(
+            Item=dict(request_id=request_id, **key, error=error),
+            ConditionExpression="attribute_not_exists(request_id)",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise e
+    state = dict(request_id=request_id, status="FAILED", created_at=utils.utcnow())
+    monitor_table.put_item(Item=state)
+    if job_id:
+        job_tracker.record(job_id, request_id, "FAILED")
+    logger.info("Dead-lettered batch record marked as failed", request_id=request_id)
+
+
+@metrics.log_metrics(capture_cold_start_metric=True)
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
+def lambda_handler(event, context):
+    records = event["Records"]
+    failures = []
+    for record in records:
+        try:
+            fail_extraction(**json.loads(record["body"]))
+        except Exception as e:
+            logger.exception(e)
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    metrics.add_metric(
+        f"{ANNOTATION_KEY}Records", unit=MetricUnit.Count, value=len(records)
+    )
+    return {"batchItemFailures": failures}
@@ -1,15 +1,24 @@
+import concurrent.futures
+import functools
 import json
 
 from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.metrics import MetricUnit
 
-from docai import error, llm, utils
+from docai import cache
+from docai import constants as c
+from docai import deadline as dl
+from docai import error
+from docai import exceptions as exc
+from docai import jobs, llm, ratelimit, relevance, schemas, stream, utils
 
 logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap(["OPENAI_API_KEY_PARAMETER_NAME"])
+
 config = utils.Config()
 bucket_name = config("FILES_BUCKET_PARAMETER_NAME")
 
@@ -17,9 +26,16 @@ resources = utils.Resources()
 s3_client = resources.get_s3()
 result_table = resources.get_table("RESULT_TABLE_PARAMETER_NAME")
 monitor_table = resources.get_table("MONITOR_TABLE_PARAMETER_NAME")
+result_cache = cache.ResultCache(resources.get_table("CACHE_TABLE_PARAMETER_NAME"))
+schema_cache = schemas.SchemaCache(resources.get_table("SCHEMA_TABLE_PARAMETER_NAME"))
+job_tracker = jobs.JobTracker(resources.get_table("JOB_TABLE_PARAMETER_NAME"))
 
 secrets = utils.Secrets()
-openai_client = llm.LLMClient(secrets("OPENAI_API_KEY_PARAMETER_NAME"))
+rate_limit_table = resources.get_table("RATE_LIMIT_TABLE_PARAMETER_NAME")
+rate_limiter = ratelimit.RateLimiter(ratelimit.DynamoDBStore(rate_limit_table))
+openai_client = llm.LLMClient(
+    secrets("OPENAI_API_KEY_PARAMETER_NAME"), rate_limiter=rate_limiter
+)
 
 RECEIVED = "Request to extract data in batch mode received"
 SUCCESS = "Batch mode extraction completed successfully"
@@ -27,20 +43,116 @@ ERROR = "Failed to extract data in batch mode"
 ANNOTATION_KEY = "ExtractDataBatchRun"
 
 
+def get_schema(key: dict) -> schemas.CachedSchema:
+    entry = schema_cache.get(**key)
+    if not entry:
+        raise exc.SchemaDoesNotExist
+    return entry
+
+
+def load_document(document: dict) -> dict:
+    """Load the content of a document queued as an S3 reference"""
+    content = stream.load_document(
+        s3_client, bucket_name, document["s3_key"], document["mime_type"]
+    )
+    return dict(document, content=content)
+
+
+def prepare_fallback(key: dict, document: dict, deadline: dl.Deadline | None) -> dict:
+    """Prepare the request with every page, once the selected ones were not enough"""
+    return stream.prepare_extraction_request(
+        get_schema(key).item,
+        load_document(document),
+        s3_client,
+        bucket_name,
+        deadline,
+        select_pages=False,
+    )
+
+
+def extract_document(
+    entry: schemas.CachedSchema, document: dict, deadline: dl.Deadline | None
+) -> dict:
+    """Extract a document that was queued by reference rather than prepared"""
+    # Nothing is queued behind the extraction, so pages can be sent inline
+    prepare = functools.partial(
+        stream.prepare_extraction_request,
+        entry.item,
+        document,
+        s3_client,
+        bucket_name,
+        deadline,
+        inline_limit=c.INLINE_IMAGE_MAX_BYTES,
+    )
+    return relevance.extract(
+        openai_client,
+        prepare(),
+        functools.partial(prepare, select_pages=False),
+        s3=s3_client,
+        bucket_name=bucket_name,
+        validator=entry.validator,
+        deadline=deadline,
+    )
+
+
 @tracer.capture_method
-def extract_data(request_id: str, key: dict, payload: dict, **kwargs: dict):
+def extract_data(
+    request_id: str,
+    key: dict,
+    payload: dict | None = None,
+    document: dict | None = None,
+    job_id: str | None = None,
+    cache_key: str | None = None,
+    bypass_cache: bool = False,
+    deadline: dl.Deadline | None = None,
+    attempt: int = 1,
+    **kwargs: dict,
+):
+    # Records that cannot start in time are left to be redelivered
+    if deadline:
+        deadline.check("extracting the record")
     try:
         logger.info(RECEIVED, key)
         state = dict(request_id=request_id, status="RUNNING", created_at=utils.utcnow())
         monitor_table.put_item(Item=state)
 
-        data = openai_client(**payload, s3=s3_client, bucket_name=bucket_name)
+        # Documents of a bulk job are queued as S3 references and prepared here
+        entry = None
+        if payload is None:
+            entry = get_schema(key)
+            document = load_document(document)
+            cache_key = cache.result_key(entry.item, document)
+
+        # An identical document may have been extracted since this one was queued
+        lookup = cache_key and not bypass_cache
+        data = result_cache.get(cache_key) if lookup else None
+        cached = data is not None
+        name = "CacheHit" if cached else "CacheMiss"
+        metrics.add_metric(f"{ANNOTATION_KEY}{name}", unit=MetricUnit.Count, value=1)
+        if not cached and entry is not None:
+            data = extract_document(entry, document, deadline)
+        elif not cached:
+            # Rendered documents are queued as the key of their manifest
+            params = stream.load_extraction_request(s3_client, bucket_name, payload)
+            data = relevance.extract(
+                openai_client,
+                params,
+                lambda: prepare_fallback(key, document, deadline),
+                s3=s3_client,
+                bucket_name=bucket_name,
+                deadline=deadline,
+            )
+        if not cached and cache_key:
+            result_cache.put(cache_key, data)
 
-        result_table.put_item(Item=dict(request_id=request_id, **key, **data))
+        item = dict(request_id=request_id, **key, **data, cached=cached)
+        result_table.put_item(Item=item)
         state = dict(
             request_id=request_id, status="COMPLETED", created_at=utils.utcnow()
         )
         monitor_table.put_item(Item=state)
+        if job_id:
+            job_tracker.record(job_id, request_id, "COMPLETED")
 
         logger.info(SUCCESS, extra={"data": data})
         tracer.put_annotation(ANNOTATION_KEY, "SUCCESS")
@@ -51,8 +163,13 @@ def extract_data(request_id: str, key: dict, payload: dict, **kwargs: dict):
         result_table.put_item(
             Item=dict(request_id=request_id, **key, error=err.log_dict())
         )
-        state = dict(request_id=request_id, status="FAILED", created_at=utils.utcnow())
+        status = "TIMEOUT" if dl.is_timeout(e, deadline) else "FAILED"
+        state = dict(request_id=request_id, status=status, created_at=utils.utcnow())
         monitor_table.put_item(Item=state)
+        if job_id:
+            # The record is delivered again until its last attempt, then dead-lettered
+            final = attempt >= c.BATCH_MAX_RECEIVE_COUNT
+            job_tracker.record(job_id, request_id, "FAILED" if final else "RETRYING")
 
         logger.error(ERROR, error=err.log_dict())
         tracer.put_annotation(ANNOTATION_KEY, "FAILED")
@@ -61,9 +178,31 @@ def extract_data(request_id: str, key: dict, payload: dict, **kwargs: dict):
         raise e
 
 
+def process_record(record: dict, deadline: dl.Deadline) -> None:
+    req = json.loads((record["body"]))
+    attempt = int(record["attributes"]["ApproximateReceiveCount"])
+    extract_data(**req, deadline=deadline, attempt=attempt)
+
+
 @metrics.log_metrics(capture_cold_start_metric=True)
 @logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
 def lambda_handler(event, context):
-    for record in event["Records"]:
-        req = json.loads((record["body"]))
-        extract_data(**req)
+    # Records are extracted concurrently and only the failed ones are reported back,
+    # so SQS does not redeliver the records that were already extracted
+    records = event["Records"]
+    deadline = dl.Deadline.from_context(context)
+    workers = max(1, min(c.BATCH_RUN_CONCURRENCY, len(records)))
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(process_record, r, deadline): r["messageId"]
+            for r in records
+        }
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is not None:
+                failures.append({"itemIdentifier": futures[future]})
+
+    metrics.add_metric(
+        f"{ANNOTATION_KEY}Records", unit=MetricUnit.Count, value=len(records)
+    )
+    return {"batchItemFailures": failures}
@@ -0,0 +1,227 @@
+import concurrent.futures
+import random
+import time
+
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities.parser import BaseModel, Field, validator
+from botocore.exceptions import BotoCoreError, ClientError
+
+from docai import constants as c
+from docai import exceptions as exc
+from docai import jobs, middleware, schemas, stream, uploads, utils
+
+
+class DocumentModel(BaseModel):
+    content: str | None = Field(default=None, min_length=1, max_length=10000000)
+    s3_key: str | None = Field(default=None, min_length=1, max_length=1024)
+    mime_type: str = Field(..., min_length=1, max_length=64)
+    encoding_profile: str | None = Field(default=None, min_length=1, max_length=32)
+
+    @validator("s3_key", always=True)
+    def validate_source(cls, v: str | None, values: dict) -> str | None:
+        if (v is None) == (values.get("content") is None):
+            raise ValueError("Either content or s3_key is required, not both")
+        # Keys elsewhere in the bucket hold the pages and documents of other requests
+        if v is not None and not v.startswith(f"{stream.UPLOADS_PREFIX}/"):
+            raise ValueError(f"s3_key must be under {stream.UPLOADS_PREFIX}/")
+        return v
+
+
+class RequestModel(BaseModel):
+    schema_name: str = Field(..., min_length=4, max_length=64)
+    schema_version: str = Field(..., length=10)
+    documents: list[DocumentModel] = Field(
+        ..., min_items=1, max_items=c.BULK_MAX_DOCUMENTS
+    )
+    bypass_cache: bool = False
+
+
+class DocumentReferenceModel(BaseModel):
+    s3_key: str
+    mime_type: str
+    encoding_profile: str | None = None
+
+
+class KeyModel(BaseModel):
+    schema_name: str
+    schema_version: str
+
+
+class EventModel(BaseModel):
+    request_id: str
+    key: KeyModel
+    document: DocumentReferenceModel
+    job_id: str
+    bypass_cache: bool = False
+    created_at: str = Field(default_factory=utils.utcnow)
+
+
+logger = Logger()
+tracer = Tracer()
+metrics = Metrics()
+
+utils.bootstrap()
+
+config = utils.Config()
+bucket_name = config("FILES_BUCKET_PARAMETER_NAME")
+
+resources = utils.Resources()
+s3_client = resources.get_s3()
+schema_table = resources.get_table("SCHEMA_TABLE_PARAMETER_NAME")
+schema_cache = schemas.SchemaCache(schema_table)
+result_table = resources.get_table("RESULT_TABLE_PARAMETER_NAME")
+monitor_table = resources.get_table("MONITOR_TABLE_PARAMETER_NAME")
+job_tracker = jobs.JobTracker(resources.get_table("JOB_TABLE_PARAMETER_NAME"))
+batch_queue = resources.get_queue("BATCH_DATA_QUEUE_PARAMETER_NAME")
+
+ANNOTATION_KEY = "ExtractDataBulk"
+
+params = {
+    "validation_model": RequestModel,
+    "messages": {
+        "RECEIVED": "Request to extract data in bulk received",
+        "SUCCESS": "Bulk extraction job queued successfully",
+        "ERROR": "Failed to queue bulk extraction job",
+    },
+    "include_fields": {"schema_name", "schema_version"},
+    "annotation_key": ANNOTATION_KEY,
+    "logger": logger,
+    "tracer": tracer,
+    "metrics": metrics,
+}
+
+
+def store_document(request_id: str, document: dict) -> str:
+    """Return the S3 key of a document, storing it first if it was sent inline"""
+    if document["content"] is None:
+        return document["s3_key"]
+    key = f"{stream.DOCUMENTS_PREFIX}/{request_id}"
+    body = stream.document_body(document["content"], document["mime_type"])
+    return stream.save_to_s3(s3_client, bucket_name, body, document["mime_type"], key)
+
+
+def send_batch(entries: list[dict]) -> list[dict]:
+    """Send a batch of messages, retrying the failed ones, and return those that fail.
+
+    A call that raises fails every message of the batch, so they are all retried and,
+    if the call keeps failing, all returned.
+    """
+    for attempt in range(c.BULK_SEND_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, c.BULK_SEND_BASE_DELAY * 2**attempt))
+        try:
+            response = batch_queue.send_messages(Entries=entries)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning("Failed to send a batch of %d messages: %s", len(entries), e)
+            continue
+        failed = {failure["Id"] for failure in response.get("Failed", [])}
+        entries = [entry for entry in entries if entry["Id"] in failed]
+        if not entries:
+            break
+    return entries
+
+
+def send_events(events: list[EventModel]) -> list[str]:
+    """Queue the events in batches and return the request ids that failed"""
+    entries = [
+        dict(Id=str(index), MessageBody=event.json())
+        for index, event in enumerate(events)
+    ]
+    batches = [
+        entries[i : i + c.SQS_BATCH_SIZE]
+        for i in range(0, len(entries), c.SQS_BATCH_SIZE)
+    ]
+    workers = max(1, min(c.BULK_SEND_CONCURRENCY, len(batches)))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        failed = [
+            entry for batch in executor.map(send_batch, batches) for entry in batch
+        ]
+    return [events[int(entry["Id"])].request_id for entry in failed]
+
+
+@tracer.capture_method
+def queue_bulk_extraction(job_id: str, req: dict):
+    key = dict(schema_name=req["schema_name"], schema_version=req["schema_version"])
+    if not schema_cache.get(**key):
+        raise exc.SchemaDoesNotExist
+
+    documents = req["documents"]
+    request_ids = [f"{job_id}-{index:05d}" for index in range(len(documents))]
+
+    # Documents sent inline are stored first, so the queued messages stay small
+    futures = [
+        uploads.pool.submit(store_document, request_id, document)
+        for request_id, document in zip(request_ids, documents)
+    ]
+    events = [
+        EventModel(
+            request_id=request_id,
+            key=key,
+            document=dict(
+                s3_key=future.result(),
+                mime_type=document["mime_type"],
+                encoding_profile=document["encoding_profile"],
+            ),
+            job_id=job_id,
+            bypass_cache=req["bypass_cache"],
+        )
+        for request_id, document, future in zip(request_ids, documents, futures)
+    ]
+
+    job = job_tracker.create(job_id, len(documents), **key)
+    with monitor_table.batch_writer() as writer:
+        for request_id in request_ids:
+            state = dict(
+                request_id=request_id,
+                status="QUEUED",
+                created_at=job["created_at"],
+                job_id=job_id,
+            )
+            writer.put_item(Item=state)
+
+    failed = send_events(events)
+    if failed:
+        error = dict(error_name="QueueError", error_message="Failed to queue document")
+        created_at = utils.utcnow()
+        with result_table.batch_writer() as results, monitor_table.batch_writer() as states:
+            for request_id in failed:
+                results.put_item(Item=dict(request_id=request_id, **key, error=error))
+                state = dict(
+                    request_id=request_id,
+                    status="FAILED",
+                    created_at=created_at,
+                    job_id=job_id,
+                )
+                states.put_item(Item=state)
+        for request_id in failed:
+            job_tracker.record(job_id, request_id, "FAILED")
+
+    metrics.add_metric(
+        f"{ANNOTATION_KEY}Documents", unit=MetricUnit.Count, value=len(documents)
+    )
+    # Documents that could not be queued are already counted as failed by the job
+    queued = len(documents) - len(failed)
+    if not failed:
+        status = "QUEUED"
+    elif queued:
+        status = "PARTIALLY_QUEUED"
+    else:
+        status = "FAILED"
+    return dict(
+        job_id=job_id,
+        status=status,
+        total=len(documents),
+        queued=queued,
+        failed=len(failed),
+        request_ids=request_ids,
+        created_at=job["created_at"],
+    )
+
+
+@metrics.log_metrics(capture_cold_start_metric=True)
+@middleware.process_docai(**params)
+def lambda_handler(event, context):
+    return queue_bulk_extraction(
+        event["requestContext"]["requestId"], event["valid_body"]
+    )
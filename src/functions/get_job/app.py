@@ -0,0 +1,48 @@
+from aws_lambda_powertools import Logger, Metrics, Tracer
+from aws_lambda_powertools.utilities.parser import BaseModel
+
+from docai import exceptions as exc
+from docai import jobs, middleware, utils
+
+
+class RequestModel(BaseModel):
+    job_id: str
+
+
+logger = Logger()
+tracer = Tracer()
+metrics = Metrics()
+
+utils.bootstrap()
+
+resources = utils.Resources()
+job_tracker = jobs.JobTracker(resources.get_table("JOB_TABLE_PARAMETER_NAME"))
+
+
+params = {
+    "validation_model": RequestModel,
+    "messages": {
+        "RECEIVED": "Request to get job received",
+        "SUCCESS": "Job has been retrieved successfully",
+        "ERROR": "Failed to retrieve job",
+    },
+    "include_fields": {"job_id"},
+    "annotation_key": "GetJob",
+    "logger": logger,
+    "tracer": tracer,
+    "metrics": metrics,
+}
+
+
+@tracer.capture_method
+def get_job(job_id: str):
+    job = job_tracker.get(job_id)
+    if job is None:
+        raise exc.JobDoesNotExist
+    return job
+
+
+@metrics.log_metrics(capture_cold_start_metric=True)
+@middleware.process_docai(**params)
+def lambda_handler(event, context):
+    return get_job(event["valid_body"]["job_id"])
@@ -2,7 +2,7 @@ from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.utilities.parser import BaseModel, Field
 
 from docai import exceptions as exc
-from docai import middleware, stream, utils
+from docai import middleware, utils
 
 
 class RequestModel(BaseModel):
@@ -13,6 +13,8 @@ logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap()
+
 resources = utils.Resources()
 result_table = resources.get_table("RESULT_TABLE_PARAMETER_NAME")
 monitor_table = resources.get_table("MONITOR_TABLE_PARAMETER_NAME")
@@ -47,12 +49,12 @@ def get_result(request_id: str):
         raise exc.RequestDoesNotExist
 
     state = states["Items"][0]
-    if state["status"] in ["COMPLETED", "FAILED"]:
+    if state["status"] in ["COMPLETED", "FAILED", "TIMEOUT"]:
         result = result_table.get_item(Key=dict(request_id=request_id)).get("Item")
         if state["status"] == "COMPLETED":
             state.update(status="COMPLETED", data=result["result"])
-        elif state["status"] == "FAILED":
-            state.update(status="FAILED", error=result["error"])
+        else:
+            state.update(error=result["error"])
     return state
 
 
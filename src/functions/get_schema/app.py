@@ -1,7 +1,4 @@
 from aws_lambda_powertools import Logger, Metrics, Tracer
-from aws_lambda_powertools.event_handler import APIGatewayRestResolver
-from aws_lambda_powertools.logging import correlation_paths
-from aws_lambda_powertools.metrics import MetricUnit
 from aws_lambda_powertools.utilities.parser import BaseModel, Field
 
 from docai import exceptions as exc
@@ -17,6 +14,8 @@ logger = Logger()
 tracer = Tracer()
 metrics = Metrics()
 
+utils.bootstrap()
+
 resources = utils.Resources()
 schema_table = resources.get_table("SCHEMA_TABLE_PARAMETER_NAME")
 
@@ -0,0 +1,52 @@
+"""Benchmark the page image encoding profiles on the sample PDFs.
+
+Reports the image size, bytes, encode time and estimated vision tokens per page for
+each profile in `constants.ENCODING_PROFILES`.
+
+Usage:
+    poetry run python benchmarks/encoding_profiles.py
+"""
+import argparse
+import time
+from pathlib import Path
+
+import fitz
+
+from docai import constants as c
+from docai import encoding
+
+SAMPLES = Path(__file__).parents[4] / "samples" / "media"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'document':<16}{'profile':<10}{'size':>12}{'KB/page':>10}"
+        f"{'ms/page':>10}{'tokens/page':>13}"
+    )
+    for path in sorted(SAMPLES.glob("*.pdf")):
+        document = fitz.open(path)
+        for name in c.ENCODING_PROFILES:
+            profile = encoding.get_profile(name)
+            size, elapsed, tokens = 0, 0.0, 0
+            for _ in range(args.repeat):
+                for page in document:
+                    start = time.perf_counter()
+                    image = encoding.render_page(page, profile)
+                    elapsed += time.perf_counter() - start
+                    size += len(image)
+                    pixmap = fitz.Pixmap(image)
+                    tokens += encoding.image_tokens(pixmap.width, pixmap.height)
+            pages = len(document) * args.repeat
+            dimensions = f"{pixmap.width}x{pixmap.height}"
+            print(
+                f"{path.name:<16}{name:<10}{dimensions:>12}{size / pages / 1024:>10.1f}"
+                f"{elapsed / pages * 1000:>10.1f}{tokens // pages:>13}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark the import time of every handler.
+
+Runs the top level imports of each handler in a fresh interpreter with
+`-X importtime` and reports the total import time and the heaviest top level
+packages. The handlers' module scope initialization needs AWS, so only the imports
+are measured.
+
+Usage:
+    poetry run python benchmarks/import_time.py
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+LAYER = Path(__file__).parents[1]
+FUNCTIONS = Path(__file__).parents[3] / "functions"
+
+
+def handler_imports(path: Path) -> str:
+    """Return the top level import statements of a handler"""
+    tree = ast.parse(path.read_text())
+    nodes = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in nodes)
+
+
+def import_profile(source: str) -> dict[str, int]:
+    """Return the cumulative import time in microseconds of each top level package"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(LAYER), *sys.path]))
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", source],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    profile: dict[str, int] = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented under the package that imported them
+        if len(name) - len(name.lstrip()) == 1:
+            profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    # Packages the interpreter imports at startup are not part of the handler
+    startup = import_profile("pass").keys()
+
+    print(f"{'handler':<24}{'ms':>8}  heaviest packages (ms)")
+    for path in sorted(FUNCTIONS.glob("*/app.py")):
+        source = handler_imports(path)
+        # The fastest run is the one least disturbed by the rest of the machine
+        profiles = [
+            {n: t for n, t in import_profile(source).items() if n not in startup}
+            for _ in range(args.repeat)
+        ]
+        profile = min(profiles, key=lambda p: sum(p.values()))
+        heaviest = sorted(profile.items(), key=lambda item: item[1], reverse=True)
+        packages = ", ".join(f"{n} {t / 1000:.0f}" for n, t in heaviest[: args.top])
+        total = sum(profile.values()) / 1000
+        print(f"{path.parent.name:<24}{total:>8.0f}  {packages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Benchmark extracting the JSON object from long model responses.
+
+Compares the previous greedy regex with `codec.extract_json` for each JSON codec,
+and the codecs at serializing the extracted data.
+
+Usage:
+    poetry run python benchmarks/json_extraction.py
+"""
+import argparse
+import decimal
+import json
+import re
+import time
+from typing import Any, Callable
+
+from docai import codec
+
+
+def regex_extract(text: str) -> Any:
+    """The extraction `utils.validate_data` used before the scanner"""
+    match = re.search(r"\{.*\}", text.strip(), re.MULTILINE | re.IGNORECASE | re.DOTALL)
+    output = match.group() if match else ""
+    return json.loads(output, strict=False, parse_float=decimal.Decimal)
+
+
+def payload(items: int) -> dict:
+    line = {"description": "Consulting services", "quantity": 2, "amount": 1250.75}
+    return {"invoice_number": "INV-001", "line_items": [line] * items}
+
+
+def responses(items: int) -> dict[str, str]:
+    data = json.dumps(payload(items), indent=2)
+    prose = "The document lists the services rendered during the period. " * 40
+    return {
+        "bare": data,
+        "fenced": f"{prose}\n```json\n{data}\n```\n{prose}",
+        "braces in prose": f"{prose} {{see below}} \n```json\n{data}\n```\n{prose}",
+        "unclosed braces": prose + " {" * (items * 4),
+    }
+
+
+def timeit(fn: Callable, text: str, repeat: int) -> str:
+    """Return the mean time in ms, marked with `!` if no object was extracted"""
+    failed = False
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            fn(text)
+        except Exception:
+            failed = True
+    elapsed = (time.perf_counter() - start) / repeat * 1e3
+    return f"{elapsed:>9.3f}{'!' if failed else ' '}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    codecs = [codec.get_codec("stdlib")]
+    if codec.orjson is not None:
+        codecs.append(codec.get_codec("orjson"))
+
+    names = "".join(f"{c.name:>10}" for c in codecs)
+    print(f"{'response':<18}{'items':>6}{'KB':>8}{'regex ms':>10}{names}")
+    for items in args.items:
+        for name, text in responses(items).items():
+            row = f"{name:<18}{items:>6}{len(text) / 1024:>8.0f}"
+            row += timeit(regex_extract, text, args.repeat)
+            for selected in codecs:
+                codec.codec = selected
+                row += timeit(codec.extract_json, text, args.repeat)
+            print(row)
+
+    print(f"\n{'serialize':<18}{'items':>6}{names}")
+    for items in args.items:
+        data = codec.get_codec("stdlib").loads(json.dumps(payload(items)))
+        row = f"{'':<18}{items:>6}"
+        for selected in codecs:
+            row += timeit(selected.dumps, data, args.repeat)
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
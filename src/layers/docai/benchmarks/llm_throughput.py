@@ -0,0 +1,130 @@
+"""Benchmark extraction throughput of the sync and async LLM clients.
+
+Serves chat completions from a local stub of the OpenAI API that answers after a
+fixed latency, and reports the extractions per second of the sync client called
+from a thread per concurrent extraction, and of the async client on one event loop.
+
+Usage:
+    poetry run python benchmarks/llm_throughput.py --latency 2 --concurrency 1 64 256
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import socket
+import time
+from typing import Any
+
+from docai import llm
+
+SCHEMA = {
+    "type": "object",
+    "properties": {"employer_name": {"type": ["null", "string"]}},
+    "required": ["employer_name"],
+    "additionalProperties": False,
+}
+COMPLETION = {
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "stub",
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": '{"employer_name": "Acme"}'},
+        }
+    ],
+    "usage": {"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+}
+
+
+async def serve_stub(port: int, latency: float, ready: Any) -> None:
+    """Serve chat completions over keep-alive HTTP/1.1 connections"""
+    body = json.dumps(COMPLETION).encode()
+    response = (
+        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+        b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+    )
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while headers := await reader.readuntil(b"\r\n\r\n"):
+                length = re.search(rb"(?i)content-length: *(\d+)", headers)
+                await reader.readexactly(int(length.group(1)) if length else 0)
+                await asyncio.sleep(latency)
+                # One write per response, split writes stall on delayed ACKs
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port, backlog=1024)
+    ready.set()
+    await server.serve_forever()
+
+
+def start_stub(latency: float) -> tuple[multiprocessing.Process, int]:
+    """Start the stub in its own process so it does not compete for the GIL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=lambda: asyncio.run(serve_stub(port, latency, ready)), daemon=True
+    )
+    process.start()
+    ready.wait()
+    return process, port
+
+
+def run_sync(requests: int, concurrency: int) -> float:
+    client = llm.LLMClient("sk-stub")
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        futures = [
+            executor.submit(client, SCHEMA, "text", None, None) for _ in range(requests)
+        ]
+        for future in futures:
+            future.result()
+    return requests / (time.perf_counter() - start)
+
+
+async def run_async(requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract(client: llm.AsyncLLMClient) -> dict:
+        async with semaphore:
+            return await client(SCHEMA, "text", None, None)
+
+    async with llm.AsyncLLMClient("sk-stub", max_connections=concurrency) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(extract(client) for _ in range(requests)))
+        return requests / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    process, port = start_stub(args.latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+
+    print(f"stub latency {args.latency * 1000:.0f} ms, {args.rounds} rounds")
+    print(f"{'concurrency':<12}{'sync/s':>10}{'async/s':>10}")
+    for concurrency in args.concurrency:
+        requests = concurrency * args.rounds
+        sync = run_sync(requests, concurrency)
+        asynchronous = asyncio.run(run_async(requests, concurrency))
+        print(f"{concurrency:<12}{sync:>10.1f}{asynchronous:>10.1f}")
+    process.terminate()
+
+
+if __name__ == "__main__":
+    main()
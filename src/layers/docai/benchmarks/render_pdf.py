@@ -0,0 +1,55 @@
+"""Benchmark PDF page rendering throughput for different worker counts.
+
+The sample PDFs are one or two pages long, so each one is repeated into a longer
+document before rendering.
+
+Usage:
+    poetry run python benchmarks/render_pdf.py --pages 24 --workers 1 2 4 6
+"""
+import argparse
+import base64
+import time
+from pathlib import Path
+
+import fitz
+
+from docai import stream
+
+SAMPLES = Path(__file__).parents[4] / "samples" / "media"
+
+
+def build_document(path: Path, pages: int) -> str:
+    """Repeat the pages of the sample until the document has `pages` pages."""
+    source = fitz.open(path)
+    document = fitz.open()
+    while len(document) < pages:
+        document.insert_pdf(source, to_page=min(len(source), pages - len(document)) - 1)
+    return base64.b64encode(document.tobytes()).decode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 6])
+    args = parser.parse_args()
+
+    print(
+        f"{'document':<16}{'workers':>8}{'seconds':>10}{'pages/sec':>12}{'speedup':>10}"
+    )
+    for path in sorted(SAMPLES.glob("*.pdf")):
+        data = build_document(path, args.pages)
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            for _ in stream.iter_pdf(data, workers=workers):
+                pass
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                f"{path.name:<16}{workers:>8}{elapsed:>10.2f}"
+                f"{args.pages / elapsed:>12.2f}{baseline / elapsed:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark the compiled validators against building a jsonschema validator per call.
+
+Uses the schema definitions of the Postman collection, with a valid output built
+from each schema in place of a model response.
+
+Usage:
+    poetry run python benchmarks/validators.py
+"""
+import argparse
+import decimal
+import json
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from jsonschema import Draft202012Validator
+
+from docai import validators
+
+COLLECTION = Path(__file__).parents[4] / "postman" / "docai.postman_collection.json"
+
+
+def collection_schemas(item: Any) -> Iterator[tuple[str, dict]]:
+    """Yield the name and schema definition of every create schema request"""
+    if isinstance(item, list):
+        for value in item:
+            yield from collection_schemas(value)
+    elif isinstance(item, dict):
+        raw = (item.get("request") or {}).get("body", {}).get("raw", "")
+        if "schema_definition" in raw:
+            yield item["name"], json.loads(raw)["schema_definition"]
+        for value in item.values():
+            yield from collection_schemas(value)
+
+
+def example(schema: Any, root: dict) -> Any:
+    """Build a valid instance of a schema"""
+    if not isinstance(schema, dict):
+        return None
+    if "$ref" in schema:
+        target = root
+        for token in schema["$ref"][2:].split("/"):
+            target = target[token]
+        return example(target, root)
+    if "allOf" in schema:
+        data: dict = {}
+        for branch in schema["allOf"]:
+            data.update(example(branch, root) or {})
+        return data
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "object")
+    kind = kind if isinstance(kind, str) else [k for k in kind if k != "null"][0]
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: example(value, root) for name, value in properties.items()}
+    if kind == "array":
+        return [example(schema.get("items", {}), root) for _ in range(3)]
+    return {
+        "string": "value",
+        "integer": 7,
+        "number": decimal.Decimal("12.5"),
+        "boolean": True,
+    }.get(kind)
+
+
+def timeit(fn: Any, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    collection = json.loads(COLLECTION.read_text())
+    print(
+        f"{'schema':<28}{'compiled':>9}{'compile us':>12}"
+        f"{'per call us':>13}{'cached us':>11}{'speedup':>9}"
+    )
+    for name, schema in collection_schemas(collection):
+        data = example(schema, schema)
+        start = time.perf_counter()
+        validator = validators.SchemaValidator(schema)
+        compile_time = (time.perf_counter() - start) * 1e6
+        assert not validator.errors(data), validator.errors(data)
+
+        baseline = timeit(lambda: Draft202012Validator(schema).validate(data), 50)
+        # Keyed by name like the schema versions of the schema cache
+        cached = timeit(
+            lambda: validators.get_validator(schema, name).validate(data), args.repeat
+        )
+        print(
+            f"{name:<28}{str(validator.compiled):>9}{compile_time:>12.0f}"
+            f"{baseline:>13.1f}{cached:>11.1f}{baseline / cached:>8.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import functools
+import re
+from typing import NamedTuple
+
+from docai import constants as c
+from docai import encoding
+from docai import exceptions as exc
+from docai import telemetry, utils
+
+# Tokens of an image sent at the largest size the vision model accepts
+MAX_IMAGE_TOKENS = encoding.image_tokens(
+    c.VISION_MAX_SHORT_EDGE, c.VISION_MAX_LONG_EDGE
+)
+# Tokens the API adds around every message
+MESSAGE_TOKENS = 4
+TRUNCATION_MARKER = "\n[... content truncated to fit the context window ...]"
+SPACES = re.compile(r"[ \t\f\v]+")
+BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+class Estimate(NamedTuple):
+    """The tokens of an extraction request, estimated before it is sent"""
+
+    context_window: int
+    system_tokens: int
+    schema_tokens: int
+    text_tokens: int
+    image_tokens: int
+    output_tokens: int
+
+    @property
+    def prompt_tokens(self) -> int:
+        return (
+            self.system_tokens
+            + self.schema_tokens
+            + self.text_tokens
+            + self.image_tokens
+        )
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens
+
+    def metadata(self) -> dict:
+        return dict(
+            **self._asdict(),
+            prompt_tokens=self.prompt_tokens,
+            total_tokens=self.total_tokens,
+        )
+
+
+def context_window(model: str) -> int:
+    """Return the context window of a model, matched by the longest name prefix"""
+    for prefix in sorted(c.CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return c.CONTEXT_WINDOWS[prefix]
+    return c.DEFAULT_CONTEXT_WINDOW
+
+
+@functools.cache
+def system_tokens() -> int:
+    """Tokens of the system message and of the instructions around the content"""
+    template = c.USER_INSTRUCTIONS_FORMAT.format(schema="", content="")
+    return (
+        utils.count_tokens(c.SYSTEM_MESSAGE)
+        + utils.count_tokens(template)
+        + 2 * MESSAGE_TOKENS
+    )
+
+
+def compress(text: str) -> str:
+    """Collapse runs of spaces and blank lines, which cost tokens but no content"""
+    return BLANK_LINES.sub("\n\n", SPACES.sub(" ", text)).strip()
+
+
+def truncate(text: str, tokens: int) -> str:
+    """Return the longest prefix of the text within `tokens`, marked as truncated"""
+    tokens -= utils.count_tokens(TRUNCATION_MARKER)
+    return utils.decode(utils.encode(text)[: max(tokens, 0)]) + TRUNCATION_MARKER
+
+
+def preflight(
+    schema_definition: dict, text_data: str, images: int, model: str
+) -> tuple[str, Estimate]:
+    """Fit an extraction request into the context window of the model.
+
+    Estimates the tokens of the request before anything is sent. Text that does not
+    fit is compressed and then, depending on `PROMPT_OVERFLOW`, truncated or the
+    request is rejected. Returns the text to send and the estimate.
+    """
+    estimate = Estimate(
+        context_window=context_window(model),
+        system_tokens=system_tokens(),
+        schema_tokens=utils.count_tokens(str(schema_definition)),
+        text_tokens=utils.count_tokens(text_data) if text_data else 0,
+        image_tokens=images * MAX_IMAGE_TOKENS,
+        output_tokens=int(c.MAX_OUTPUT_TOKENS),
+    )
+    if estimate.total_tokens <= estimate.context_window:
+        return text_data, estimate
+
+    text_data = compress(text_data)
+    estimate = estimate._replace(text_tokens=utils.count_tokens(text_data))
+    overflow = estimate.total_tokens - estimate.context_window
+    if overflow <= 0:
+        telemetry.add_count("PromptCompressed")
+        return text_data, estimate
+
+    available = estimate.text_tokens - overflow
+    if c.PROMPT_OVERFLOW != "truncate" or available < c.MIN_TEXT_TOKENS:
+        telemetry.add_count("PromptRejected")
+        raise exc.PromptTooLarge(
+            f"The request needs about {estimate.total_tokens} tokens, more than the "
+            f"{estimate.context_window} of the model."
+        )
+    text_data = truncate(text_data, available)
+    telemetry.add_count("PromptTruncated")
+    return text_data, estimate._replace(text_tokens=utils.count_tokens(text_data))
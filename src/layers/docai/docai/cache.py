@@ -0,0 +1,58 @@
+import time
+
+import boto3
+
+from docai import constants as c
+from docai import utils
+
+
+def result_key(schema: dict, document: dict) -> str:
+    """Return the cache key of the extraction result for a document and schema.
+
+    Extraction is reproducible (fixed seed and zero temperature), so the result only
+    depends on the document, the schema version, the models, the prompt templates,
+    the encoding of the pages, the selection of the pages and how documents are split
+    into chunks.
+    """
+    profile = (
+        document.get("encoding_profile")
+        or schema.get("encoding_profile")
+        or c.ENCODING_PROFILE
+    )
+    return utils.content_hash(
+        document["content"],
+        document["mime_type"],
+        schema["schema_name"],
+        schema["schema_version"],
+        c.TEXT_MODEL,
+        c.VISION_MODEL,
+        c.PROMPT_VERSION,
+        profile,
+        f"{c.PAGE_SELECTION}:{c.PAGE_SELECTION_TOP_K}",
+        f"{c.CHUNKING}:{c.CHUNK_PAGES}:{c.CHUNK_TOKENS}",
+    )
+
+
+class ResultCache:
+    def __init__(self, table: boto3.resource, ttl: int = c.RESULT_CACHE_TTL) -> None:
+        self.__table = table
+        self.__ttl = ttl
+
+    def get(self, cache_key: str) -> dict | None:
+        """Get a cached extraction result"""
+        item = self.__table.get_item(Key=dict(cache_key=cache_key)).get("Item")
+        # DynamoDB deletes expired items lazily, so they can still be returned
+        if not item or item["expires_at"] <= int(time.time()):
+            return None
+        return dict(result=item["result"], metadata=item["metadata"])
+
+    def put(self, cache_key: str, data: dict) -> None:
+        """Cache an extraction result"""
+        item = dict(
+            cache_key=cache_key,
+            result=data["result"],
+            metadata=data["metadata"],
+            created_at=utils.utcnow(),
+            expires_at=int(time.time()) + self.__ttl,
+        )
+        self.__table.put_item(Item=item)
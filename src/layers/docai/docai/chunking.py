@@ -0,0 +1,188 @@
+import json
+import re
+from typing import Any, NamedTuple
+
+from docai import budget
+from docai import constants as c
+from docai import stream, telemetry, utils, validators
+
+PAGE_HEADER = re.compile(r"^## Page \d+\n\n", re.MULTILINE)
+PARAGRAPH = "\n\n"
+
+
+class Chunk(NamedTuple):
+    """A part of a document extracted on its own"""
+
+    text_data: str
+    image_list: list[str]
+    pages: int
+
+    @property
+    def tokens(self) -> int:
+        return (
+            utils.count_tokens(self.text_data)
+            + len(self.image_list) * budget.MAX_IMAGE_TOKENS
+        )
+
+
+def units(text_data: str, image_list: list[str]) -> list[Chunk]:
+    """Split a document into the smallest parts a chunk is made of.
+
+    Those are the pages of a PDF, each with its image when it is sent as one, and
+    the paragraphs of a text document.
+    """
+    headers = list(PAGE_HEADER.finditer(text_data))
+    if not headers:
+        if not text_data.strip():  # pages sent as images only
+            return [Chunk("", [key], 1) for key in image_list]
+        paragraphs = [Chunk(p, [], 0) for p in text_data.split(PARAGRAPH) if p.strip()]
+        if image_list:
+            paragraphs[0] = paragraphs[0]._replace(image_list=image_list)
+        return paragraphs
+
+    images = iter(image_list)
+    pages = []
+    for header, end in zip(headers, [*headers[1:], None]):
+        text = text_data[header.start() : end.start() if end else None].rstrip()
+        image = None
+        if text_data[header.end() :].startswith(stream.IMAGE_PAGE):
+            image = next(images, None)
+        pages.append(Chunk(text, [image] if image else [], 1))
+    # Images with no page in the text cannot be placed, the first chunk gets them
+    pages[0] = pages[0]._replace(image_list=[*pages[0].image_list, *images])
+    return pages
+
+
+def join(parts: list[Chunk]) -> Chunk:
+    return Chunk(
+        PARAGRAPH.join(part.text_data for part in parts if part.text_data),
+        [key for part in parts for key in part.image_list],
+        sum(part.pages for part in parts),
+    )
+
+
+def split(
+    text_data: str,
+    image_list: list[str],
+    max_pages: int = c.CHUNK_PAGES,
+    max_tokens: int = c.CHUNK_TOKENS,
+) -> list[Chunk]:
+    """Split a document into chunks of at most `max_pages` pages and `max_tokens`.
+
+    A page or paragraph larger than `max_tokens` is a chunk of its own. A document
+    that fits in one chunk is returned unchanged.
+    """
+    parts = units(text_data, image_list)
+    if not c.CHUNKING or not parts:
+        return [Chunk(text_data, image_list, len(parts))]
+
+    chunks: list[Chunk] = []
+    current: list[Chunk] = []
+    pages = tokens = 0
+    for part in parts:
+        cost = part.tokens
+        if current and (pages + part.pages > max_pages or tokens + cost > max_tokens):
+            chunks.append(join(current))
+            current, pages, tokens = [], 0, 0
+        current.append(part)
+        pages += part.pages
+        tokens += cost
+    chunks.append(join(current))
+
+    if len(chunks) == 1:
+        return [Chunk(text_data, image_list, chunks[0].pages)]
+    return [
+        chunk._replace(
+            text_data=c.CHUNK_NOTE_FORMAT.format(part=i, parts=len(chunks))
+            + chunk.text_data
+        )
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+
+
+def _resolve(schema: Any, root: dict) -> Any:
+    while isinstance(schema, dict) and isinstance(schema.get("$ref"), str):
+        target: Any = root
+        for token in filter(None, schema["$ref"].lstrip("#").split("/")):
+            target = target.get(token.replace("~1", "/").replace("~0", "~"), {})
+        schema = target
+    return schema
+
+
+def _properties(schema: Any, root: dict) -> dict:
+    schema = _resolve(schema, root)
+    if not isinstance(schema, dict):
+        return {}
+    properties = dict(schema.get("properties", {}))
+    for branch in schema.get("allOf", []):
+        properties.update(_properties(branch, root))
+    return properties
+
+
+def _key(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def merge(values: list[Any], schema: Any, root: dict) -> Any:
+    """Merge the values a field was extracted with from each chunk.
+
+    Objects are merged by property, arrays concatenated without their duplicates,
+    and any other value is the first that is not null.
+    """
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    if all(isinstance(value, dict) for value in values):
+        properties = _properties(schema, root)
+        names = list(dict.fromkeys(name for value in values for name in value))
+        return {
+            name: merge(
+                [value[name] for value in values if name in value],
+                properties.get(name),
+                root,
+            )
+            for name in names
+        }
+    if all(isinstance(value, list) for value in values):
+        seen, items = set(), []
+        for item in (item for value in values for item in value):
+            key = _key(item)
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+        return items
+    return values[0]
+
+
+def combine(
+    schema_definition: dict,
+    extractions: list[dict],
+    validator: validators.SchemaValidator | None = None,
+) -> dict:
+    """Combine the extractions of the chunks of a document into one.
+
+    The merged result is validated again, as merging can break constraints that
+    held for every chunk, like the size of an array.
+    """
+    result = merge(
+        [data["result"] for data in extractions], schema_definition, schema_definition
+    )
+    validator = validator or validators.get_validator(schema_definition)
+    validator.validate(result)
+
+    metadata: dict[str, Any] = {"chunks": len(extractions)}
+    for data in extractions:
+        for name, value in data["metadata"].items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                metadata[name] = metadata.get(name, 0) + value
+    telemetry.add_count("ChunkedExtractions")
+    telemetry.add_count("ExtractionChunks", len(extractions))
+    return {
+        # The messages of every chunk repeat the schema and add up to the whole
+        # document, so the request of the first chunk stands for the others
+        "request": {**extractions[0]["request"], "chunks": len(extractions)},
+        "images": {k: v for data in extractions for k, v in data["images"].items()},
+        "error": None,
+        "result": result,
+        "metadata": metadata,
+    }
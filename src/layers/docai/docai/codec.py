@@ -0,0 +1,114 @@
+import decimal
+import json
+import re
+from typing import Any
+
+from docai import constants as c
+from docai import exceptions as exc
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+FENCE = "```"
+# Only braces followed by a key or a closing brace can start an object, skipping the
+# others is cheap while a failed decode formats an error with its line number
+OBJECT_START = re.compile(r'\{\s*["}]')
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class StdlibCodec:
+    name = "stdlib"
+
+    def __init__(self) -> None:
+        self.decoder = json.JSONDecoder(strict=False, parse_float=decimal.Decimal)
+
+    def loads(self, data: str | bytes) -> Any:
+        """Parse JSON, with numbers that have a fraction or exponent as Decimal"""
+        if isinstance(data, bytes):
+            data = data.decode()
+        return self.decoder.decode(data)
+
+    def decode_object(self, text: str, begin: int, end: int) -> Any:
+        """Parse the JSON value starting at `begin`, ignoring any text after it"""
+        value, stop = self.decoder.raw_decode(text, begin)
+        if stop > end:
+            raise ValueError("The JSON value overruns its code block")
+        return value
+
+    def dumps(self, value: Any) -> str:
+        """Serialize to compact JSON, with Decimal numbers as numbers"""
+        return json.dumps(value, separators=(",", ":"), default=_default)
+
+
+class OrjsonCodec(StdlibCodec):
+    """Serializes with orjson.
+
+    orjson has no `parse_float`, and converting its floats to Decimal afterwards is
+    slower than the stdlib parser, so parsing stays with the stdlib.
+    """
+
+    name = "orjson"
+
+    def dumps(self, value: Any) -> str:
+        return orjson.dumps(value, default=_default).decode()
+
+
+def get_codec(name: str = c.JSON_CODEC) -> StdlibCodec:
+    """Return the JSON codec with the given name, `auto` prefers orjson if installed"""
+    if name == "orjson" or (name == "auto" and orjson is not None):
+        if orjson is None:
+            raise ImportError("The orjson codec requires the orjson package")
+        return OrjsonCodec()
+    return StdlibCodec()
+
+
+codec = get_codec()
+
+
+def loads(data: str | bytes) -> Any:
+    """Parse JSON with the configured codec"""
+    return codec.loads(data)
+
+
+def dumps(value: Any) -> str:
+    """Serialize to JSON with the configured codec"""
+    return codec.dumps(value)
+
+
+def _fenced_spans(text: str) -> list[tuple[int, int]]:
+    spans = []
+    start = text.find(FENCE)
+    while start != -1:
+        body = text.find("\n", start)
+        close = text.find(FENCE, body) if body != -1 else -1
+        if close == -1:
+            break
+        spans.append((body + 1, close))
+        start = text.find(FENCE, close + len(FENCE))
+    return spans
+
+
+def extract_json(text: str) -> Any:
+    """Extract the first JSON object from a model response.
+
+    Objects inside fenced code blocks are preferred over objects in the prose around
+    them. Each candidate is decoded in place, so the object ends where the parser
+    stops rather than at the last brace of the response.
+    """
+    for start, end in [*_fenced_spans(text), (0, len(text))]:
+        candidate = OBJECT_START.search(text, start, end)
+        while candidate:
+            try:
+                return codec.decode_object(text, candidate.start(), end)
+            except ValueError:
+                candidate = OBJECT_START.search(text, candidate.start() + 1, end)
+    raise exc.InvalidData("No JSON object found in the output")
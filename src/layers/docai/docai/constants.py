@@ -1,8 +1,11 @@
 import os
+from typing import Any
 
 # Environment parameters
 STAGE = os.environ.get("STAGE", "dev")
 AWS_REGION = os.environ.get("AWS_DEFAULT_REGION", "ca-central-1")
+# Seconds kept at the end of an invocation to record the outcome of a request
+DEADLINE_MARGIN = float(os.environ.get("DEADLINE_MARGIN", 10))
 
 # OpenAI parameters
 SEED = 43
@@ -11,6 +14,142 @@ TEXT_MODEL = os.environ.get("TEXT_MODEL", "gpt-4-turbo")
 VISION_MODEL = os.environ.get("VISION_MODEL", "gpt-4-turbo")
 SCHEMA_TOKEN_LIMIT = os.environ.get("SCHEMA_TOKEN_LIMIT", 2048)
 MAX_OUTPUT_TOKENS = os.environ.get("SCHEMA_TOKEN_LIMIT", 4096)
+# Context windows in tokens by model name prefix, the longest matching prefix wins
+CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get("DEFAULT_CONTEXT_WINDOW", 128000))
+# Requests that do not fit the context window are `truncate`d or `reject`ed
+PROMPT_OVERFLOW = os.environ.get("PROMPT_OVERFLOW", "truncate")
+MIN_TEXT_TOKENS = int(os.environ.get("MIN_TEXT_TOKENS", 1024))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 180))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 64))
+OPENAI_POOL_SIZE = int(os.environ.get("OPENAI_POOL_SIZE", 16))
+
+# How the output of the model is constrained to the schema, `json_schema` has the API
+# enforce it (structured outputs), `prompt` only asks for it and `auto` picks the
+# former for the models that support it
+RESPONSE_FORMAT = os.environ.get("RESPONSE_FORMAT", "auto")
+STRUCTURED_OUTPUT_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+STRUCTURED_OUTPUT_EXCLUDED_MODELS = ("gpt-4o-2024-05-13", "o1-mini", "o1-preview")
+
+# Retries of the calls to the OpenAI API that failed on the transport, within a total
+# timeout per extraction that leaves time to record a failure before the Lambda one
+OPENAI_RETRY_ATTEMPTS = int(os.environ.get("OPENAI_RETRY_ATTEMPTS", 5))
+OPENAI_RETRY_BASE_DELAY = float(os.environ.get("OPENAI_RETRY_BASE_DELAY", 1))
+OPENAI_RETRY_MAX_DELAY = float(os.environ.get("OPENAI_RETRY_MAX_DELAY", 30))
+OPENAI_RETRY_TIMEOUT = float(os.environ.get("OPENAI_RETRY_TIMEOUT", 240))
+OPENAI_MIN_ATTEMPT_TIME = float(os.environ.get("OPENAI_MIN_ATTEMPT_TIME", 10))
+
+# Rate limits of the OpenAI API shared by all the functions, 0 disables a limit
+RATE_LIMIT_RPM = int(os.environ.get("RATE_LIMIT_RPM", 500))
+RATE_LIMIT_TPM = int(os.environ.get("RATE_LIMIT_TPM", 300000))
+RATE_LIMIT_ATTEMPTS = 8
+RATE_LIMIT_TTL = 60 * 60
+
+# Bump whenever the prompt templates below change, it is part of the result cache key
+PROMPT_VERSION = "3"
+
+# JSON codec for model outputs, `auto` uses orjson when it is installed
+JSON_CODEC = os.environ.get("JSON_CODEC", "auto")
+
+# Result cache parameters
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 60 * 60))
+
+# Schema cache parameters
+SCHEMA_CACHE_SIZE = int(os.environ.get("SCHEMA_CACHE_SIZE", 128))
+SCHEMA_CACHE_TTL = int(os.environ.get("SCHEMA_CACHE_TTL", 300))
+
+# Batch run parameters, the SQS records of one invocation extracted concurrently
+BATCH_RUN_CONCURRENCY = int(os.environ.get("BATCH_RUN_CONCURRENCY", 4))
+# Deliveries of a batch record before it is dead-lettered, set by the queues stack
+BATCH_MAX_RECEIVE_COUNT = int(os.environ.get("BATCH_MAX_RECEIVE_COUNT", 3))
+
+# Bulk extraction parameters
+BULK_MAX_DOCUMENTS = int(os.environ.get("BULK_MAX_DOCUMENTS", 1000))
+BULK_SEND_ATTEMPTS = 3
+BULK_SEND_BASE_DELAY = 0.1  # seconds, the most a retry waits doubles each attempt
+BULK_SEND_CONCURRENCY = int(os.environ.get("BULK_SEND_CONCURRENCY", 8))
+SQS_BATCH_SIZE = 10  # the most messages send_message_batch accepts per call
+
+# Page pipeline parameters
+PAGE_WINDOW = int(os.environ.get("PAGE_WINDOW", 4))
+# Threads uploading pages, shared by the requests of a process. The S3 client keeps a
+# connection for each and one for each request, S3 throttling is retried adaptively
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 16))
+S3_MAX_POOL_CONNECTIONS = UPLOAD_WORKERS + BATCH_RUN_CONCURRENCY
+S3_MAX_ATTEMPTS = int(os.environ.get("S3_MAX_ATTEMPTS", 5))
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", 0))  # 0 derives it from the CPUs
+# Pages each render worker gets at least, smaller documents are rendered serially
+MIN_PAGES_PER_WORKER = int(os.environ.get("MIN_PAGES_PER_WORKER", 4))
+
+# Inline image parameters. Page images of synchronous requests of at most
+# `INLINE_IMAGE_MAX_BYTES` are sent in the request as data URLs, rather than uploaded
+# to S3 for the API to fetch, up to `INLINE_IMAGES_MAX_BYTES` per document. Larger
+# pages and queued requests go through S3, `INLINE_IMAGE_MAX_BYTES=0` sends all there
+INLINE_IMAGE_MAX_BYTES = int(os.environ.get("INLINE_IMAGE_MAX_BYTES", 512 * 1024))
+INLINE_IMAGES_MAX_BYTES = int(
+    os.environ.get("INLINE_IMAGES_MAX_BYTES", 8 * 1024 * 1024)
+)
+
+# Page selection parameters. The pages of long PDFs are ranked by the terms of the
+# schema found in their text layer, and only the `PAGE_SELECTION_TOP_K` best and the
+# first page are sent, all of them again when the extraction finds nothing valid
+PAGE_SELECTION = os.environ.get("PAGE_SELECTION", "true").lower() == "true"
+PAGE_SELECTION_TOP_K = int(os.environ.get("PAGE_SELECTION_TOP_K", 4))
+
+# Chunked extraction parameters. Documents larger than a chunk of `CHUNK_PAGES` pages
+# and `CHUNK_TOKENS` tokens are split into chunks extracted concurrently and merged,
+# `CHUNKING=false` sends every document in one request
+CHUNKING = os.environ.get("CHUNKING", "true").lower() == "true"
+CHUNK_PAGES = int(os.environ.get("CHUNK_PAGES", 10))
+CHUNK_TOKENS = int(os.environ.get("CHUNK_TOKENS", 24000))
+CHUNK_CONCURRENCY = int(os.environ.get("CHUNK_CONCURRENCY", 8))
+
+# Page image encoding parameters. The vision model fits images within 2048x2048 and
+# then scales the shortest side down to 768 before cutting them into 512px tiles, so
+# pixels beyond those limits only cost bytes and upload time.
+VISION_TILE_SIZE = 512
+VISION_MAX_LONG_EDGE = 2048
+VISION_MAX_SHORT_EDGE = 768
+ENCODING_PROFILE = os.environ.get("ENCODING_PROFILE", "standard")
+ENCODING_PROFILES: dict[str, dict[str, Any]] = {
+    "legacy": {"dpi": 300, "image_format": "png"},
+    "standard": {
+        "dpi": 150,
+        "max_long_edge": VISION_MAX_LONG_EDGE,
+        "max_short_edge": VISION_MAX_SHORT_EDGE,
+        "image_format": "jpeg",
+        "quality": 85,
+    },
+    "lossless": {
+        "dpi": 150,
+        "max_long_edge": VISION_MAX_LONG_EDGE,
+        "max_short_edge": VISION_MAX_SHORT_EDGE,
+        "image_format": "png",
+    },
+    "compact": {
+        "dpi": 150,
+        "max_long_edge": VISION_MAX_LONG_EDGE,
+        "max_short_edge": VISION_MAX_SHORT_EDGE,
+        "image_format": "jpeg",
+        "quality": 70,
+        "grayscale": True,
+    },
+}
+
+# PDF text layer parameters
+PDF_TEXT_LAYER = os.environ.get("PDF_TEXT_LAYER", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.environ.get("TEXT_LAYER_MIN_CHARS", 64))
+TEXT_LAYER_MIN_QUALITY = float(os.environ.get("TEXT_LAYER_MIN_QUALITY", 0.9))
 
 
 # Prompt templates
@@ -145,3 +284,33 @@ Schema:
 Content:
 {content}
 """
+
+CHUNK_NOTE_FORMAT = """
+(This is part {part} of {parts} of the document. Extract the fields found in this part
+and use null for the others, they are extracted from the other parts.)
+
+"""
+
+CORRECTION_SYSTEM_MESSAGE = """
+You correct JSON objects extracted from documents so that they match their JSON
+schema. Respond with the complete corrected JSON object only, in a ```json code block.
+"""
+
+CORRECTION_FORMAT = """
+The JSON object below does not match its schema.
+
+Errors:
+{errors}
+
+Schema of the failing fields:
+```json
+{fragments}
+```
+
+JSON object:
+```json
+{output}
+```
+
+Return the complete corrected JSON object, changing only the failing fields.
+"""
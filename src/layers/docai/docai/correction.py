@@ -0,0 +1,104 @@
+import ast
+import json
+import re
+from typing import Any
+
+from docai import codec
+from docai import constants as c
+from docai import telemetry, validators
+
+# Errors about the shape of a value, which the model can fix from its previous output
+# alone. Any other error may need a value read again from the document.
+SHAPE_ERRORS = ("is not of type", "additional properties are not allowed")
+# The compiled validators quote the property as JSON, jsonschema with repr
+REQUIRED = re.compile(r"""^(".*"|'.*') is a required property$""")
+
+
+def needs_source(errors: list[validators.ValidationIssue]) -> bool:
+    """Whether correcting the errors needs the document sent again"""
+    if not errors:  # the output was not a JSON object at all
+        return True
+    return not all(
+        any(shape in error.message for shape in SHAPE_ERRORS) for error in errors
+    )
+
+
+def _resolve(schema: Any, root: dict) -> Any:
+    while isinstance(schema, dict) and isinstance(schema.get("$ref"), str):
+        target: Any = root
+        for token in filter(None, schema["$ref"].lstrip("#").split("/")):
+            target = target.get(token.replace("~1", "/").replace("~0", "~"), {})
+        schema = target
+    return schema
+
+
+def _child(schema: Any, part: str | int, root: dict) -> Any:
+    schema = _resolve(schema, root)
+    if not isinstance(schema, dict):
+        return None
+    if isinstance(part, int):
+        return schema.get("items")
+    for branch in [schema, *schema.get("allOf", [])]:
+        branch = _resolve(branch, root)
+        if isinstance(branch, dict) and part in branch.get("properties", {}):
+            return branch["properties"][part]
+    return None
+
+
+def fragments(
+    schema_definition: dict, errors: list[validators.ValidationIssue]
+) -> dict[str, Any]:
+    """Return the schema of each failing field by its path"""
+    found: dict[str, Any] = {}
+    for error in errors:
+        parts = error.parts
+        required = REQUIRED.match(error.message)
+        if required:
+            # Reported on the object, the fragment needed is the missing property's
+            name = required.group(1)
+            name = json.loads(name) if name[0] == '"' else ast.literal_eval(name)
+            parts = (*parts, name)
+        schema: Any = schema_definition
+        for part in parts:
+            schema = _child(schema, part, schema_definition)
+        schema = _resolve(schema, schema_definition)
+        if schema is not None:
+            found[validators.format_path(parts)] = schema
+    return found
+
+
+def build_messages(
+    schema_definition: dict,
+    output: str,
+    error: Exception,
+    text_data: str,
+    images: dict[str, str],
+) -> list[dict]:
+    """Build the messages asking the model to correct an invalid output.
+
+    Rather than the whole conversation, only the errors, the schema of the failing
+    fields and the previous output are sent, with the document only when the errors
+    may need values read from it again.
+    """
+    errors = getattr(error, "errors", None) or []
+    text = c.CORRECTION_FORMAT.format(
+        errors=validators.format_errors(errors) if errors else f"- {error}",
+        fragments=codec.dumps(fragments(schema_definition, errors)),
+        output=output,
+    )
+    content: list[dict[str, Any]] = [{"type": "text", "text": text}]
+
+    source = needs_source(errors)
+    telemetry.add_count("CorrectionWithSource" if source else "CorrectionWithoutSource")
+    if source:
+        document = c.USER_INSTRUCTIONS_FORMAT.format(
+            schema=schema_definition, content=text_data
+        )
+        content.append({"type": "text", "text": document})
+        for url in images.values():
+            content.append({"type": "image_url", "image_url": {"url": url}})
+
+    return [
+        {"role": "system", "content": c.CORRECTION_SYSTEM_MESSAGE},
+        {"role": "user", "content": content},
+    ]
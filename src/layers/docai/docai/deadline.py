@@ -0,0 +1,54 @@
+import time
+from typing import Any
+
+from docai import constants as c
+from docai import exceptions as exc
+
+
+class Deadline:
+    """The time a request must be done by, on the `time.monotonic` clock.
+
+    Handlers derive it from the Lambda context and pass it down the pipeline, so each
+    stage can size its timeouts and skip work that cannot finish in time, leaving
+    enough time to record the outcome of the request.
+    """
+
+    def __init__(self, expires_at: float) -> None:
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    @classmethod
+    def from_context(
+        cls, context: Any, margin: float = c.DEADLINE_MARGIN
+    ) -> "Deadline":
+        """Return the deadline of a Lambda invocation, `margin` seconds before it ends"""
+        remaining = context.get_remaining_time_in_millis() / 1000
+        return cls.after(remaining - margin)
+
+    def remaining(self) -> float:
+        """Return the seconds left, negative once the deadline has passed"""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str, needed: float = 0) -> None:
+        """Raise if there is not `needed` seconds left to run a stage"""
+        if self.remaining() <= needed:
+            raise exc.DeadlineExceeded(f"Deadline exceeded before {stage}.")
+
+    def earliest(self, other: "Deadline | None") -> "Deadline":
+        if other is None or self.expires_at <= other.expires_at:
+            return self
+        return other
+
+
+def is_timeout(error: Exception, deadline: Deadline | None) -> bool:
+    """Whether a request failed for running out of time"""
+    if isinstance(error, exc.DeadlineExceeded):
+        return True
+    return deadline is not None and deadline.expired
@@ -0,0 +1,70 @@
+import math
+from typing import TYPE_CHECKING
+
+from docai import constants as c
+from docai import exceptions as exc
+from docai import models
+
+if TYPE_CHECKING:
+    import fitz
+
+POINTS_PER_INCH = 72
+TILE_SLACK = 0.1  # fraction of a tile an edge may spill over before it is snapped back
+
+
+def get_profile(name: str | None = None) -> models.EncodingProfile:
+    """Return the encoding profile with the given name, or the default profile."""
+    name = name or c.ENCODING_PROFILE
+    if name not in c.ENCODING_PROFILES:
+        raise exc.InvalidEncodingProfile(f"Invalid encoding profile {name}")
+    return models.EncodingProfile(**c.ENCODING_PROFILES[name])
+
+
+def resolve_profile(schema: dict, document: dict) -> models.EncodingProfile:
+    """Return the profile requested for the document, then the schema's, then the default."""
+    return get_profile(
+        document.get("encoding_profile") or schema.get("encoding_profile")
+    )
+
+
+def page_scale(profile: models.EncodingProfile, width: float, height: float) -> float:
+    """Return the scale that renders a page of the given size in points for the profile."""
+    long_edge, short_edge = max(width, height), min(width, height)
+    scale = profile.dpi / POINTS_PER_INCH
+    if profile.max_long_edge:
+        scale = min(scale, profile.max_long_edge / long_edge)
+    if profile.max_short_edge:
+        scale = min(scale, profile.max_short_edge / short_edge)
+    if profile.max_long_edge or profile.max_short_edge:
+        # An edge that spills just past a tile boundary costs a whole extra tile,
+        # so snap it back onto the boundary
+        for edge in (long_edge, short_edge):
+            tiles = edge * scale / c.VISION_TILE_SIZE
+            if tiles > 1 and tiles - math.floor(tiles) < TILE_SLACK:
+                scale = min(scale, math.floor(tiles) * c.VISION_TILE_SIZE / edge)
+    return scale
+
+
+def render_page(page: "fitz.Page", profile: models.EncodingProfile) -> bytes:
+    """Render a PDF page into an image using the profile."""
+    import fitz
+
+    scale = page_scale(profile, page.rect.width, page.rect.height)
+    colorspace = fitz.csGRAY if profile.grayscale else fitz.csRGB
+    pixmap = page.get_pixmap(
+        matrix=fitz.Matrix(scale, scale), colorspace=colorspace, alpha=False
+    )
+    if profile.image_format == models.ImageFormat.JPEG:
+        return pixmap.tobytes(output="jpg", jpg_quality=profile.quality)
+    return pixmap.tobytes(output="png")
+
+
+def image_tokens(width: int, height: int) -> int:
+    """Estimate the prompt tokens the vision model charges for an image of the given size."""
+    scale = min(1.0, c.VISION_MAX_LONG_EDGE / max(width, height))
+    width, height = int(width * scale), int(height * scale)
+    scale = min(1.0, c.VISION_MAX_SHORT_EDGE / min(width, height))
+    width, height = int(width * scale), int(height * scale)
+    columns = math.ceil(width / c.VISION_TILE_SIZE)
+    rows = math.ceil(height / c.VISION_TILE_SIZE)
+    return 85 + 170 * columns * rows
@@ -22,7 +22,28 @@ class InvalidMimeType(Exception):
 
 
 class InvalidData(Exception):
-    def __init__(self, message="Invalid data."):
+    def __init__(self, message="Invalid data.", errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class InvalidEncodingProfile(Exception):
+    def __init__(self, message="Invalid encoding profile."):
+        super().__init__(message)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, message="Deadline exceeded."):
+        super().__init__(message)
+
+
+class PromptTooLarge(Exception):
+    def __init__(self, message="Document is too large for the model."):
+        super().__init__(message)
+
+
+class ManifestDoesNotExist(Exception):
+    def __init__(self, message="Rendered pages of the document have expired."):
         super().__init__(message)
 
 
@@ -31,11 +52,19 @@ class RequestDoesNotExist(Exception):
         super().__init__(message)
 
 
+class JobDoesNotExist(Exception):
+    def __init__(self, message="Job does not exist."):
+        super().__init__(message)
+
+
 EXCEPTIONS = (
     InvalidData,
     InvalidMimeType,
+    InvalidEncodingProfile,
     ValidationError,
     RequestDoesNotExist,
+    JobDoesNotExist,
     SchemaDoesNotExist,
     SchemaDefinitionTooLarge,
+    PromptTooLarge,
 )
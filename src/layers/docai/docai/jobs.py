@@ -0,0 +1,86 @@
+import collections
+
+import boto3
+from botocore.exceptions import ClientError
+
+from docai import utils
+
+# Sort key of the item holding the job itself, the others are its documents
+JOB_ITEM = "#job"
+# Counter of the documents in each status, only RETRYING ones are delivered again
+COUNTERS = {"COMPLETED": "completed", "FAILED": "failed", "RETRYING": "retrying"}
+
+
+class JobTracker:
+    """Tracks the progress of the documents of a bulk extraction job.
+
+    Every document has an item with its last status, and the progress of the job is
+    counted from them when it is read. Recording a status is then a single write,
+    so a document delivered again, or a crash after the write, never leaves the
+    counts off. A job is complete once each of its documents has completed or
+    failed for good, after its last delivery.
+    """
+
+    def __init__(self, table: boto3.resource) -> None:
+        self.__table = table
+
+    def create(self, job_id: str, total: int, **attributes: str) -> dict:
+        """Create a job of `total` documents"""
+        item = dict(
+            job_id=job_id,
+            item_id=JOB_ITEM,
+            total=total,
+            created_at=utils.utcnow(),
+            **attributes,
+        )
+        self.__table.put_item(Item=item)
+        return item
+
+    def record(self, job_id: str, request_id: str, status: str) -> None:
+        """Record the status of a document of a job"""
+        try:
+            self.__table.put_item(
+                Item=dict(
+                    job_id=job_id,
+                    item_id=request_id,
+                    status=status,
+                    updated_at=utils.utcnow(),
+                ),
+                # A late delivery that failed never overrides a completed document
+                ConditionExpression="attribute_not_exists(item_id) OR #s <> :completed",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":completed": "COMPLETED"},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+
+    def count(self, job_id: str) -> dict[str, int]:
+        """Count the documents of a job in each status"""
+        statuses: collections.Counter[str] = collections.Counter()
+        params = dict(
+            KeyConditionExpression="job_id = :job_id",
+            ExpressionAttributeValues={":job_id": job_id},
+            ProjectionExpression="#s",
+            ExpressionAttributeNames={"#s": "status"},
+            ConsistentRead=True,
+        )
+        while True:
+            response = self.__table.query(**params)
+            statuses.update(item["status"] for item in response["Items"] if item)
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return {counter: statuses[status] for status, counter in COUNTERS.items()}
+
+    def get(self, job_id: str) -> dict | None:
+        """Get the progress of a job"""
+        key = dict(job_id=job_id, item_id=JOB_ITEM)
+        item = self.__table.get_item(Key=key, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        del item["item_id"]
+        counts = self.count(job_id)
+        finished = counts["completed"] + counts["failed"]
+        status = "COMPLETED" if finished >= item["total"] else "RUNNING"
+        return dict(item, **counts, status=status)
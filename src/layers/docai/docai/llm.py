@@ -1,65 +1,293 @@
-import traceback
-from typing import Any
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import time
+from typing import TYPE_CHECKING, Any, Generator
 
 import boto3
-from openai import OpenAI
 
+from docai import budget, chunking, codec
 from docai import constants as c
-from docai import stream, utils
+from docai import correction
+from docai import deadline as dl
+from docai import exceptions as exc
+from docai import ratelimit, repair, retry, stream, structured, telemetry, utils, validators
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
 
 VALIDATION_RETRY_LIMIT = 3
 
+# Prefix of the metrics of the extractions in each response mode
+MODE_METRICS = {"json_schema": "StructuredOutput", "prompt": "PromptedOutput"}
+
+# An extraction yields the payload of each API call and is sent back its response
+Extraction = Generator[dict, dict, dict]
+
+
+def timeout(seconds: float = c.OPENAI_TIMEOUT) -> "httpx.Timeout":
+    """Return the timeouts of a call to the OpenAI API, at most `seconds` each"""
+    import httpx
+
+    seconds = max(0.0, min(seconds, c.OPENAI_TIMEOUT))
+    return httpx.Timeout(seconds, connect=min(seconds, c.OPENAI_CONNECT_TIMEOUT))
+
+
+def build_messages(
+    schema_definition: dict, text_data: str, images: dict[str, str]
+) -> list[dict]:
+    """Build the messages of an extraction request"""
+    text = c.USER_INSTRUCTIONS_FORMAT.format(
+        schema=schema_definition, content=text_data
+    )
+
+    user_content: list[dict[str, dict | str]] = [{"type": "text", "text": text}]
+    for _, url in images.items():
+        user_content.append({"type": "image_url", "image_url": {"url": url}})
+
+    return [
+        {"role": "system", "content": c.SYSTEM_MESSAGE},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def estimate_tokens(payload: dict) -> int:
+    """Estimate the tokens a call counts against the rate limits.
+
+    The API counts `max_tokens` rather than the completion tokens against the limits
+    when a call is made, and every image as if it was the largest the model accepts.
+    """
+    tokens = int(payload["max_tokens"])
+    for message in payload["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for part in content:
+            if part["type"] == "text":
+                tokens += utils.count_tokens(part["text"])
+            else:
+                tokens += budget.MAX_IMAGE_TOKENS
+    return tokens
+
+
+def unwrap_response(response: dict) -> tuple[str, dict]:
+    message = response["choices"][0]["message"]
+    # A refusal is sent back to the model like any other invalid output
+    content = message["content"] or message.get("refusal") or ""
+    metadata = response["usage"]
+    return content, metadata
+
+
+def parse_output(content: str, schema_definition: dict, mode: str) -> Any:
+    """Parse the JSON object of the output of the model"""
+    data = codec.extract_json(content)
+    if mode == "json_schema":
+        data = structured.drop_added_nulls(data, schema_definition)
+    return data
+
+
+def validate_output(
+    content: str,
+    schema_definition: dict,
+    validator: validators.SchemaValidator | None,
+    mode: str,
+) -> dict:
+    """Parse the output of the model and validate it against the schema.
+
+    Outputs that fail are repaired locally when the errors are mechanical, so only
+    the others cost another call to the model.
+    """
+    validator = validator or validators.get_validator(schema_definition)
+    parse = functools.partial(
+        parse_output, schema_definition=schema_definition, mode=mode
+    )
+    try:
+        data = parse(content)
+        validator.validate(data)
+    except exc.InvalidData as e:
+        data = repair.repair(content, schema_definition, validator, parse)
+        if data is None:
+            raise e
+    return data
+
+
+def record_extraction(
+    mode: str, calls: int, tokens: int, start: float, valid: bool
+) -> None:
+    """Add the metrics comparing the response modes"""
+    prefix = MODE_METRICS[mode]
+    telemetry.add_count(f"{prefix}{'Extractions' if valid else 'Failed'}")
+    telemetry.add_count(f"{prefix}Calls", calls)
+    telemetry.add_count(f"{prefix}Tokens", tokens)
+    telemetry.add_duration(f"{prefix}Latency", time.perf_counter() - start)
+
+
+def record_delivery(images: dict[str, str], start: float) -> None:
+    """Add the latency of an extraction by how its images were delivered"""
+    if not images:
+        return
+    inline = sum(stream.is_data_url(url) for url in images.values())
+    delivery = "Inline" if inline == len(images) else "Mixed" if inline else "S3"
+    telemetry.add_duration(f"{delivery}ImagesLatency", time.perf_counter() - start)
+
+
+def stored_request(payload: dict) -> dict:
+    """Return the request as it is recorded with the result.
+
+    The strict schema holds floats, which DynamoDB does not store, and is derived from
+    the stored schema anyway. Images sent inline are recorded without their content.
+    """
+
+    def redact(part: dict) -> dict:
+        if part["type"] != "image_url":
+            return part
+        url = stream.redact_data_url(part["image_url"]["url"])
+        return {**part, "image_url": {**part["image_url"], "url": url}}
+
+    request = {k: v for k, v in payload.items() if k != "response_format"}
+    request["messages"] = [
+        (
+            message
+            if isinstance(message["content"], str)
+            else {**message, "content": [redact(part) for part in message["content"]]}
+        )
+        for message in request["messages"]
+    ]
+    return request
+
+
+def extract(
+    schema_definition: dict,
+    text_data: str,
+    images: dict[str, str],
+    validator: validators.SchemaValidator | None = None,
+) -> Extraction:
+    """Run an extraction, independent of how the API is called.
+
+    Yields the payload of every API call and expects the response to be sent back,
+    re-prompting with the validation errors until the output is valid. Where the
+    model supports it, the API constrains the output to the schema.
+    """
+    model = c.VISION_MODEL if images else c.TEXT_MODEL
+    text_data, estimate = budget.preflight(
+        schema_definition, text_data, len(images), model
+    )
+    payload = {
+        "model": model,
+        "messages": build_messages(schema_definition, text_data, images),
+        "seed": c.SEED,
+        "temperature": c.TEMPERATURE,
+        "max_tokens": c.MAX_OUTPUT_TOKENS,
+    }
+    mode = structured.response_mode(model)
+    if mode == "json_schema":
+        try:
+            payload["response_format"] = structured.response_format(schema_definition)
+        except structured.UnsupportedSchema as e:
+            telemetry.logger.info("Schema not supported by structured outputs: %s", e)
+            telemetry.add_count("StructuredOutputUnsupported")
+            mode = "prompt"
+    request = payload
+
+    start, tokens, attempt = time.perf_counter(), 0, 0
+    while True:
+        attempt += 1
+        content, metadata = unwrap_response((yield payload))
+        tokens += metadata.get("total_tokens") or 0
+        try:
+            valid_data = validate_output(content, schema_definition, validator, mode)
+        except Exception as e:
+            if attempt == VALIDATION_RETRY_LIMIT:
+                record_extraction(mode, attempt, tokens, start, valid=False)
+                record_delivery(images, start)
+                raise e
+            # Retries send a compact correction request rather than the whole
+            # conversation, the first request stays the one recorded
+            messages = correction.build_messages(
+                schema_definition, content, e, text_data, images
+            )
+            payload = {**payload, "messages": messages}
+
+        else:
+            record_extraction(mode, attempt, tokens, start, valid=True)
+            record_delivery(images, start)
+            return {
+                "request": stored_request(request),
+                "images": {k: stream.redact_data_url(v) for k, v in images.items()},
+                "error": None,
+                "result": valid_data,
+                "metadata": {**metadata, "estimate": estimate.metadata()},
+            }
+
+
+def with_pages(data: dict, selected_pages: list[int] | None) -> dict:
+    """Record the pages an extraction was limited to, if not all of them"""
+    if selected_pages:
+        data["metadata"] = {**data["metadata"], "selected_pages": selected_pages}
+    return data
+
 
 class LLMClient:
     def __init__(
         self,
         api_key: str,
+        rate_limiter: ratelimit.RateLimiter | None = None,
+        retry_policy: retry.RetryPolicy | None = None,
     ):
-        self.__openai = OpenAI(api_key=api_key)
+        self.__api_key = api_key
+        self.__rate_limiter = rate_limiter
+        self.__retry_policy = retry_policy or retry.RetryPolicy()
 
-    def __unwrap_response(self, response: dict) -> dict:
-        content = response["choices"][0]["message"]["content"]
-        metadata = response["usage"]
-        return content, metadata
+    @functools.cached_property
+    def __openai(self) -> "OpenAI":
+        # The SDK takes a second to import, so it is only loaded for requests that
+        # reach the API rather than being served from a cache
+        from openai import OpenAI
 
-    def __validate_response(self, content: str, schema_definition: dict) -> dict:
-        return utils.validate_data(content, schema_definition)
+        # Retries are left to the retry policy, which knows the deadline
+        return OpenAI(api_key=self.__api_key, timeout=timeout(), max_retries=0)
 
-    def __call_api(
-        self, schema_definition: dict, model: str, messages: Any, images: dict
+    def __create(self, payload: dict, deadline: dl.Deadline) -> dict:
+        if self.__rate_limiter:
+            tokens = estimate_tokens(payload)
+            self.__rate_limiter.acquire(payload["model"], tokens, deadline)
+        try:
+            min_time = self.__retry_policy.min_attempt_time
+            deadline.check("calling the OpenAI API", min_time)
+        except exc.DeadlineExceeded as e:
+            # The call is not sent, so its reservation goes back to the others
+            if self.__rate_limiter:
+                self.__rate_limiter.release(payload["model"], tokens)
+            raise e
+        completion = self.__openai.chat.completions.create(
+            **payload, timeout=timeout(deadline.remaining())
+        )
+        return completion.dict()
+
+    def __extract(
+        self,
+        schema_definition: dict,
+        chunk: chunking.Chunk,
+        s3: boto3.client,
+        bucket_name: str,
+        validator: validators.SchemaValidator | None,
+        deadline: dl.Deadline,
     ) -> dict:
-        payload = {
-            "model": model,
-            "messages": messages,
-            "seed": c.SEED,
-            "temperature": c.TEMPERATURE,
-            "max_tokens": c.MAX_OUTPUT_TOKENS,
-        }
-        data = {"request": payload, "images": images, "error": None}
-
-        for i in range(VALIDATION_RETRY_LIMIT):
-            completion = self.__openai.chat.completions.create(**payload)
-            content, metadata = self.__unwrap_response(completion.dict())
-            try:
-                valid_data = self.__validate_response(content, schema_definition)
-            except Exception as e:
-                if i == VALIDATION_RETRY_LIMIT - 1:
-                    raise e
-                error_message = traceback.format_exc()
-                error_messages = [
-                    {"role": "assistant", "content": content},
-                    {
-                        "role": "user",
-                        "content": f"The output JSON is not valid, try again! The error is as follows : {error_message}",
-                    },
-                ]
-                messages = payload["messages"] + error_messages
-                payload["messages"] = messages
+        images = {}
+        if chunk.image_list:
+            images = stream.generate_presigned_url(s3, bucket_name, chunk.image_list)
 
-            else:
-                response = {"result": valid_data, "metadata": metadata}
-                data.update(response)
-                return data
+        extraction = extract(schema_definition, chunk.text_data, images, validator)
+        payload = next(extraction)
+        while True:
+            create = functools.partial(self.__create, payload, deadline)
+            response = self.__retry_policy.run(create, deadline)
+            try:
+                payload = extraction.send(response)
+            except StopIteration as stop:
+                return stop.value
 
     def __call__(
         self,
@@ -68,22 +296,169 @@ class LLMClient:
         s3: boto3.client,
         bucket_name: str,
         image_list: list[str] | None = None,
+        validator: validators.SchemaValidator | None = None,
+        deadline: dl.Deadline | None = None,
+        selected_pages: list[int] | None = None,
+    ) -> dict:
+        deadline = self.__retry_policy.deadline(deadline)
+        chunks = chunking.split(text_data, image_list or [])
+        extract_chunk = functools.partial(
+            self.__extract,
+            schema_definition,
+            s3=s3,
+            bucket_name=bucket_name,
+            validator=validator,
+            deadline=deadline,
+        )
+        if len(chunks) == 1:
+            return with_pages(extract_chunk(chunks[0]), selected_pages)
+
+        # The chunks are independent requests, so the latency is that of the slowest
+        # rather than growing with the pages of the document
+        start = time.perf_counter()
+        workers = min(c.CHUNK_CONCURRENCY, len(chunks))
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            extractions = list(executor.map(extract_chunk, chunks))
+        data = chunking.combine(schema_definition, extractions, validator)
+        telemetry.add_duration("ChunkedExtractionLatency", time.perf_counter() - start)
+        return with_pages(data, selected_pages)
+
+
+class AsyncLLMClient:
+    """An asyncio variant of `LLMClient`.
+
+    Concurrent extractions share the HTTP connections of the client, so many of them
+    can be in flight on one event loop. The connections are bound to the event loop
+    they are first used on and are released by `aclose`.
+
+    httpx scans every connection of a pool for each idle connection whenever a
+    request starts or ends, so the connections are split into pools of at most
+    `OPENAI_POOL_SIZE` used in turn, and calls beyond `max_connections` wait on a
+    semaphore rather than in a pool queue.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        max_connections: int = c.OPENAI_MAX_CONNECTIONS,
+        rate_limiter: ratelimit.RateLimiter | None = None,
+        retry_policy: retry.RetryPolicy | None = None,
+    ):
+        self.__api_key = api_key
+        self.__rate_limiter = rate_limiter
+        self.__retry_policy = retry_policy or retry.RetryPolicy()
+        self.__max_connections = max_connections
+        self.__slots = asyncio.Semaphore(max_connections)
+
+    @functools.cached_property
+    def __pools(self) -> "itertools.cycle[AsyncOpenAI]":
+        import httpx
+        from openai import AsyncOpenAI
+
+        pools = []
+        for start in range(0, self.__max_connections, c.OPENAI_POOL_SIZE):
+            size = min(c.OPENAI_POOL_SIZE, self.__max_connections - start)
+            limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+            http_client = httpx.AsyncClient(limits=limits, timeout=timeout())
+            pools.append(
+                AsyncOpenAI(
+                    api_key=self.__api_key, http_client=http_client, max_retries=0
+                )
+            )
+        self.__clients = pools
+        return itertools.cycle(pools)
+
+    async def __create(self, payload: dict, deadline: dl.Deadline) -> dict:
+        # Waiting for capacity does not hold on to a connection
+        if self.__rate_limiter:
+            tokens = estimate_tokens(payload)
+            await self.__rate_limiter.acquire_async(payload["model"], tokens, deadline)
+        async with self.__slots:
+            openai = next(self.__pools)
+            try:
+                min_time = self.__retry_policy.min_attempt_time
+                deadline.check("calling the OpenAI API", min_time)
+            except exc.DeadlineExceeded as e:
+                # The call is not sent, so its reservation goes back to the others
+                if self.__rate_limiter:
+                    await asyncio.to_thread(
+                        self.__rate_limiter.release, payload["model"], tokens
+                    )
+                raise e
+            completion = await openai.chat.completions.create(
+                **payload, timeout=timeout(deadline.remaining())
+            )
+        return completion.dict()
+
+    async def __extract(
+        self,
+        schema_definition: dict,
+        chunk: chunking.Chunk,
+        s3: boto3.client,
+        bucket_name: str,
+        validator: validators.SchemaValidator | None,
+        deadline: dl.Deadline,
     ) -> dict:
         images = {}
-        text = c.USER_INSTRUCTIONS_FORMAT.format(
-            schema=schema_definition, content=text_data
+        if chunk.image_list:
+            images = await stream.generate_presigned_url_async(
+                s3, bucket_name, chunk.image_list
+            )
+
+        extraction = extract(schema_definition, chunk.text_data, images, validator)
+        payload = next(extraction)
+        while True:
+            create = functools.partial(self.__create, payload, deadline)
+            response = await self.__retry_policy.run_async(create, deadline)
+            try:
+                payload = extraction.send(response)
+            except StopIteration as stop:
+                return stop.value
+
+    async def __call__(
+        self,
+        schema_definition: dict,
+        text_data: str,
+        s3: boto3.client,
+        bucket_name: str,
+        image_list: list[str] | None = None,
+        validator: validators.SchemaValidator | None = None,
+        deadline: dl.Deadline | None = None,
+        selected_pages: list[int] | None = None,
+    ) -> dict:
+        deadline = self.__retry_policy.deadline(deadline)
+        chunks = chunking.split(text_data, image_list or [])
+        extract_chunk = functools.partial(
+            self.__extract,
+            schema_definition,
+            s3=s3,
+            bucket_name=bucket_name,
+            validator=validator,
+            deadline=deadline,
         )
+        if len(chunks) == 1:
+            return with_pages(await extract_chunk(chunks[0]), selected_pages)
+
+        start = time.perf_counter()
+        slots = asyncio.Semaphore(c.CHUNK_CONCURRENCY)
+
+        async def bounded(chunk: chunking.Chunk) -> dict:
+            async with slots:
+                return await extract_chunk(chunk)
+
+        extractions = await asyncio.gather(*(bounded(chunk) for chunk in chunks))
+        data = chunking.combine(schema_definition, list(extractions), validator)
+        telemetry.add_duration("ChunkedExtractionLatency", time.perf_counter() - start)
+        return with_pages(data, selected_pages)
 
-        user_content: list[dict[str, dict | str]] = [{"type": "text", "text": text}]
-        if image_list:
-            images = stream.generate_presigned_url(s3, bucket_name, image_list)
-            for _, url in images.items():
-                user_content.append({"type": "image_url", "image_url": {"url": url}})
+    async def aclose(self) -> None:
+        """Close the connections of the client"""
+        if "_AsyncLLMClient__pools" in self.__dict__:
+            await asyncio.gather(*(client.close() for client in self.__clients))
+            del self.__pools
 
-        messages = [
-            {"role": "system", "content": c.SYSTEM_MESSAGE},
-            {"role": "user", "content": user_content},
-        ]
+    async def __aenter__(self) -> "AsyncLLMClient":
+        return self
 
-        model = c.VISION_MODEL if images else c.TEXT_MODEL
-        return self.__call_api(schema_definition, model, messages, images)
+    async def __aexit__(self, *args: Any) -> None:
+        await self.aclose()
@@ -51,6 +51,12 @@ def process_docai(
 
         ret = models.ResultResponseModel(result=data)
 
+        if isinstance(data, dict) and "cached" in data:
+            name = "CacheHit" if data["cached"] else "CacheMiss"
+            metrics.add_metric(
+                f"{annotation_key}{name}", unit=MetricUnit.Count, value=1
+            )
+
         logger.info(messages["SUCCESS"], result=data)
         tracer.put_annotation(annotation_key, "SUCCESS")
         tracer.put_metadata(annotation_key, data)
@@ -4,7 +4,6 @@ from enum import StrEnum
 from typing import Any, Literal
 
 from aws_lambda_powertools.utilities.parser import BaseModel, Field, validator
-from jsonschema import Draft202012Validator as JSONValidator
 
 from docai import constants as c
 from docai import exceptions as exc
@@ -52,6 +51,26 @@ class MimeTypeEnum(StrEnum):
     WEBP = "image/webp"
 
 
+class ImageFormat(StrEnum):
+    PNG = "png"
+    JPEG = "jpeg"
+
+
+class EncodingProfile(BaseModel):
+    dpi: int = Field(..., gt=0)
+    max_long_edge: int | None = Field(default=None, gt=0)
+    max_short_edge: int | None = Field(default=None, gt=0)
+    image_format: ImageFormat = ImageFormat.PNG
+    quality: int = Field(default=85, ge=1, le=100)
+    grayscale: bool = False
+
+    @property
+    def mime_type(self) -> str:
+        if self.image_format == ImageFormat.JPEG:
+            return MimeTypeEnum.JPEG.value
+        return MimeTypeEnum.PNG.value
+
+
 class SchemaModel(BaseModel):
     schema_name: str
     schema_description: str
@@ -59,10 +78,13 @@ class SchemaModel(BaseModel):
     schema_version: str | None = Field(default_factory=utils.guid)
     schema_status: SchemaStatus = Field(default=SchemaStatus.ACTIVE)
     number_of_tokens: int | None = None
+    encoding_profile: str | None = None
     created_at: str = Field(default_factory=utcnow)
 
     @validator("schema_definition")
     def validate_schema_definition(cls, v: dict[str, Any]) -> dict[str, Any]:
+        from jsonschema import Draft202012Validator as JSONValidator
+
         JSONValidator.check_schema(v)
         return v
 
@@ -79,3 +101,9 @@ class SchemaModel(BaseModel):
                 f"tokens: {number_of_tokens}"
             )
         return number_of_tokens
+
+    @validator("encoding_profile")
+    def validate_encoding_profile(cls, v: str | None) -> str | None:
+        if v is not None and v not in c.ENCODING_PROFILES:
+            raise exc.InvalidEncodingProfile(f"Invalid encoding profile {v}")
+        return v
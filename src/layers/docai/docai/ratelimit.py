@@ -0,0 +1,224 @@
+import asyncio
+import decimal
+import random
+import threading
+import time
+from typing import NamedTuple, Protocol
+
+import boto3
+from botocore.exceptions import ClientError
+
+from docai import constants as c
+from docai import deadline as dl
+from docai import exceptions as exc
+from docai import telemetry
+
+SECONDS_PER_MINUTE = 60
+
+
+class Limits(NamedTuple):
+    """Requests and tokens per minute, 0 disables a limit"""
+
+    requests: int
+    tokens: int
+
+
+class Bucket(NamedTuple):
+    """The capacity left of a limit, negative once callers are queued for it"""
+
+    requests: float
+    tokens: float
+    updated_at: float
+
+
+def full_bucket(limits: Limits, now: float) -> Bucket:
+    return Bucket(float(limits.requests), float(limits.tokens), now)
+
+
+def refill(bucket: Bucket, limits: Limits, now: float) -> Bucket:
+    """Add the capacity regained since the bucket was last updated"""
+    minutes = max(0.0, now - bucket.updated_at) / SECONDS_PER_MINUTE
+    return Bucket(
+        min(limits.requests, bucket.requests + minutes * limits.requests),
+        min(limits.tokens, bucket.tokens + minutes * limits.tokens),
+        max(now, bucket.updated_at),
+    )
+
+
+def reserve(
+    bucket: Bucket, limits: Limits, tokens: int, now: float, requests: int = 1
+) -> tuple[Bucket, float]:
+    """Take requests and their tokens from a bucket.
+
+    The bucket goes into debt rather than refusing, and the caller waits until the
+    debt is paid back, so callers are served in the order they reserved and slow
+    down smoothly as the limits are approached. Returns the bucket and the wait.
+    Negative `requests` and `tokens` give back a reservation, up to the limits.
+    """
+    bucket = refill(bucket, limits, now)
+    bucket = Bucket(
+        min(limits.requests, bucket.requests - requests),
+        min(limits.tokens, bucket.tokens - tokens),
+        bucket.updated_at,
+    )
+    wait = 0.0
+    for available, limit in zip(bucket[:2], limits):
+        if limit and available < 0:
+            wait = max(wait, -available / limit * SECONDS_PER_MINUTE)
+    return bucket, wait
+
+
+class Store(Protocol):
+    def reserve(
+        self, key: str, limits: Limits, tokens: int, requests: int = 1
+    ) -> float:
+        ...
+
+
+class InMemoryStore:
+    """A store local to the process, for tests and single instance deployments"""
+
+    def __init__(self) -> None:
+        self.__buckets: dict[str, Bucket] = {}
+        self.__lock = threading.Lock()
+
+    def reserve(
+        self, key: str, limits: Limits, tokens: int, requests: int = 1
+    ) -> float:
+        with self.__lock:
+            now = time.time()
+            bucket = self.__buckets.get(key) or full_bucket(limits, now)
+            self.__buckets[key], wait = reserve(bucket, limits, tokens, now, requests)
+            return wait
+
+
+class DynamoDBStore:
+    """A store shared by all the functions, one item per bucket.
+
+    Buckets are updated with a conditional put on the time of their last update, so
+    concurrent reservations of the same bucket are retried rather than lost.
+    """
+
+    def __init__(
+        self,
+        table: boto3.resource,
+        attempts: int = c.RATE_LIMIT_ATTEMPTS,
+        ttl: int = c.RATE_LIMIT_TTL,
+    ) -> None:
+        self.__table = table
+        self.__attempts = attempts
+        self.__ttl = ttl
+
+    def __put(self, key: str, bucket: Bucket, previous: dict | None) -> bool:
+        item = dict(
+            limit_key=key,
+            requests=decimal.Decimal(f"{bucket.requests:.3f}"),
+            tokens=decimal.Decimal(f"{bucket.tokens:.3f}"),
+            updated_at=decimal.Decimal(f"{bucket.updated_at:.6f}"),
+            # A bucket left idle for its TTL is full again once it is deleted
+            expires_at=int(bucket.updated_at) + self.__ttl,
+        )
+        if previous:
+            condition = dict(
+                ConditionExpression="updated_at = :updated_at",
+                ExpressionAttributeValues={":updated_at": previous["updated_at"]},
+            )
+        else:
+            condition = dict(ConditionExpression="attribute_not_exists(limit_key)")
+        try:
+            self.__table.put_item(Item=item, **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+            return False
+        return True
+
+    def reserve(
+        self, key: str, limits: Limits, tokens: int, requests: int = 1
+    ) -> float:
+        wait = 0.0
+        for _ in range(self.__attempts):
+            item = self.__table.get_item(
+                Key=dict(limit_key=key), ConsistentRead=True
+            ).get("Item")
+            now = time.time()
+            if item:
+                bucket = Bucket(
+                    float(item["requests"]),
+                    float(item["tokens"]),
+                    float(item["updated_at"]),
+                )
+            else:
+                bucket = full_bucket(limits, now)
+            bucket, wait = reserve(bucket, limits, tokens, now, requests)
+            if self.__put(key, bucket, item):
+                return wait
+            time.sleep(random.uniform(0, 0.05))
+
+        # Waiting as long as the last attempt would have is closer to the limits than
+        # failing an extraction over contention on the bucket
+        telemetry.add_count("RateLimitConflict")
+        return wait
+
+
+def check_wait(wait: float, deadline: dl.Deadline | None) -> None:
+    """Fail fast rather than wait for capacity past the deadline"""
+    if deadline and wait >= deadline.remaining():
+        raise exc.DeadlineExceeded("Deadline exceeded waiting for the rate limits.")
+
+
+class RateLimiter:
+    """Paces the calls to the OpenAI API to stay within its rate limits.
+
+    Every call reserves one request and its estimated tokens from the bucket of its
+    model before it is sent, and waits until the bucket has the capacity for it.
+    """
+
+    def __init__(self, store: Store, limits: Limits | None = None) -> None:
+        self.__store = store
+        self.__limits = limits or Limits(c.RATE_LIMIT_RPM, c.RATE_LIMIT_TPM)
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.__limits)
+
+    def reserve(self, model: str, tokens: int) -> float:
+        """Reserve capacity for a call and return how long to wait before sending it"""
+        if not self.enabled:
+            return 0.0
+        wait = self.__store.reserve(model, self.__limits, tokens)
+        telemetry.add_duration("RateLimitWait", wait)
+        if wait:
+            telemetry.add_count("RateLimitThrottled")
+        return wait
+
+    def release(self, model: str, tokens: int) -> None:
+        """Give back the capacity reserved for a call that is not sent"""
+        if self.enabled:
+            self.__store.reserve(model, self.__limits, -tokens, requests=-1)
+
+    def acquire(
+        self, model: str, tokens: int, deadline: dl.Deadline | None = None
+    ) -> float:
+        """Wait until there is capacity for a call"""
+        wait = self.reserve(model, tokens)
+        try:
+            check_wait(wait, deadline)
+        except exc.DeadlineExceeded as e:
+            self.release(model, tokens)
+            raise e
+        time.sleep(wait)
+        return wait
+
+    async def acquire_async(
+        self, model: str, tokens: int, deadline: dl.Deadline | None = None
+    ) -> float:
+        """Wait until there is capacity for a call without blocking the event loop"""
+        wait = await asyncio.to_thread(self.reserve, model, tokens)
+        try:
+            check_wait(wait, deadline)
+        except exc.DeadlineExceeded as e:
+            await asyncio.to_thread(self.release, model, tokens)
+            raise e
+        await asyncio.sleep(wait)
+        return wait
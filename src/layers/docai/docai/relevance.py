@@ -0,0 +1,127 @@
+import collections
+import math
+import re
+from typing import Any, Callable
+
+from docai import constants as c
+from docai import exceptions as exc
+from docai import telemetry
+
+WORD = re.compile(r"[a-z0-9]+")
+CAMEL_CASE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+# Words of schema descriptions that say nothing about where a field is found
+STOPWORDS = frozenset(
+    """
+    about above after all also and any are based been but can candidate contain
+    contains data date description document each either else etc example extract
+    extracted false field fields for format found from given has have however into
+    its list may must not null number one only other otherwise provided should some
+    string such than that the their them then there these this those true type used
+    using value values was were what when where which while will with within without
+    yes you your
+    """.split()
+)
+
+
+def terms(schema_definition: dict) -> set[str]:
+    """Return the words of the property names, titles, descriptions and enums"""
+    words: set[str] = set()
+
+    def add(text: str) -> None:
+        text = CAMEL_CASE.sub(" ", text).lower()
+        words.update(word for word in WORD.findall(text) if len(word) > 2)
+
+    def walk(node: Any) -> None:
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            for keyword, value in node.items():
+                if keyword in ("properties", "$defs", "definitions"):
+                    for name in value:
+                        add(name)
+                if keyword in ("title", "description") and isinstance(value, str):
+                    add(value)
+                elif keyword == "enum":
+                    for option in value:
+                        if isinstance(option, str):
+                            add(option)
+                else:
+                    walk(value)
+
+    walk(schema_definition)
+    return words - STOPWORDS
+
+
+def score_pages(texts: list[str], words: set[str]) -> list[float]:
+    """Score each page by the terms it holds, the rarer across pages the higher"""
+    counts = [collections.Counter(WORD.findall(text.lower())) for text in texts]
+    weights = {}
+    for word in words:
+        pages = sum(word in count for count in counts)
+        if pages:
+            weights[word] = math.log(1 + len(texts) / pages)
+    return [
+        sum(math.log1p(count[word]) * weight for word, weight in weights.items())
+        for count in counts
+    ]
+
+
+def select_pages(
+    texts: list[str], schema_definition: dict, top_k: int = c.PAGE_SELECTION_TOP_K
+) -> list[int] | None:
+    """Return the indices of the pages worth sending, or None to send all of them.
+
+    The `top_k` pages scoring highest against the schema are kept, with the first
+    page for the context of the document. Pages without any text cannot be scored
+    and are always kept.
+    """
+    if len(texts) <= top_k + 1:
+        return None
+    scores = score_pages(texts, terms(schema_definition))
+    if not any(scores):
+        return None
+    ranked = sorted(range(len(texts)), key=lambda index: -scores[index])
+    selected = {0, *(index for index in ranked[:top_k] if scores[index] > 0)}
+    selected.update(index for index, text in enumerate(texts) if not text.strip())
+    if len(selected) == len(texts):
+        return None
+    telemetry.add_count("PageSelectionPages", len(selected))
+    telemetry.add_count("PageSelectionSkipped", len(texts) - len(selected))
+    return sorted(selected)
+
+
+def is_empty(value: Any) -> bool:
+    """Whether an extraction result holds no value at all"""
+    if isinstance(value, dict):
+        return all(is_empty(item) for item in value.values())
+    if isinstance(value, list):
+        return all(is_empty(item) for item in value)
+    return value is None
+
+
+def extract(
+    client: Callable[..., dict],
+    params: dict,
+    fallback: Callable[[], dict],
+    **options: Any,
+) -> dict:
+    """Extract from the selected pages, or from all of them if that fails validation.
+
+    When the output of the selected pages fails validation, the fields are likely on
+    pages that were left out, so the request returned by `fallback` with every page
+    is sent instead. An output without any value is returned as it is, as most
+    documents missing a field do not have it on any page either.
+    """
+    if not params.get("selected_pages"):
+        return client(**params, **options)
+    try:
+        data = client(**params, **options)
+    except exc.InvalidData as e:
+        telemetry.logger.info("Invalid extraction from the selected pages: %s", e)
+    else:
+        if is_empty(data["result"]):
+            telemetry.add_count("PageSelectionEmpty")
+        return data
+    telemetry.add_count("PageSelectionFallback")
+    return client(**fallback(), **options)
@@ -0,0 +1,221 @@
+import collections
+import decimal
+import re
+from typing import Any, Callable
+
+from docai import codec
+from docai import exceptions as exc
+from docai import telemetry, validators
+
+NULL_STRINGS = {"null", "none", "nil", "n/a"}
+BOOLEAN_STRINGS = {"true": True, "false": False}
+NUMBER = re.compile(r"-?\d{1,3}(,\d{3})+(\.\d+)?|-?\d+(\.\d+)?([eE][-+]?\d+)?")
+PYTHON_LITERALS = re.compile(r"(True|False|None)\b")
+JSON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSING = {"{": "}", "[": "]"}
+
+
+def repair_syntax(text: str) -> str:
+    """Fix the common syntax errors of the first JSON object in a model response.
+
+    Drops trailing commas, replaces Python literals, and closes the strings, arrays
+    and objects left open by an output cut short. Returns the object alone.
+    """
+    start = text.find("{")
+    if start == -1:
+        return text
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = escaped = False
+    i = start
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            i += 1
+            continue
+        if text.startswith(codec.FENCE, i):
+            break
+        literal = PYTHON_LITERALS.match(text, i)
+        if literal:
+            out.append(JSON_LITERALS[literal.group()])
+            i = literal.end()
+            continue
+        if char == '"':
+            in_string = True
+        elif char in CLOSING:
+            stack.append(CLOSING[char])
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            if not stack:
+                out.append(char)
+                break
+        out.append(char)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    while stack:
+        while out and (out[-1].isspace() or out[-1] == ","):
+            out.pop()
+        if out and out[-1] == ":":
+            out.append("null")
+        out.append(stack.pop())
+    return "".join(out)
+
+
+def _types(schema: dict) -> set[str] | None:
+    kind = schema.get("type")
+    if kind is None:
+        return None
+    return {kind} if isinstance(kind, str) else set(kind)
+
+
+def _is_type(value: Any, kind: str) -> bool:
+    if kind == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == "number":
+        return isinstance(value, (int, float, decimal.Decimal)) and not isinstance(
+            value, bool
+        )
+    return {
+        "object": isinstance(value, dict),
+        "array": isinstance(value, list),
+        "string": isinstance(value, str),
+        "boolean": isinstance(value, bool),
+        "null": value is None,
+    }.get(kind, True)
+
+
+def _matches(value: Any, schema: dict) -> bool:
+    """Whether the value has a type and, for enums, a value the schema allows"""
+    types = _types(schema)
+    if types is not None and not any(_is_type(value, kind) for kind in types):
+        return False
+    if "enum" in schema and not any(
+        validators._equal(value, option) for option in schema["enum"]
+    ):
+        return False
+    return "const" not in schema or validators._equal(value, schema["const"])
+
+
+def _allows_null(schema: dict) -> bool:
+    return "null" in (_types(schema) or ()) or None in schema.get("enum", ())
+
+
+class _Coercer:
+    """Converts the values that do not match their schema into ones that do"""
+
+    def __init__(self, root: dict) -> None:
+        self.root = root
+        self.fixes: collections.Counter[str] = collections.Counter()
+
+    def resolve(self, schema: dict) -> dict:
+        ref = schema.get("$ref")
+        if not isinstance(ref, str) or not ref.startswith("#"):
+            return schema
+        target: Any = self.root
+        for token in filter(None, ref[1:].split("/")):
+            target = target[token.replace("~1", "/").replace("~0", "~")]
+        return self.resolve(target)
+
+    def convert(self, value: Any, schema: dict) -> tuple[Any, str | None]:
+        types = _types(schema) or set()
+        if isinstance(value, str):
+            text = value.strip()
+            if text.lower() in NULL_STRINGS and _allows_null(schema):
+                return None, "null"
+            for option in schema.get("enum", ()):
+                if isinstance(option, str) and option.lower() == text.lower():
+                    return option, "enum"
+            if types & {"integer", "number"} and NUMBER.fullmatch(text):
+                # Parsed like the JSON codec, integers as int and the others as Decimal
+                number = decimal.Decimal(text.replace(",", ""))
+                if number == number.to_integral_value():
+                    return int(number), "number"
+                return number, "number"
+            if "boolean" in types and text.lower() in BOOLEAN_STRINGS:
+                return BOOLEAN_STRINGS[text.lower()], "boolean"
+        elif _is_type(value, "number") and "string" in types:
+            return str(value), "string"
+        if "array" in types and value is not None and not isinstance(value, list):
+            return [value], "array"
+        return value, None
+
+    def coerce(self, value: Any, schema: Any) -> Any:
+        if not isinstance(schema, dict):
+            return value
+        schema = self.resolve(schema)
+        for branch in schema.get("allOf", ()):
+            value = self.coerce(value, branch)
+
+        if not _matches(value, schema):
+            converted, fix = self.convert(value, schema)
+            if fix and _matches(converted, schema):
+                self.fixes[fix] += 1
+                value = converted
+
+        if isinstance(value, dict):
+            self.object(value, schema)
+        elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+            value[:] = [self.coerce(item, schema["items"]) for item in value]
+        return value
+
+    def object(self, value: dict, schema: dict) -> None:
+        properties = schema.get("properties", {})
+        for name, subschema in properties.items():
+            if name in value:
+                value[name] = self.coerce(value[name], subschema)
+            elif name in schema.get("required", ()) and isinstance(subschema, dict):
+                if _allows_null(self.resolve(subschema)):
+                    value[name] = None
+                    self.fixes["missing"] += 1
+        if schema.get("additionalProperties") is False and properties:
+            for name in [name for name in value if name not in properties]:
+                del value[name]
+                self.fixes["additional"] += 1
+
+
+def repair(
+    content: str,
+    schema_definition: dict,
+    validator: validators.SchemaValidator,
+    parse: Callable[[str], Any],
+) -> Any | None:
+    """Repair a model output that failed validation, without calling the model again.
+
+    Fixes the syntax of the output if it does not parse, then converts the values
+    that do not match their schema: strings like "null", numbers and booleans as
+    strings, enum values in the wrong case, missing nullable properties. Returns the
+    repaired data if it is valid, otherwise None.
+    """
+    coercer = _Coercer(schema_definition)
+    try:
+        data = parse(content)
+    except exc.InvalidData:
+        try:
+            data = parse(repair_syntax(content))
+        except exc.InvalidData:
+            telemetry.add_count("RepairFailed")
+            return None
+        coercer.fixes["syntax"] += 1
+
+    data = coercer.coerce(data, schema_definition)
+    if not coercer.fixes or validator.errors(data):
+        telemetry.add_count("RepairFailed")
+        return None
+    telemetry.add_count("RepairSucceeded")
+    telemetry.add_count("RepairFixes", sum(coercer.fixes.values()))
+    telemetry.logger.info("Repaired the model output", fixes=dict(coercer.fixes))
+    return data
@@ -0,0 +1,125 @@
+import asyncio
+import contextlib
+import email.utils
+import random
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from docai import constants as c
+from docai import deadline as dl
+from docai import telemetry
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed call to the OpenAI API may succeed if it is sent again"""
+    # Only reached once a call failed, so the SDK is already loaded
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):  # timeouts included
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code in RETRYABLE_STATUS_CODES or (status_code or 0) >= 500
+
+
+def retry_after(error: Exception) -> float | None:
+    """Return the seconds to wait the API asked for in the response of a failed call"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if "retry-after-ms" in headers:
+        with contextlib.suppress(ValueError):
+            return float(headers["retry-after-ms"]) / 1000
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    with contextlib.suppress(ValueError):
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return date.timestamp() - time.time()
+
+
+class RetryPolicy:
+    """Retries the calls to the OpenAI API that failed on the transport.
+
+    Retries back off exponentially with full jitter, or wait as long as the API asks
+    for with `Retry-After`. An attempt is only made if it can finish before the
+    deadline, so the caller has time left to record the failure.
+    """
+
+    def __init__(
+        self,
+        attempts: int = c.OPENAI_RETRY_ATTEMPTS,
+        base_delay: float = c.OPENAI_RETRY_BASE_DELAY,
+        max_delay: float = c.OPENAI_RETRY_MAX_DELAY,
+        timeout: float = c.OPENAI_RETRY_TIMEOUT,
+        min_attempt_time: float = c.OPENAI_MIN_ATTEMPT_TIME,
+    ) -> None:
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.min_attempt_time = min_attempt_time
+
+    def deadline(self, deadline: dl.Deadline | None = None) -> dl.Deadline:
+        """Return the deadline of the calls, at most `timeout` away"""
+        return dl.Deadline.after(self.timeout).earliest(deadline)
+
+    def backoff(
+        self, attempt: int, error: Exception, deadline: dl.Deadline
+    ) -> float | None:
+        """Return how long to wait before the next attempt, None to give up"""
+        if attempt + 1 >= self.attempts or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(
+                0, min(self.max_delay, self.base_delay * 2**attempt)
+            )
+        delay = max(0.0, delay)
+        if delay + self.min_attempt_time > deadline.remaining():
+            telemetry.add_count("OpenAIRetryDeadline")
+            return None
+        telemetry.add_count("OpenAIRetry")
+        return delay
+
+    def run(self, fn: Callable[[], T], deadline: dl.Deadline) -> T:
+        """Call `fn` until it succeeds or can no longer be retried"""
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                return fn()
+            except Exception as e:
+                delay = self.backoff(attempt, e, deadline)
+                if delay is None:
+                    raise e
+            finally:
+                telemetry.add_duration("OpenAIAttempt", time.perf_counter() - start)
+            time.sleep(delay)
+            attempt += 1
+
+    async def run_async(
+        self, fn: Callable[[], Awaitable[T]], deadline: dl.Deadline
+    ) -> T:
+        """Await `fn` until it succeeds or can no longer be retried"""
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self.backoff(attempt, e, deadline)
+                if delay is None:
+                    raise e
+            finally:
+                telemetry.add_duration("OpenAIAttempt", time.perf_counter() - start)
+            await asyncio.sleep(delay)
+            attempt += 1
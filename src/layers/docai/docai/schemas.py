@@ -0,0 +1,82 @@
+import collections
+import threading
+import time
+
+import boto3
+
+from docai import constants as c
+from docai import models, telemetry, validators
+
+
+class CachedSchema:
+    def __init__(self, item: dict) -> None:
+        self.item = item
+        # Schema definitions were checked when the schema was created, and versions
+        # are immutable, so the model is built without running the validators again.
+        # That skips coercion too, so the fields DynamoDB returns as other types are
+        # converted here.
+        tokens = item.get("number_of_tokens")
+        self.model = models.SchemaModel.construct(
+            **dict(
+                item,
+                schema_status=models.SchemaStatus(
+                    item.get("schema_status", models.SchemaStatus.ACTIVE)
+                ),
+                number_of_tokens=None if tokens is None else int(tokens),
+            )
+        )
+        self.fetched_at = time.monotonic()
+
+    @property
+    def validator(self) -> validators.SchemaValidator:
+        """The compiled validator of the schema version"""
+        key = (self.item["schema_name"], self.item["schema_version"])
+        return validators.get_validator(self.item["schema_definition"], key)
+
+
+class SchemaCache:
+    """An in-process LRU cache of schema versions with a TTL.
+
+    Only `schema_status` of a schema version ever changes, so the TTL bounds how long
+    another container may keep extracting with a schema after it is deleted. The
+    schema management endpoints read the table directly.
+    """
+
+    def __init__(
+        self,
+        table: boto3.resource,
+        maxsize: int = c.SCHEMA_CACHE_SIZE,
+        ttl: int = c.SCHEMA_CACHE_TTL,
+    ) -> None:
+        self.__table = table
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__entries: collections.OrderedDict[
+            tuple[str, str], CachedSchema
+        ] = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, schema_name: str, schema_version: str) -> CachedSchema | None:
+        """Get a schema version from the cache, fetching it from the table on a miss"""
+        key = (schema_name, schema_version)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry and time.monotonic() - entry.fetched_at < self.__ttl:
+                self.__entries.move_to_end(key)
+                telemetry.add_count("SchemaCacheHit")
+                return entry
+
+        telemetry.add_count("SchemaCacheMiss")
+        item = self.__table.get_item(
+            Key=dict(schema_name=schema_name, schema_version=schema_version)
+        ).get("Item")
+        if not item:
+            return None
+
+        entry = CachedSchema(item)
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__maxsize:
+                self.__entries.popitem(last=False)
+        return entry
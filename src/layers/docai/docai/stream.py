@@ -1,14 +1,43 @@
+import asyncio
 import base64
+import collections
 import concurrent.futures
+import functools
+import json
+import multiprocessing
+import multiprocessing.context
+import os
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Iterable, Iterator
 
 import boto3
-import fitz
+from botocore.exceptions import ClientError
 
-from docai import models, utils
+from docai import codec
+from docai import constants as c
+from docai import deadline as dl
+from docai import encoding
+from docai import exceptions as exc
+from docai import models, relevance, telemetry, uploads, utils
 
-DPI = 300
-DEFAULT_IMAGE_FORMAT = "png"
-DEFAULT_IMAGE_MIME_TYPE = models.MimeTypeEnum.PNG.value
+if TYPE_CHECKING:
+    import fitz
+
+PAGES_PREFIX = "pages"
+MANIFESTS_PREFIX = "manifests"
+DOCUMENTS_PREFIX = "documents"
+UPLOADS_PREFIX = "uploads"  # documents uploaded by clients, referenced by their key
+IMAGE_PAGE = "(This page is provided as an image.)"
+DATA_URL_PREFIX = "data:"
+TEXT_LAYER_PUNCTUATION = set(".,;:!?'\"()[]{}<>-_/\\@#$%&*+=|~`^–—‘’“”•€£¥°§")
+# PyMuPDF cannot be used from several threads at once, even on separate documents,
+# and the batch run and the async client prepare several requests at once
+PDF_LOCK = threading.RLock()
+RenderContext = (
+    multiprocessing.context.ForkServerContext | multiprocessing.context.SpawnContext
+)
 
 
 def is_image(mime_type: str) -> bool:
@@ -33,15 +62,183 @@ def is_text(mime_type: str) -> bool:
     return mime_type == models.MimeTypeEnum.TXT.value
 
 
-def load_pdf(data: str) -> list[bytes]:
+def render_workers(pages: int) -> int:
+    """Return the number of processes used to render `pages` PDF pages.
+
+    Starting a worker and sending it the document costs more than rendering a few
+    pages, so each worker gets at least `MIN_PAGES_PER_WORKER` of them.
+    """
+    if c.RENDER_WORKERS > 0:
+        workers = c.RENDER_WORKERS
+    elif hasattr(os, "sched_getaffinity"):
+        workers = len(os.sched_getaffinity(0))
+    else:
+        workers = os.cpu_count() or 1
+    return min(workers, pages // max(c.MIN_PAGES_PER_WORKER, 1))
+
+
+@functools.cache
+def render_context() -> RenderContext:
+    """Return the context starting the processes that render PDF pages.
+
+    Workers are started by a fork server rather than forked from this process, whose
+    other threads may hold locks (of MuPDF, boto3 or logging) that a forked child
+    would inherit held. The server preloads the rendering modules, so starting a
+    worker stays cheap.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["fitz", __name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def _render_worker(
+    decoded: bytes,
+    page_numbers: list[int],
+    profile: models.EncodingProfile,
+    conn: Connection,
+) -> None:
+    """Render the given pages of the document into `conn`."""
+    import fitz
+
+    with fitz.open(stream=decoded, filetype="pdf") as pages:
+        for index in page_numbers:
+            conn.send_bytes(encoding.render_page(pages[index], profile))
+    conn.close()
+
+
+def _iter_pdf_parallel(
+    decoded: bytes,
+    page_numbers: list[int],
+    workers: int,
+    profile: models.EncodingProfile,
+) -> Iterator[bytes]:
+    """Render the pages of the document across worker processes and yield them in order.
+
+    Lambda has no `/dev/shm`, so process pools (which need semaphores) are not usable
+    there. Each worker is a plain process that opens the document once, renders every
+    `workers`-th page of `page_numbers` and streams them back through its own pipe.
+    Reading the pipes round robin restores the page order, and since a pipe only
+    buffers a page or so, a worker never renders far ahead of the consumer.
+    """
+    ctx = render_context()
+    processes, connections = [], []
+    for i in range(workers):
+        receiver, sender = ctx.Pipe(duplex=False)
+        args = (decoded, page_numbers[i::workers], profile, sender)
+        process = ctx.Process(target=_render_worker, args=args, daemon=True)
+        process.start()
+        sender.close()
+        processes.append(process)
+        connections.append(receiver)
+
+    try:
+        for position, index in enumerate(page_numbers):
+            try:
+                yield connections[position % workers].recv_bytes()
+            except EOFError:
+                raise RuntimeError(f"Rendering worker exited before page {index}")
+    finally:
+        for conn in connections:
+            conn.close()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def _iter_pdf(
+    decoded: bytes,
+    page_numbers: list[int] | None = None,
+    workers: int | None = None,
+    profile: models.EncodingProfile | None = None,
+) -> Iterator[bytes]:
+    """Yield the given pages (all by default) of a decoded PDF as images in page order."""
+    profile = profile or encoding.get_profile()
+    import fitz
+
+    with PDF_LOCK:
+        pages = fitz.open(stream=decoded, filetype="pdf")
+    try:
+        if page_numbers is None:
+            page_numbers = list(range(len(pages)))
+        workers = min(workers or render_workers(len(page_numbers)), len(page_numbers))
+        if workers <= 1:
+            for index in page_numbers:
+                # The lock is not held across the yield, while the page is uploaded
+                with PDF_LOCK:
+                    content = encoding.render_page(pages[index], profile)
+                yield content
+            return
+    finally:
+        with PDF_LOCK:
+            pages.close()
+    yield from _iter_pdf_parallel(decoded, page_numbers, workers, profile)
+
+
+def iter_pdf(
+    data: str,
+    workers: int | None = None,
+    page_numbers: list[int] | None = None,
+    profile: models.EncodingProfile | None = None,
+) -> Iterator[bytes]:
+    """Given a base64 encoded string, yield the pages of the document as images in page order."""
+    return _iter_pdf(base64.b64decode(data), page_numbers, workers, profile)
+
+
+def page_text(page: "fitz.Page") -> str | None:
+    """Return the text layer of a PDF page, or None if it is missing or unusable.
+
+    Scanned pages have no text at all, and broken font encodings produce text that is
+    mostly replacement characters or symbols, so a page only counts as text when it
+    has enough characters and most of them are letters, digits or punctuation.
+    """
+    text = page.get_text("text").strip()
+    characters = [char for char in text if not char.isspace()]
+    if len(characters) < c.TEXT_LAYER_MIN_CHARS:
+        return None
+    readable = sum(
+        char.isalnum() or char in TEXT_LAYER_PUNCTUATION for char in characters
+    )
+    if readable / len(characters) < c.TEXT_LAYER_MIN_QUALITY:
+        return None
+    return text
+
+
+def load_pdf_text(decoded: bytes) -> list[str | None]:
+    """Return the text layer of each page of a decoded PDF, None where it is unusable."""
+    import fitz
+
+    with PDF_LOCK, fitz.open(stream=decoded, filetype="pdf") as pages:
+        return [page_text(page) for page in pages]
+
+
+def load_pdf_raw_text(decoded: bytes) -> list[str]:
+    """Return the text layer of each page of a decoded PDF as is, to search it."""
+    import fitz
+
+    with PDF_LOCK, fitz.open(stream=decoded, filetype="pdf") as pages:
+        return [page.get_text("text") for page in pages]
+
+
+def format_pages(texts: list[str | None], numbers: list[int] | None = None) -> str:
+    """Join the text of the pages, pointing the model at the images for the others."""
+    sections = []
+    numbers = numbers or list(range(1, len(texts) + 1))
+    for number, text in zip(numbers, texts):
+        body = text if text is not None else IMAGE_PAGE
+        sections.append(f"## Page {number}\n\n{body}")
+    return "\n\n".join(sections)
+
+
+def load_pdf(
+    data: str,
+    workers: int | None = None,
+    profile: models.EncodingProfile | None = None,
+) -> list[bytes]:
     """Given a base64 encoded string, return the contents of document into multiple images"""
-    decoded = base64.b64decode(data)
-    pages = fitz.open(stream=decoded, filetype="pdf")
-    images = []
-    for page in pages:
-        image = page.get_pixmap(dpi=DPI)
-        images.append(image.tobytes(output=DEFAULT_IMAGE_FORMAT))
-    return images
+    return list(iter_pdf(data, workers, profile=profile))
 
 
 def load_image(data: str) -> list[bytes]:
@@ -49,13 +246,42 @@ def load_image(data: str) -> list[bytes]:
     return [base64.b64decode(data)]
 
 
-def load_media(content: str, mime_type: str) -> tuple[list[bytes], str]:
-    """Given a base64 encoded string, return the contents of the document as a list of bytes and mime type."""
+def load_media(
+    content: str, mime_type: str, profile: models.EncodingProfile | None = None
+) -> tuple[Iterator[bytes], str]:
+    """Given a base64 encoded string, return a lazy iterator over the pages of the document and mime type."""
     if is_pdf(mime_type):
-        return load_pdf(content), DEFAULT_IMAGE_MIME_TYPE
+        profile = profile or encoding.get_profile()
+        return iter_pdf(content, profile=profile), profile.mime_type
     if is_image(mime_type):
-        return load_image(content), mime_type
-    return [], mime_type
+        return iter(load_image(content)), mime_type
+    return iter([]), mime_type
+
+
+def data_url(content: bytes, mime_type: str) -> str:
+    """Return the content as a data URL, to send it in the request itself."""
+    return f"{DATA_URL_PREFIX}{mime_type};base64,{base64.b64encode(content).decode()}"
+
+
+def is_data_url(key: str) -> bool:
+    """Return True if the image is sent inline rather than stored in S3."""
+    return key.startswith(DATA_URL_PREFIX)
+
+
+def redact_data_url(url: str) -> str:
+    """Return a data URL without its content, to record it."""
+    return url.split(",", 1)[0] + ",..." if is_data_url(url) else url
+
+
+def document_body(content: str, mime_type: str) -> bytes:
+    """Return the bytes of a document given as in a request, base64 unless text."""
+    return content.encode() if is_text(mime_type) else base64.b64decode(content)
+
+
+def load_document(s3: boto3.client, bucket_name: str, key: str, mime_type: str) -> str:
+    """Load a document stored in S3 as the content a request would give."""
+    body = s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+    return body.decode() if is_text(mime_type) else base64.b64encode(body).decode()
 
 
 def create_key(request_id: str | None = None) -> str:
@@ -64,55 +290,341 @@ def create_key(request_id: str | None = None) -> str:
     return f"{prefix}/{utils.guid()}"
 
 
+def media_prefix(
+    content: str,
+    profile: models.EncodingProfile,
+    pages: list[int] | None = None,
+    inline_limit: int = 0,
+) -> str:
+    """Return the content address of the rendered pages of a document.
+
+    The address covers the document and every setting that changes which pages are
+    rendered and how, so a document is only rendered again when one of them changes.
+    """
+    settings = dict(
+        profile=profile.dict(),
+        text_layer=c.PDF_TEXT_LAYER,
+        text_layer_min_chars=c.TEXT_LAYER_MIN_CHARS,
+        text_layer_min_quality=c.TEXT_LAYER_MIN_QUALITY,
+    )
+    if pages is not None:
+        settings["pages"] = pages
+    if inline_limit:
+        settings["inline_limit"] = inline_limit
+        settings["inline_total"] = c.INLINE_IMAGES_MAX_BYTES
+    fingerprint = utils.content_hash(json.dumps(settings, sort_keys=True))[:16]
+    return f"{utils.content_hash(content)}/{fingerprint}"
+
+
+def load_manifest(s3: boto3.client, bucket_name: str, prefix: str) -> dict | None:
+    """Return the manifest of a previously rendered document, or None.
+
+    The manifest is the existence check for the whole document. It is written after
+    all the pages and expires before them (see the bucket lifecycle rules), so the
+    pages it lists are always there. Pages are never skipped on upload, which keeps
+    their age in line with the manifest.
+    """
+    key = f"{MANIFESTS_PREFIX}/{prefix}.json"
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise e
+    return codec.loads(response["Body"].read())
+
+
+def save_manifest(
+    s3: boto3.client, bucket_name: str, prefix: str, text_data: str, image_list: list
+) -> None:
+    """Save the manifest of a rendered document once all of its pages are uploaded."""
+    body = codec.dumps(dict(text_data=text_data, image_list=image_list))
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=f"{MANIFESTS_PREFIX}/{prefix}.json",
+        Body=body.encode(),
+        ContentType="application/json",
+    )
+
+
 def save_to_s3(
-    s3: boto3.client, bucket_name: str, content: bytes, mime_type: str
+    s3: boto3.client,
+    bucket_name: str,
+    content: bytes,
+    mime_type: str,
+    key: str | None = None,
 ) -> str:
     """Save the content to S3 and return the key."""
-    key = create_key()
-    s3.put_object(Bucket=bucket_name, Key=key, Body=content, ContentType=mime_type)
+    key = key or create_key()
+    response = s3.put_object(
+        Bucket=bucket_name, Key=key, Body=content, ContentType=mime_type
+    )
+    # Throttled puts are retried by the client, adaptively slowing down its requests
+    retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    if retries:
+        telemetry.add_count("S3UploadRetries", retries)
     return key
 
 
 def save_media(
-    s3: boto3.client, bucket_name: str, data: list[bytes], mime_type: str
+    s3: boto3.client,
+    bucket_name: str,
+    data: Iterable[bytes],
+    mime_type: str,
+    window: int = c.PAGE_WINDOW,
+    prefix: str | None = None,
+    deadline: dl.Deadline | None = None,
+    inline_limit: int = 0,
 ) -> list[str]:
-    """Save the media to S3 and return the keys."""
+    """Save the media to S3 and return the keys in page order.
+
+    Pages are pulled from `data` lazily and at most `window` of them are held in memory
+    at any time, so rendering the next page overlaps with uploading the previous ones.
+    With a content address `prefix` the pages are stored under
+    `pages/<prefix>/<index>.<ext>`, otherwise under random keys. Pages stop being
+    rendered once the `deadline` has passed.
+
+    Pages of at most `inline_limit` bytes are returned as data URLs instead of being
+    uploaded, until `INLINE_IMAGES_MAX_BYTES` of them are. Uploads run on the upload
+    pool of the process, which the concurrent requests share.
+    """
+    extension = mime_type.split("/")[-1]
+    inline_budget = c.INLINE_IMAGES_MAX_BYTES if inline_limit else 0
+
+    def inline(content: bytes) -> concurrent.futures.Future[str]:
+        future: concurrent.futures.Future[str] = concurrent.futures.Future()
+        future.set_result(data_url(content, mime_type))
+        return future
+
+    def fn(index: int, content: bytes) -> str:
+        key = f"{PAGES_PREFIX}/{prefix}/{index:04d}.{extension}" if prefix else None
+        key = save_to_s3(s3, bucket_name, content, mime_type, key)
+        timings["uploaded"] = max(timings["uploaded"], time.perf_counter())
+        return key
 
-    def fn(content: bytes) -> str:
-        return save_to_s3(s3, bucket_name, content, mime_type)
+    def wait(future: concurrent.futures.Future[str]) -> str:
+        start = time.perf_counter()
+        key = future.result()
+        timings["upload"] += time.perf_counter() - start
+        return key
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        for content in data:
-            futures.append(executor.submit(fn, content))
-        return [future.result() for future in concurrent.futures.as_completed(futures)]
+    keys: list[str] = []
+    inlined = uploaded = 0
+    timings = {"render": 0.0, "upload": 0.0, "uploaded": 0.0}
+    pending: collections.deque[concurrent.futures.Future[str]] = collections.deque()
+    pages = iter(data)
+    start = time.perf_counter()
+    try:
+        while True:
+            if deadline:
+                deadline.check("rendering the pages")
+            render_start = time.perf_counter()
+            content = next(pages, None)
+            timings["render"] += time.perf_counter() - render_start
+            if content is None:
+                break
+            if len(content) <= min(inline_limit, inline_budget):
+                inline_budget -= len(content)
+                inlined += 1
+                pending.append(inline(content))
+            else:
+                uploaded += len(content)
+                index = len(keys) + len(pending)
+                pending.append(uploads.pool.submit(fn, index, content))
+            del content
+            # Waiting on the oldest page keeps the keys in page order
+            if len(pending) >= max(window, 1):
+                keys.append(wait(pending.popleft()))
+        while pending:
+            keys.append(wait(pending.popleft()))
+    finally:
+        for future in pending:
+            future.cancel()
+        # Stops the rendering of a document that failed, rather than on collection
+        close = getattr(pages, "close", None)
+        if close:
+            close()
+
+    if keys:
+        telemetry.add_duration("PagePipelineRender", timings["render"])
+        telemetry.add_duration("PagePipelineUploadWait", timings["upload"])
+        telemetry.add_duration("PagePipelineTotal", time.perf_counter() - start)
+        telemetry.add_count("PagePipelinePages", len(keys))
+        telemetry.add_count("PagePipelineInlinePages", inlined)
+        if uploaded:
+            seconds = timings["uploaded"] - start
+            telemetry.add_throughput("PagePipelineUploadThroughput", uploaded, seconds)
+        telemetry.add_peak_memory("PagePipelinePeakMemory")
+    return keys
 
 
 def generate_presigned_url(
     s3: boto3.client, bucket_name: str, keys: list[str]
 ) -> dict[str, str]:
-    """Generate a presigned URL for the given keys."""
-    return {
-        key: s3.generate_presigned_url(
-            "get_object", Params=dict(Bucket=bucket_name, Key=key), ExpiresIn=300
-        )
-        for key in keys
-    }
+    """Generate a presigned URL for the given keys, images sent inline are kept as is."""
+    urls = {}
+    for index, key in enumerate(keys):
+        if is_data_url(key):
+            urls[f"inline/{index:04d}/{utils.content_hash(key)[:16]}"] = key
+        else:
+            urls[key] = s3.generate_presigned_url(
+                "get_object", Params=dict(Bucket=bucket_name, Key=key), ExpiresIn=300
+            )
+    return urls
+
+
+async def generate_presigned_url_async(
+    s3: boto3.client, bucket_name: str, keys: list[str]
+) -> dict[str, str]:
+    """Generate presigned URLs for the given keys without blocking the event loop."""
+    # Signing is local, but the first call may block on fetching credentials
+    return await asyncio.to_thread(generate_presigned_url, s3, bucket_name, keys)
+
+
+async def save_to_s3_async(
+    s3: boto3.client,
+    bucket_name: str,
+    content: bytes,
+    mime_type: str,
+    key: str | None = None,
+) -> str:
+    """Save content to S3 without blocking the event loop."""
+    return await asyncio.to_thread(save_to_s3, s3, bucket_name, content, mime_type, key)
 
 
 def prepare_extraction_request(
-    schema: dict, document: dict, s3: boto3.client, bucket_name: str
+    schema: dict,
+    document: dict,
+    s3: boto3.client,
+    bucket_name: str,
+    deadline: dl.Deadline | None = None,
+    select_pages: bool = c.PAGE_SELECTION,
+    inline_limit: int = 0,
+    reference: bool = False,
 ) -> dict:
-    """Given a schema and document, return a dictionary with the data for the LLM request."""
+    """Given a schema and document, return a dictionary with the data for the LLM request.
+
+    With `select_pages`, only the pages of a PDF relevant to the schema are rendered
+    and sent, their numbers are returned as `selected_pages`. Pages up to
+    `inline_limit` bytes are sent as data URLs rather than through S3, which only
+    suits requests extracted right away. With `reference`, the text and pages of a
+    rendered document are returned as the prefix of their manifest, see
+    `load_extraction_request`.
+    """
     schema_data = schema["schema_definition"]
     mime_type = document["mime_type"]
 
-    text_data = document["content"] if is_text(mime_type) else ""
-    image_list = None
+    if is_text(mime_type):
+        return dict(
+            text_data=document["content"], image_list=[], schema_definition=schema_data
+        )
+
+    text_data = ""
+    selected = None
+    if is_pdf(mime_type):
+        decoded = base64.b64decode(document["content"])
+        if select_pages:
+            selected = relevance.select_pages(load_pdf_raw_text(decoded), schema_data)
+    selected_pages = [index + 1 for index in selected] if selected else None
+
+    profile = encoding.resolve_profile(schema, document)
+    prefix = media_prefix(document["content"], profile, selected, inline_limit)
+    manifest = load_manifest(s3, bucket_name, prefix)
+    if manifest is not None and reference:
+        telemetry.add_count("PageCacheHit")
+        return dict(
+            manifest=prefix,
+            schema_definition=schema_data,
+            selected_pages=selected_pages,
+        )
+    if manifest is not None:
+        telemetry.add_count("PageCacheHit")
+        return dict(
+            **manifest, schema_definition=schema_data, selected_pages=selected_pages
+        )
+    telemetry.add_count("PageCacheMiss")
 
-    data, new_mime_type = load_media(document["content"], mime_type)
-    image_list = save_media(s3, bucket_name, data, new_mime_type)
+    if is_pdf(mime_type) and c.PDF_TEXT_LAYER:
+        # Born-digital pages go to the model as text, only pages without a usable
+        # text layer are rendered, uploaded and sent to the vision model
+        texts = load_pdf_text(decoded)
+        indexes = selected or list(range(len(texts)))
+        image_pages = [index for index in indexes if texts[index] is None]
+        telemetry.add_count("PdfTextPages", len(indexes) - len(image_pages))
+        telemetry.add_count("PdfImagePages", len(image_pages))
+        if len(image_pages) < len(indexes):
+            numbers = [index + 1 for index in indexes]
+            text_data = format_pages([texts[index] for index in indexes], numbers)
+        pages = _iter_pdf(decoded, image_pages, profile=profile)
+        new_mime_type = profile.mime_type
+    elif is_pdf(mime_type):
+        pages = _iter_pdf(decoded, selected, profile=profile)
+        new_mime_type = profile.mime_type
+    else:
+        pages, new_mime_type = load_media(document["content"], mime_type, profile)
+    image_list = save_media(
+        s3,
+        bucket_name,
+        pages,
+        new_mime_type,
+        prefix=prefix,
+        deadline=deadline,
+        inline_limit=inline_limit,
+    )
+    # Pages sent inline are rendered again rather than stored in the manifest, which
+    # would then be written and read back in full on every request
+    if not any(is_data_url(key) for key in image_list):
+        save_manifest(s3, bucket_name, prefix, text_data, image_list)
 
+    if reference:
+        return dict(
+            manifest=prefix,
+            schema_definition=schema_data,
+            selected_pages=selected_pages,
+        )
     return dict(
-        text_data=text_data, image_list=image_list, schema_definition=schema_data
+        text_data=text_data,
+        image_list=image_list,
+        schema_definition=schema_data,
+        selected_pages=selected_pages,
+    )
+
+
+def load_extraction_request(s3: boto3.client, bucket_name: str, params: dict) -> dict:
+    """Return a request prepared with `reference`, with its text and pages loaded.
+
+    Queued requests refer to the manifest, since the text layer of a long PDF alone
+    can outgrow an SQS message. The manifest outlives the time a message waits in
+    the queue (see the bucket lifecycle rules) unless the queue is backed up for days.
+    """
+    params = dict(params)
+    prefix = params.pop("manifest", None)
+    if prefix is None:
+        return params
+    manifest = load_manifest(s3, bucket_name, prefix)
+    if manifest is None:
+        raise exc.ManifestDoesNotExist
+    return dict(params, **manifest)
+
+
+async def prepare_extraction_request_async(
+    schema: dict,
+    document: dict,
+    s3: boto3.client,
+    bucket_name: str,
+    deadline: dl.Deadline | None = None,
+    select_pages: bool = c.PAGE_SELECTION,
+    inline_limit: int = 0,
+) -> dict:
+    """Prepare the extraction request without blocking the event loop."""
+    # Rendering runs in worker processes and uploads in a thread pool already
+    return await asyncio.to_thread(
+        prepare_extraction_request,
+        schema,
+        document,
+        s3,
+        bucket_name,
+        deadline,
+        select_pages,
+        inline_limit,
     )
@@ -0,0 +1,202 @@
+import copy
+import json
+from typing import Any
+
+from docai import codec
+from docai import constants as c
+from docai import telemetry
+
+# Keywords the API accepts in a strict JSON schema. Others are dropped from the schema
+# sent to the model, the output is still validated against the full schema.
+STRICT_KEYWORDS = {
+    "type",
+    "properties",
+    "required",
+    "additionalProperties",
+    "items",
+    "enum",
+    "const",
+    "anyOf",
+    "$ref",
+    "$defs",
+    "description",
+}
+DEFINITIONS = ("$defs", "definitions")
+
+
+class UnsupportedSchema(Exception):
+    """The schema cannot be expressed as a strict JSON schema"""
+
+
+def supports_structured_outputs(model: str) -> bool:
+    """Whether the API can constrain the output of a model to a JSON schema"""
+    if model in c.STRUCTURED_OUTPUT_EXCLUDED_MODELS:
+        return False
+    return model.startswith(c.STRUCTURED_OUTPUT_MODELS)
+
+
+def response_mode(model: str) -> str:
+    """Return how the output of a model is constrained, `json_schema` or `prompt`"""
+    if c.RESPONSE_FORMAT == "auto":
+        return "json_schema" if supports_structured_outputs(model) else "prompt"
+    return c.RESPONSE_FORMAT
+
+
+def _resolve(schema: dict, root: dict) -> dict:
+    ref = schema.get("$ref")
+    if ref is None:
+        return schema
+    if not ref.startswith("#/"):
+        raise UnsupportedSchema(f"Only local references are supported, got {ref}")
+    target: Any = root
+    for token in ref[2:].split("/"):
+        target = target[token.replace("~1", "/").replace("~0", "~")]
+    return _resolve(target, root)
+
+
+class _Translator:
+    def __init__(self, root: dict) -> None:
+        self.root = root
+        self.dropped: set[str] = set()
+
+    def ref(self, ref: str) -> str:
+        for name in DEFINITIONS:
+            prefix = f"#/{name}/"
+            if ref.startswith(prefix):
+                return "#/$defs/" + ref[len(prefix) :]
+        raise UnsupportedSchema(
+            f"Only references to definitions are supported, got {ref}"
+        )
+
+    def merge(self, branches: list[dict]) -> dict:
+        """Merge the object schemas of an `allOf` into one object schema"""
+        merged: dict = {"type": "object", "properties": {}, "required": []}
+        for branch in branches:
+            branch = _resolve(branch, self.root)
+            if "allOf" in branch:
+                branch = self.merge(branch["allOf"])
+            if "properties" not in branch:
+                raise UnsupportedSchema("allOf is only supported over object schemas")
+            merged["properties"].update(branch["properties"])
+            merged["required"] += branch.get("required", [])
+            if "description" in branch:
+                merged.setdefault("description", branch["description"])
+        return merged
+
+    def node(self, schema: Any) -> Any:
+        if not isinstance(schema, dict):
+            return schema
+        if "$ref" in schema:
+            node: dict[str, Any] = {"$ref": self.ref(schema["$ref"])}
+            if "description" in schema:
+                node["description"] = schema["description"]
+            return node
+        if "allOf" in schema:
+            rest = {k: v for k, v in schema.items() if k != "allOf"}
+            schema = {**self.merge(schema["allOf"]), **rest}
+
+        node = {}
+        for keyword, value in schema.items():
+            if keyword == "oneOf":
+                # Looser than oneOf, exclusivity is checked by the local validation
+                keyword = "anyOf"
+            if keyword in DEFINITIONS or keyword == "required":
+                continue  # see `object` and `translate`
+            if keyword not in STRICT_KEYWORDS:
+                self.dropped.add(keyword)
+                continue
+            if keyword == "properties":
+                node[keyword] = {k: self.node(v) for k, v in value.items()}
+            elif keyword == "anyOf":
+                node[keyword] = [self.node(branch) for branch in value]
+            elif keyword == "items":
+                node[keyword] = self.node(value)
+            elif keyword == "additionalProperties" and value is not False:
+                raise UnsupportedSchema("Objects with additional properties")
+            else:
+                node[keyword] = copy.deepcopy(value)
+
+        if node.get("type") == "object" or "properties" in node:
+            self.object(node, schema)
+        return node
+
+    def object(self, node: dict, schema: dict) -> None:
+        """Make every property required, the optional ones nullable instead"""
+        if "properties" not in node:
+            raise UnsupportedSchema("Objects without properties")
+        required = set(schema.get("required", []))
+        for name, value in node["properties"].items():
+            if name not in required:
+                node["properties"][name] = nullable(value)
+        node["required"] = list(node["properties"])
+        node["additionalProperties"] = False
+
+    def translate(self) -> dict:
+        schema = self.node(self.root)
+        if schema.get("type") != "object":
+            raise UnsupportedSchema("The root of the schema must be an object")
+        definitions = {}
+        for name in DEFINITIONS:
+            for key, value in self.root.get(name, {}).items():
+                definitions[key] = self.node(value)
+        if definitions:
+            schema["$defs"] = definitions
+        return schema
+
+
+def nullable(schema: dict) -> dict:
+    kind = schema.get("type")
+    if isinstance(kind, str) and "enum" not in schema:
+        return {**schema, "type": [kind, "null"]}
+    if isinstance(kind, list) and "enum" not in schema:
+        return schema if "null" in kind else {**schema, "type": [*kind, "null"]}
+    return {"anyOf": [schema, {"type": "null"}]}
+
+
+def strict_schema(schema_definition: dict) -> tuple[dict, set[str]]:
+    """Translate a schema definition into a strict JSON schema for the API.
+
+    Returns the schema and the keywords dropped from it. Optional properties become
+    required but nullable, since strict schemas require every property, and the
+    nulls the model fills them with are removed by `drop_added_nulls`.
+    """
+    translator = _Translator(schema_definition)
+    return translator.translate(), translator.dropped
+
+
+def response_format(schema_definition: dict) -> dict:
+    """Return the response format constraining the output to a schema definition"""
+    schema, dropped = strict_schema(schema_definition)
+    if dropped:
+        telemetry.logger.debug("Keywords left to validation", keywords=sorted(dropped))
+    name = str(schema_definition.get("title") or "extraction")
+    name = "".join(ch if ch.isalnum() or ch in "_-" else "_" for ch in name)[:64]
+    # Schemas read from DynamoDB hold Decimal numbers, which the SDK cannot serialize
+    schema = json.loads(codec.dumps(schema))
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema},
+    }
+
+
+def drop_added_nulls(data: Any, schema: Any, root: dict | None = None) -> Any:
+    """Remove the nulls of optional properties made nullable by `strict_schema`"""
+    root = root if root is not None else schema
+    if not isinstance(schema, dict):
+        return data
+    schema = _resolve(schema, root)
+    if isinstance(data, dict):
+        for branch in schema.get("allOf", []):
+            drop_added_nulls(data, branch, root)
+        required = set(schema.get("required", []))
+        for name, value in schema.get("properties", {}).items():
+            if name not in data:
+                continue
+            if data[name] is None and name not in required:
+                del data[name]
+            else:
+                drop_added_nulls(data[name], value, root)
+    elif isinstance(data, list) and isinstance(schema.get("items"), dict):
+        for item in data:
+            drop_added_nulls(item, schema["items"], root)
+    return data
@@ -0,0 +1,49 @@
+import contextlib
+import resource
+import time
+from typing import Iterator
+
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+
+# Powertools loggers and metrics share their state per service/namespace, so the
+# records emitted here are flushed by the handler's own `metrics.log_metrics`.
+logger = Logger()
+metrics = Metrics()
+
+# Imported early by every handler, so this marks the start of the cold start init
+loaded_at = time.perf_counter()
+
+
+def add_count(name: str, value: int = 1) -> None:
+    """Add a count metric"""
+    metrics.add_metric(name=name, unit=MetricUnit.Count, value=value)
+
+
+def add_duration(name: str, seconds: float) -> None:
+    """Add a duration metric in milliseconds"""
+    metrics.add_metric(name=name, unit=MetricUnit.Milliseconds, value=seconds * 1000)
+
+
+def add_throughput(name: str, size: int, seconds: float) -> None:
+    """Add a throughput metric in bytes per second"""
+    if seconds > 0:
+        unit = MetricUnit.BytesPerSecond
+        metrics.add_metric(name=name, unit=unit, value=size / seconds)
+
+
+def add_peak_memory(name: str) -> int:
+    """Add the peak resident memory of the process in kilobytes and return it"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics.add_metric(name=name, unit=MetricUnit.Kilobytes, value=peak)
+    return peak
+
+
+@contextlib.contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Time the enclosed block and add it as a duration metric"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_duration(name, time.perf_counter() - start)
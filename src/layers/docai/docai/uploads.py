@@ -0,0 +1,45 @@
+import concurrent.futures
+import threading
+from typing import Any, Callable, TypeVar
+
+from docai import constants as c
+
+T = TypeVar("T")
+
+
+class UploadPool:
+    """A pool of threads uploading to S3, shared by the requests of a process.
+
+    The pool is created on first use and kept across the invocations of a warm
+    container, rather than a pool being started and joined by every request. Its
+    size matches the connections the S3 client keeps, so uploads never wait on or
+    discard a connection. Results are futures, callers wait on them in the order
+    they need.
+    """
+
+    def __init__(self, workers: int = c.UPLOAD_WORKERS) -> None:
+        self.__workers = max(workers, 1)
+        self.__executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self.__lock = threading.Lock()
+
+    @property
+    def workers(self) -> int:
+        return self.__workers
+
+    def __get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self.__executor is None:
+            with self.__lock:
+                if self.__executor is None:
+                    self.__executor = concurrent.futures.ThreadPoolExecutor(
+                        self.__workers, thread_name_prefix="upload"
+                    )
+        return self.__executor
+
+    def submit(
+        self, fn: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> concurrent.futures.Future[T]:
+        """Run `fn` on the pool"""
+        return self.__get_executor().submit(fn, *args, **kwargs)
+
+
+pool = UploadPool()
@@ -1,26 +1,31 @@
+import concurrent.futures
 import datetime
-import decimal
-import json
+import functools
+import hashlib
 import os
 import random
-import re
 import string
-from typing import Any
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable
 
 import boto3
-import tiktoken
-from jsonschema import Draft202012Validator as Validator
 
+from docai import codec
 from docai import constants as c
-from docai import exceptions as exc
+from docai import telemetry, validators
+
+if TYPE_CHECKING:
+    import tiktoken
 
 
 class MissingEnvironmentVariable(Exception):
     pass
 
 
+SSM_BATCH_SIZE = 10  # the most parameters get_parameters accepts per call
+
 alphabet = string.ascii_lowercase + string.digits + string.ascii_uppercase
-tokenizer = tiktoken.get_encoding("cl100k_base")
 
 
 def guid(length: int = 10) -> str:
@@ -28,6 +33,15 @@ def guid(length: int = 10) -> str:
     return "".join(random.choices(alphabet, k=length))
 
 
+def content_hash(*parts: str | bytes) -> str:
+    """Return a SHA-256 hex digest of the given parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
 def utcnow() -> str:
     """Return the current UTC time in ISO format"""
     return datetime.datetime.utcnow().isoformat()
@@ -41,14 +55,22 @@ def getenv(name: str) -> str:
         raise MissingEnvironmentVariable(f"Missing environment variable {name}")
 
 
+@functools.cache
+def get_tokenizer() -> "tiktoken.Encoding":
+    """Load the tokenizer on first use, most handlers never count tokens"""
+    import tiktoken
+
+    return tiktoken.get_encoding("cl100k_base")
+
+
 def encode(string: str) -> list[int]:
     """Encode a string into tokens"""
-    return tokenizer.encode(string)
+    return get_tokenizer().encode(string)
 
 
 def decode(tokens: list[int]) -> str:
     """Decode tokens into a string"""
-    return tokenizer.decode(tokens)
+    return get_tokenizer().decode(tokens)
 
 
 def count_tokens(string: str) -> int:
@@ -56,40 +78,124 @@ def count_tokens(string: str) -> int:
     return len(encode(string))
 
 
-def validate_data(data_object: str, schema_definition: dict[str, Any]) -> dict[str, Any]:
-    """Given a JSON string, and a schema definition return a validated JSON data."""
-    match = re.search(r"\{.*\}", data_object.strip(), re.MULTILINE | re.IGNORECASE | re.DOTALL)
-    output = ""
-    if match:
-        output = match.group()
-    data = json.loads(output, strict=False, parse_float=decimal.Decimal)
+def validate_data(
+    data_object: str,
+    schema_definition: dict[str, Any],
+    validator: validators.SchemaValidator | None = None,
+) -> dict[str, Any]:
+    """Given a JSON string, and a schema definition return a validated JSON data.
 
-    try:
-        Validator(schema_definition).validate(data)
-    except Exception:
-        raise exc.InvalidData("Data does not match schema")
+    Without a `validator` the cached validator of the schema definition is used. The
+    raised `InvalidData` carries the path-level errors of the data.
+    """
+    data = codec.extract_json(data_object)
+
+    validator = validator or validators.get_validator(schema_definition)
+    validator.validate(data)
     return data
 
 
+@functools.cache
+def client(service_name: str) -> boto3.client:
+    """Get a boto3 client shared by the process"""
+    return boto3.client(service_name)
+
+
+@functools.cache
+def resource(service_name: str) -> boto3.resource:
+    """Get a boto3 resource shared by the process"""
+    return boto3.resource(service_name)
+
+
+class Lazy:
+    """A proxy that builds the wrapped object on first attribute access.
+
+    Handlers declare their resources at module scope, this keeps the declarations
+    there while the boto3 resources and clients are only built when a request uses
+    them.
+    """
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        self.__factory = factory
+        self.__value: Any = None
+        self.__lock = threading.Lock()
+
+    def __resolve(self) -> Any:
+        if self.__value is None:
+            with self.__lock:
+                if self.__value is None:
+                    self.__value = self.__factory()
+        return self.__value
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.__resolve(), name)
+
+
+# Configuration values of the process, resolved once by `bootstrap` or on first use
+parameter_cache: dict[str, str] = {}
+secret_cache: dict[str, str] = {}
+
+
+def bootstrap(secret_env_names: list[str] | None = None) -> None:
+    """Resolve the configuration of a handler before it serves any request.
+
+    Every `*_PARAMETER_NAME` environment variable names an SSM parameter, so they are
+    all fetched with batched `get_parameters` calls instead of one call each. The
+    secrets named by `secret_env_names` are then fetched concurrently. The values are
+    kept for the life of the process, as handlers resolve them once at import.
+    """
+    start = time.perf_counter()
+    env_names = [name for name in os.environ if name.endswith("_PARAMETER_NAME")]
+    names = sorted({os.environ[name] for name in env_names})
+    for i in range(0, len(names), SSM_BATCH_SIZE):
+        response = client("ssm").get_parameters(Names=names[i : i + SSM_BATCH_SIZE])
+        for parameter in response["Parameters"]:
+            parameter_cache[parameter["Name"]] = parameter["Value"]
+
+    config = Config()
+    secret_names = [config(name) for name in secret_env_names or []]
+    if secret_names:
+        sm = client("secretsmanager")
+
+        def fn(secret_name: str) -> None:
+            value = sm.get_secret_value(SecretId=secret_name)["SecretString"]
+            secret_cache[secret_name] = value
+
+        with concurrent.futures.ThreadPoolExecutor(len(secret_names)) as executor:
+            list(executor.map(fn, secret_names))
+
+    telemetry.add_duration("ConfigBootstrap", time.perf_counter() - start)
+    telemetry.add_duration("ColdStartInit", time.perf_counter() - telemetry.loaded_at)
+
+
 class Config:
     def __init__(self) -> None:
-        self.__ssm = boto3.client("ssm")
+        self.__ssm = client("ssm")
 
     def __call__(self, param_env_name: str) -> str:
         """Get a parameter from SSM"""
         parameter_name = getenv(param_env_name)
-        return self.__ssm.get_parameter(Name=parameter_name)["Parameter"]["Value"]
+        value = parameter_cache.get(parameter_name)
+        if value is None:
+            response = self.__ssm.get_parameter(Name=parameter_name)
+            value = response["Parameter"]["Value"]
+            parameter_cache[parameter_name] = value
+        return value
 
 
 class Secrets:
     def __init__(self) -> None:
-        self.__sm = boto3.client("secretsmanager")
+        self.__sm = client("secretsmanager")
         self.__config = Config()
 
     def __call__(self, param_env_name: str) -> str:
         """Get a secret from Secrets Manager"""
         secret_name = self.__config(param_env_name)
-        return self.__sm.get_secret_value(SecretId=secret_name)["SecretString"]
+        value = secret_cache.get(secret_name)
+        if value is None:
+            value = self.__sm.get_secret_value(SecretId=secret_name)["SecretString"]
+            secret_cache[secret_name] = value
+        return value
 
 
 class Resources:
@@ -99,22 +205,33 @@ class Resources:
     def get_table(self, param_env_name: str) -> boto3.resource:
         """Get a DynamoDB table resource"""
         table_name = self.__config(param_env_name)
-        return boto3.resource("dynamodb").Table(table_name)
+        return Lazy(lambda: resource("dynamodb").Table(table_name))
 
     def get_bucket(self, param_env_name: str) -> boto3.resource:
         """Get a S3 bucket resource"""
         bucket_name = self.__config(param_env_name)
-        return boto3.resource("s3").Bucket(bucket_name)
+        return Lazy(lambda: resource("s3").Bucket(bucket_name))
 
     def get_queue(self, param_env_name: str) -> boto3.resource:
         """Get a SQS queue resource"""
         queue_name = self.__config(param_env_name)
-        return boto3.resource("sqs").get_queue_by_name(QueueName=queue_name)
+        return Lazy(lambda: resource("sqs").get_queue_by_name(QueueName=queue_name))
 
     def get_s3(self) -> boto3.client:
-        """Get a S3 client"""
-        from botocore.client import Config
-
-        endpoint_url = f"https://s3.{c.AWS_REGION}.amazonaws.com"
-        config = Config(signature_version="s3v4", s3={"addressing_style": "virtual"})
-        return boto3.client("s3", endpoint_url=endpoint_url, config=config)
+        """Get a S3 client shared by the process"""
+        return Lazy(s3_client)
+
+
+@functools.cache
+def s3_client() -> boto3.client:
+    """Get the S3 client of the process, with a connection for each upload thread"""
+    from botocore.client import Config
+
+    endpoint_url = f"https://s3.{c.AWS_REGION}.amazonaws.com"
+    config = Config(
+        signature_version="s3v4",
+        s3={"addressing_style": "virtual"},
+        max_pool_connections=c.S3_MAX_POOL_CONNECTIONS,
+        retries={"total_max_attempts": c.S3_MAX_ATTEMPTS, "mode": "adaptive"},
+    )
+    return boto3.client("s3", endpoint_url=endpoint_url, config=config)
@@ -0,0 +1,397 @@
+import collections
+import decimal
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Callable, Hashable, NamedTuple
+
+from docai import constants as c
+from docai import exceptions as exc
+from docai import telemetry
+
+MAX_REPORTED_ERRORS = 20
+
+# Keywords that do not constrain the instance
+ANNOTATIONS = {
+    "$schema",
+    "$id",
+    "$comment",
+    "$defs",
+    "definitions",
+    "title",
+    "description",
+    "default",
+    "examples",
+    "deprecated",
+    "readOnly",
+    "writeOnly",
+    "format",
+    "contentMediaType",
+    "contentEncoding",
+}
+OBJECT_KEYWORDS = {"properties", "required", "additionalProperties"}
+ARRAY_KEYWORDS = {"items", "minItems", "maxItems"}
+STRING_KEYWORDS = {"minLength", "maxLength", "pattern"}
+NUMBER_KEYWORDS = {"minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum"}
+KEYWORDS = (
+    ANNOTATIONS
+    | OBJECT_KEYWORDS
+    | ARRAY_KEYWORDS
+    | STRING_KEYWORDS
+    | NUMBER_KEYWORDS
+    | {"type", "enum", "const", "$ref", "allOf", "anyOf", "oneOf", "not"}
+)
+TYPE_CHECKS = {
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "string": "isinstance({0}, str)",
+    "integer": "(isinstance({0}, int) and not isinstance({0}, bool))",
+    "number": "(isinstance({0}, _numbers) and not isinstance({0}, bool))",
+    "boolean": "isinstance({0}, bool)",
+    "null": "{0} is None",
+}
+NUMBER_LIMITS = (
+    ("minimum", "<", "less than the minimum of"),
+    ("maximum", ">", "greater than the maximum of"),
+    ("exclusiveMinimum", "<=", "less than or equal to the minimum of"),
+    ("exclusiveMaximum", ">=", "greater than or equal to the maximum of"),
+)
+
+
+class ValidationIssue(NamedTuple):
+    path: str
+    message: str
+    parts: tuple = ()
+
+
+class UnsupportedSchema(Exception):
+    pass
+
+
+def format_path(parts: tuple) -> str:
+    """Format the path of a value as a JSONPath, e.g. `$.items[0].name`"""
+    path = "$"
+    for part in parts:
+        if isinstance(part, int):
+            path += f"[{part}]"
+        elif part.isidentifier():
+            path += f".{part}"
+        else:
+            path += f"[{json.dumps(part)}]"
+    return path
+
+
+def format_errors(errors: list[ValidationIssue]) -> str:
+    """Format validation errors as one line per error"""
+    return "\n".join(f"- {error.path}: {error.message}" for error in errors)
+
+
+def _show(value: Any) -> str:
+    return json.dumps(value, default=str)
+
+
+def _equal(one: Any, two: Any) -> bool:
+    # JSON Schema equality, where booleans are never equal to numbers
+    if isinstance(one, bool) or isinstance(two, bool):
+        return type(one) is type(two) and one == two
+    if isinstance(one, list) and isinstance(two, list):
+        return len(one) == len(two) and all(map(_equal, one, two))
+    if isinstance(one, dict) and isinstance(two, dict):
+        return one.keys() == two.keys() and all(_equal(one[k], two[k]) for k in one)
+    return one == two
+
+
+def _in(value: Any, options: list) -> bool:
+    return any(_equal(value, option) for option in options)
+
+
+def _path(parts: list) -> str:
+    # The expression of the path of a value, evaluated only when it is needed
+    return "path + (" + "".join(f"{part}, " for part in parts) + ")"
+
+
+class _Compiler:
+    """Compiles a JSON Schema into the source of Python validation functions.
+
+    Every schema node becomes inline checks on a local variable, and the path of a
+    value is only built when it fails a check.
+    """
+
+    def __init__(self, schema: dict) -> None:
+        self.root = schema
+        self.namespace: dict[str, Any] = {
+            "_numbers": (int, float, decimal.Decimal),
+            "_missing": object(),
+            "_show": _show,
+            "_equal": _equal,
+            "_in": _in,
+        }
+        self.functions: list[str] = []
+        self.refs: dict[str, str] = {}
+        self.count = 0
+
+    def name(self, prefix: str) -> str:
+        self.count += 1
+        return f"{prefix}{self.count}"
+
+    def constant(self, value: Any) -> str:
+        name = self.name("_c")
+        self.namespace[name] = value
+        return name
+
+    def compile(self) -> Callable[[Any, tuple, list], list]:
+        entry = self.function(self.root)
+        source = "\n\n".join(self.functions)
+        exec(compile(source, "<schema>", "exec"), self.namespace)
+        return self.namespace[entry]
+
+    def function(self, schema: Any, name: str | None = None) -> str:
+        """Compile a schema into a function `fn(data, path, errors) -> errors`"""
+        name = name or self.name("_validate")
+        lines = [f"def {name}(data, path, errors):"]
+        self.node(schema, "data", [], lines, 1)
+        lines.append("    return errors")
+        self.functions.append("\n".join(lines))
+        return name
+
+    def ref(self, pointer: str) -> str:
+        if pointer in self.refs:
+            return self.refs[pointer]
+        if pointer != "#" and not pointer.startswith("#/"):
+            raise UnsupportedSchema(f"Unsupported reference {pointer}")
+        schema = self.root
+        for token in pointer[2:].split("/") if pointer != "#" else []:
+            token = token.replace("~1", "/").replace("~0", "~")
+            try:
+                schema = schema[int(token) if isinstance(schema, list) else token]
+            except (KeyError, IndexError, TypeError, ValueError):
+                raise UnsupportedSchema(f"Unresolvable reference {pointer}")
+        # Registered before compiling so recursive references terminate
+        self.refs[pointer] = self.name("_ref")
+        return self.function(schema, self.refs[pointer])
+
+    def var(self) -> str:
+        return self.name("v")
+
+    def error(
+        self, lines: list, level: int, parts: list, message: str, value: str = ""
+    ) -> None:
+        """Append an error for the value at `parts`, prefixed with the value shown"""
+        text = self.constant(message)
+        if value:
+            text = f"_show({value}) + {text}"
+        lines.append(f"{'    ' * level}errors.append(({_path(parts)}, {text}))")
+
+    def node(self, schema: Any, var: str, parts: list, lines: list, level: int) -> None:
+        pad = "    " * level
+        lines.append(f"{pad}pass")
+        if schema is True or schema == {}:
+            return
+        if schema is False:
+            self.error(lines, level, parts, " is not allowed by a false schema", var)
+            return
+        if not isinstance(schema, dict):
+            raise UnsupportedSchema("Schemas must be objects or booleans")
+        unsupported = schema.keys() - KEYWORDS
+        if unsupported:
+            raise UnsupportedSchema(f"Unsupported keywords {sorted(unsupported)}")
+
+        path = _path(parts)
+        if "$ref" in schema:
+            lines.append(f"{pad}{self.ref(schema['$ref'])}({var}, {path}, errors)")
+
+        if "type" in schema:
+            types = schema["type"]
+            types = [types] if isinstance(types, str) else list(types)
+            if any(t not in TYPE_CHECKS for t in types):
+                raise UnsupportedSchema(f"Unsupported type {types}")
+            check = " or ".join(TYPE_CHECKS[t].format(var) for t in types)
+            names = ", ".join(f"'{t}'" for t in types)
+            lines.append(f"{pad}if not ({check}):")
+            self.error(lines, level + 1, parts, f" is not of type {names}", var)
+
+        if "enum" in schema:
+            options = self.constant(list(schema["enum"]))
+            lines.append(f"{pad}if not _in({var}, {options}):")
+            message = f" is not one of {_show(schema['enum'])}"
+            self.error(lines, level + 1, parts, message, var)
+        if "const" in schema:
+            const = self.constant(schema["const"])
+            lines.append(f"{pad}if not _equal({var}, {const}):")
+            message = f"{_show(schema['const'])} was expected"
+            self.error(lines, level + 1, parts, message)
+
+        for branch in schema.get("allOf", []):
+            lines.append(f"{pad}{self.function(branch)}({var}, {path}, errors)")
+        for keyword, test, message in (
+            ("anyOf", "== 0", "any of the given schemas"),
+            ("oneOf", "!= 1", "exactly one of the given schemas"),
+        ):
+            if keyword in schema:
+                branches = ", ".join(self.function(b) for b in schema[keyword])
+                valid = f"sum(1 for fn in ({branches},) if not fn({var}, (), []))"
+                lines.append(f"{pad}if {valid} {test}:")
+                message = f" is not valid under {message}"
+                self.error(lines, level + 1, parts, message, var)
+        if "not" in schema:
+            lines.append(f"{pad}if not {self.function(schema['not'])}({var}, (), []):")
+            message = " should not be valid under the given schema"
+            self.error(lines, level + 1, parts, message, var)
+
+        if schema.keys() & OBJECT_KEYWORDS:
+            self.object(schema, var, parts, lines, level)
+        if schema.keys() & ARRAY_KEYWORDS:
+            self.array(schema, var, parts, lines, level)
+        if schema.keys() & STRING_KEYWORDS:
+            self.string(schema, var, parts, lines, level)
+        if schema.keys() & NUMBER_KEYWORDS:
+            check = f"isinstance({var}, _numbers) and not isinstance({var}, bool)"
+            lines.append(f"{pad}if {check}:")
+            for keyword, op, text in NUMBER_LIMITS:
+                if keyword in schema:
+                    limit = self.constant(schema[keyword])
+                    lines.append(f"{pad}    if {var} {op} {limit}:")
+                    message = f" is {text} {schema[keyword]}"
+                    self.error(lines, level + 2, parts, message, var)
+
+    def object(self, schema: dict, var: str, parts: list, lines: list, level: int):
+        pad = "    " * level
+        lines.append(f"{pad}if isinstance({var}, dict):")
+        for name in schema.get("required", []):
+            lines.append(f"{pad}    if {name!r} not in {var}:")
+            message = f"{_show(name)} is a required property"
+            self.error(lines, level + 2, parts, message)
+
+        properties = schema.get("properties", {})
+        for name, subschema in properties.items():
+            value = self.var()
+            lines.append(f"{pad}    {value} = {var}.get({name!r}, _missing)")
+            lines.append(f"{pad}    if {value} is not _missing:")
+            self.node(subschema, value, [*parts, repr(name)], lines, level + 2)
+
+        additional = schema.get("additionalProperties", True)
+        if additional is True or additional == {}:
+            return
+        key, value = self.var(), self.var()
+        known = self.constant(frozenset(properties))
+        lines.append(f"{pad}    for {key}, {value} in {var}.items():")
+        lines.append(f"{pad}        if {key} not in {known}:")
+        if additional is False:
+            message = " was unexpected, additional properties are not allowed"
+            self.error(lines, level + 3, parts, message, key)
+        else:
+            self.node(additional, value, [*parts, key], lines, level + 3)
+
+    def array(self, schema: dict, var: str, parts: list, lines: list, level: int):
+        pad = "    " * level
+        lines.append(f"{pad}if isinstance({var}, list):")
+        for keyword, op, text in (
+            ("minItems", "<", "short"),
+            ("maxItems", ">", "long"),
+        ):
+            if keyword in schema:
+                lines.append(f"{pad}    if len({var}) {op} {int(schema[keyword])}:")
+                self.error(lines, level + 2, parts, f" is too {text}", var)
+        if "items" in schema:
+            if not isinstance(schema["items"], (dict, bool)):
+                raise UnsupportedSchema("Tuple validation with items is not supported")
+            index, value = self.var(), self.var()
+            lines.append(f"{pad}    for {index}, {value} in enumerate({var}):")
+            self.node(schema["items"], value, [*parts, index], lines, level + 2)
+
+    def string(self, schema: dict, var: str, parts: list, lines: list, level: int):
+        pad = "    " * level
+        lines.append(f"{pad}if isinstance({var}, str):")
+        for keyword, op, text in (
+            ("minLength", "<", "short"),
+            ("maxLength", ">", "long"),
+        ):
+            if keyword in schema:
+                lines.append(f"{pad}    if len({var}) {op} {int(schema[keyword])}:")
+                self.error(lines, level + 2, parts, f" is too {text}", var)
+        if "pattern" in schema:
+            pattern = self.constant(re.compile(schema["pattern"]))
+            lines.append(f"{pad}    if {pattern}.search({var}) is None:")
+            message = f" does not match {_show(schema['pattern'])}"
+            self.error(lines, level + 2, parts, message, var)
+
+
+class SchemaValidator:
+    """Validates data against a schema definition with structured errors.
+
+    Schemas using only the keywords extraction schemas need are compiled into Python
+    functions. Any other schema falls back to the jsonschema validator.
+    """
+
+    def __init__(self, schema_definition: dict) -> None:
+        self.schema_definition = schema_definition
+        try:
+            self.__validate = _Compiler(schema_definition).compile()
+            self.compiled = True
+        except UnsupportedSchema:
+            from jsonschema import Draft202012Validator as JSONValidator
+
+            self.__validator = JSONValidator(schema_definition)
+            self.compiled = False
+
+    def errors(self, data: Any) -> list[ValidationIssue]:
+        """Return the errors of the data, an empty list if it is valid"""
+        if self.compiled:
+            issues = self.__validate(data, (), [])
+            return [ValidationIssue(format_path(p), m, p) for p, m in issues]
+        return [
+            ValidationIssue(format_path(parts), e.message, parts)
+            for e in self.__validator.iter_errors(data)
+            for parts in [tuple(e.absolute_path)]
+        ]
+
+    def validate(self, data: Any) -> None:
+        """Raise `InvalidData` with the errors if the data is not valid"""
+        errors = self.errors(data)
+        if errors:
+            raise exc.InvalidData(
+                "Data does not match schema", errors[:MAX_REPORTED_ERRORS]
+            )
+
+
+class ValidatorCache:
+    """A process-wide LRU cache of validators keyed by schema version"""
+
+    def __init__(self, maxsize: int = c.SCHEMA_CACHE_SIZE) -> None:
+        self.__maxsize = maxsize
+        self.__validators: collections.OrderedDict[
+            Hashable, SchemaValidator
+        ] = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, schema_definition: dict, key: Hashable = None) -> SchemaValidator:
+        """Get the validator of a schema definition, compiling it on a miss.
+
+        Schema versions are immutable, so `key` is usually the schema name and
+        version. Without a key the schema definition itself is hashed.
+        """
+        if key is None:
+            encoded = json.dumps(schema_definition, sort_keys=True, default=str)
+            key = hashlib.sha256(encoded.encode()).hexdigest()
+        with self.__lock:
+            validator = self.__validators.get(key)
+            if validator:
+                self.__validators.move_to_end(key)
+                return validator
+
+        with telemetry.timer("ValidatorCompile"):
+            validator = SchemaValidator(schema_definition)
+        with self.__lock:
+            self.__validators[key] = validator
+            while len(self.__validators) > self.__maxsize:
+                self.__validators.popitem(last=False)
+        return validator
+
+
+validator_cache = ValidatorCache()
+
+
+def get_validator(schema_definition: dict, key: Hashable = None) -> SchemaValidator:
+    """Get the cached validator of a schema definition"""
+    return validator_cache.get(schema_definition, key)
@@ -0,0 +1,40 @@
+import importlib.util
+import pathlib
+import types
+from typing import Callable
+
+import pytest
+
+from docai import utils
+
+FUNCTIONS = pathlib.Path(__file__).parents[3] / "functions"
+# pydantic registers the validators of a model by name, so each app is loaded once
+apps: dict[str, types.ModuleType] = {}
+
+
+@pytest.fixture
+def load_function(monkeypatch) -> Callable[..., types.ModuleType]:
+    """Load the app of a function, with the given SSM parameters already resolved.
+
+    Tests replace the resources of the app with `monkeypatch`, so they are restored
+    for the next test using it.
+    """
+
+    def load(name: str, *parameter_env_names: str) -> types.ModuleType:
+        if name in apps:
+            return apps[name]
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "ca-central-1")
+        monkeypatch.setattr(utils, "bootstrap", lambda *args, **kwargs: None)
+        for env_name in parameter_env_names:
+            parameter_name = f"/test/{env_name}"
+            monkeypatch.setenv(env_name, parameter_name)
+            monkeypatch.setitem(utils.parameter_cache, parameter_name, env_name.lower())
+        spec = importlib.util.spec_from_file_location(
+            f"{name}_app", FUNCTIONS / name / "app.py"
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        apps[name] = module
+        return module
+
+    return load
@@ -0,0 +1,123 @@
+import contextlib
+import copy
+import io
+import re
+from typing import Any, Iterator
+
+from botocore.exceptions import ClientError
+
+COMPARISON = re.compile(r"^(\S+) (=|<>) (:\w+)$")
+NOT_EXISTS = re.compile(r"^attribute_not_exists\((\w+)\)$")
+
+
+def conditional_check_failed(operation: str) -> ClientError:
+    error = {"Error": {"Code": "ConditionalCheckFailedException"}}
+    return ClientError(error, operation)
+
+
+class Table:
+    """A DynamoDB table resource keeping its items in memory.
+
+    Supports the operations the handlers use, with conditions made of
+    `attribute_not_exists` and `=`/`<>` comparisons joined by OR, and queries on the
+    partition key returned `page_size` items at a time.
+    """
+
+    def __init__(self, *key_names: str, page_size: int = 100) -> None:
+        self.key_names = key_names
+        self.page_size = page_size
+        self.items: dict[tuple, dict] = {}
+
+    def key(self, item: dict) -> tuple:
+        return tuple(item[name] for name in self.key_names)
+
+    def matches(
+        self, condition: str, item: dict | None, names: dict, values: dict
+    ) -> bool:
+        for clause in condition.split(" OR "):
+            not_exists = NOT_EXISTS.match(clause)
+            if not_exists:
+                if item is None:
+                    return True
+                continue
+            name, operator, value = COMPARISON.match(clause).groups()
+            if item is None or names.get(name, name) not in item:
+                continue
+            equal = item[names.get(name, name)] == values[value]
+            if equal == (operator == "="):
+                return True
+        return False
+
+    def get_item(self, Key: dict, ConsistentRead: bool = False) -> dict:
+        item = self.items.get(self.key(Key))
+        return {"Item": copy.deepcopy(item)} if item else {}
+
+    def put_item(
+        self,
+        Item: dict,
+        ConditionExpression: str | None = None,
+        ExpressionAttributeNames: dict | None = None,
+        ExpressionAttributeValues: dict | None = None,
+    ) -> dict:
+        current = self.items.get(self.key(Item))
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+        if ConditionExpression and not self.matches(
+            ConditionExpression, current, names, values
+        ):
+            raise conditional_check_failed("PutItem")
+        self.items[self.key(Item)] = copy.deepcopy(Item)
+        return {}
+
+    def query(
+        self,
+        KeyConditionExpression: str,
+        ExpressionAttributeValues: dict,
+        ExpressionAttributeNames: dict | None = None,
+        ProjectionExpression: str | None = None,
+        ConsistentRead: bool = False,
+        ExclusiveStartKey: dict | None = None,
+    ) -> dict:
+        name, _, value = COMPARISON.match(KeyConditionExpression).groups()
+        keys = sorted(
+            key
+            for key, item in self.items.items()
+            if item[name] == ExpressionAttributeValues[value]
+        )
+        if ExclusiveStartKey:
+            keys = [key for key in keys if key > self.key(ExclusiveStartKey)]
+        page = keys[: self.page_size]
+        names = ExpressionAttributeNames or {}
+        attributes = [
+            names.get(name, name) for name in (ProjectionExpression or "").split(", ")
+        ]
+        items = [
+            {k: v for k, v in self.items[key].items() if k in attributes}
+            if ProjectionExpression
+            else copy.deepcopy(self.items[key])
+            for key in page
+        ]
+        response: dict[str, Any] = {"Items": items}
+        if len(keys) > len(page):
+            response["LastEvaluatedKey"] = dict(zip(self.key_names, page[-1]))
+        return response
+
+    @contextlib.contextmanager
+    def batch_writer(self) -> Iterator["Table"]:
+        yield self
+
+
+class S3:
+    """An S3 client keeping the objects of every bucket in memory"""
+
+    def __init__(self) -> None:
+        self.objects: dict[tuple[str, str], bytes] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs: Any) -> dict:
+        self.objects[(Bucket, Key)] = Body.encode() if isinstance(Body, str) else Body
+        return {"ResponseMetadata": {"RetryAttempts": 0}}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        if (Bucket, Key) not in self.objects:
+            error = {"Error": {"Code": "NoSuchKey"}}
+            raise ClientError(error, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
@@ -0,0 +1,132 @@
+import pytest
+
+from docai import budget, chunking
+from docai import constants as c
+from docai import exceptions as exc
+from docai import stream, utils
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": ["string", "null"]},
+        "address": {"$ref": "#/$defs/address"},
+        "items": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+    },
+    "$defs": {
+        "address": {
+            "type": "object",
+            "properties": {
+                "city": {"type": ["string", "null"]},
+                "zip": {"type": ["string", "null"]},
+            },
+        }
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # Words as tokens keep the sizes of the chunks predictable
+    monkeypatch.setattr(utils, "count_tokens", lambda text: len(text.split()))
+
+
+def pdf_text(pages: list[str]) -> str:
+    return "\n\n".join(f"## Page {i}\n\n{text}" for i, text in enumerate(pages, 1))
+
+
+def test_small_document_is_one_chunk():
+    text = pdf_text(["one", "two"])
+    assert chunking.split(text, ["a.png"]) == [chunking.Chunk(text, ["a.png"], 2)]
+
+
+def test_split_by_pages_keeps_images_with_their_page():
+    pages = ["text"] * 4
+    pages[1] = stream.IMAGE_PAGE
+    chunks = chunking.split(pdf_text(pages), ["1.png"], max_pages=2)
+    assert [chunk.pages for chunk in chunks] == [2, 2]
+    assert [chunk.image_list for chunk in chunks] == [["1.png"], []]
+    assert chunks[0].text_data.startswith(c.CHUNK_NOTE_FORMAT.format(part=1, parts=2))
+    assert "## Page 3" in chunks[1].text_data
+    assert "## Page 2" not in chunks[1].text_data
+
+
+def test_split_by_tokens():
+    chunks = chunking.split(pdf_text(["word " * 40] * 3), [], max_tokens=100)
+    assert [chunk.pages for chunk in chunks] == [2, 1]
+
+
+def test_split_counts_images_against_tokens():
+    chunks = chunking.split("", ["1.png", "2.png", "3.png"], max_tokens=1)
+    assert [chunk.image_list for chunk in chunks] == [["1.png"], ["2.png"], ["3.png"]]
+    assert chunks[0].tokens >= budget.MAX_IMAGE_TOKENS
+
+
+def test_split_text_by_paragraphs():
+    text = "\n\n".join(["word " * 10] * 5)
+    chunks = chunking.split(text, [], max_tokens=25)
+    assert len(chunks) == 3
+    assert all(chunk.pages == 0 for chunk in chunks)
+
+
+def test_oversized_page_is_its_own_chunk():
+    chunks = chunking.split(pdf_text(["a", "word " * 50, "b"]), [], max_tokens=10)
+    assert len(chunks) == 3
+
+
+def test_chunking_disabled(monkeypatch):
+    monkeypatch.setattr(c, "CHUNKING", False)
+    text = pdf_text(["word"] * 20)
+    assert chunking.split(text, [], max_pages=2) == [chunking.Chunk(text, [], 20)]
+
+
+def test_merge_objects_arrays_and_scalars():
+    values = [
+        {"name": None, "address": {"city": "Toronto"}, "items": ["a", "b"]},
+        {"name": "Acme", "address": {"city": "Ottawa", "zip": "K1A"}, "items": ["b"]},
+        {"name": "Other", "items": ["c"]},
+    ]
+    assert chunking.merge(values, SCHEMA, SCHEMA) == {
+        "name": "Acme",
+        "address": {"city": "Toronto", "zip": "K1A"},
+        "items": ["a", "b", "c"],
+    }
+
+
+def test_merge_nothing_is_null():
+    assert chunking.merge([None, None], SCHEMA, SCHEMA) is None
+
+
+def extraction(result: dict, index: int) -> dict:
+    return {
+        "request": {"model": "gpt-4o", "messages": [f"chunk {index}"]},
+        "images": {f"{index}.png": f"s3://{index}.png"},
+        "error": None,
+        "result": result,
+        "metadata": {"total_tokens": 10, "cached": False, "model": "gpt-4o"},
+    }
+
+
+def test_combine():
+    extractions = [
+        extraction({"name": "Acme", "items": ["a"]}, 0),
+        extraction({"name": None, "items": ["b"]}, 1),
+    ]
+    data = chunking.combine(SCHEMA, extractions)
+    assert data["result"] == {"name": "Acme", "items": ["a", "b"]}
+    assert data["request"] == {
+        "model": "gpt-4o",
+        "messages": ["chunk 0"],
+        "chunks": 2,
+    }
+    assert data["images"] == {"0.png": "s3://0.png", "1.png": "s3://1.png"}
+    assert data["metadata"] == {"chunks": 2, "total_tokens": 20}
+    assert data["error"] is None
+
+
+def test_combine_validates_merged_result():
+    extractions = [
+        extraction({"items": ["a", "b"]}, 0),
+        extraction({"items": ["c", "d"]}, 1),
+    ]
+    with pytest.raises(exc.InvalidData):
+        chunking.combine(SCHEMA, extractions)
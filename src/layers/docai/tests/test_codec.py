@@ -0,0 +1,65 @@
+import decimal
+
+import pytest
+
+from docai import codec
+from docai import exceptions as exc
+
+
+def test_extract_bare_object():
+    assert codec.extract_json('{"a": 1, "b": [true, null]}') == {
+        "a": 1,
+        "b": [True, None],
+    }
+
+
+def test_extract_fenced_object():
+    text = 'Here is the data:\n```json\n{"a": "x"}\n```\nLet me know {"b": 2}.'
+    assert codec.extract_json(text) == {"a": "x"}
+
+
+def test_extract_prefers_fenced_over_prose():
+    text = 'See {"a": 1} below.\n```\n{"a": 2}\n```'
+    assert codec.extract_json(text) == {"a": 2}
+
+
+def test_extract_ignores_trailing_output():
+    text = '{"a": {"b": "}"}} and the braces } that follow {"c": 3}'
+    assert codec.extract_json(text) == {"a": {"b": "}"}}
+
+
+def test_extract_skips_braces_that_cannot_start_an_object():
+    text = 'The {placeholder} and {"a": 1}'
+    assert codec.extract_json(text) == {"a": 1}
+
+
+def test_extract_falls_back_to_prose_after_invalid_fence():
+    text = '```\n{"a": \n```\nThe answer is {"a": 1}'
+    assert codec.extract_json(text) == {"a": 1}
+
+
+def test_extract_unclosed_fence():
+    assert codec.extract_json('```json\n{"a": 1}') == {"a": 1}
+
+
+def test_extract_parses_fractions_as_decimal():
+    data = codec.extract_json('{"a": 1.10, "b": 2, "c": 1e3}')
+    assert data == {"a": decimal.Decimal("1.10"), "b": 2, "c": decimal.Decimal("1e3")}
+    assert isinstance(data["b"], int)
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '```\n{"a": \n```', "[1, 2]"])
+def test_extract_without_object(text):
+    with pytest.raises(exc.InvalidData):
+        codec.extract_json(text)
+
+
+@pytest.mark.parametrize("name", ["stdlib", "auto"])
+def test_dumps_decimals_as_numbers(name):
+    encoder = codec.get_codec(name)
+    value = {"a": decimal.Decimal("1.5"), "b": decimal.Decimal("2"), "c": {1}}
+    assert codec.loads(encoder.dumps(value)) == {
+        "a": decimal.Decimal("1.5"),
+        "b": 2,
+        "c": [1],
+    }
@@ -0,0 +1,175 @@
+import json
+
+import pytest
+from aws_lambda_powertools.utilities.parser import ValidationError
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from docai import constants as c
+from docai import exceptions as exc
+from docai import jobs, schemas
+from tests import fakes
+
+KEY = dict(schema_name="invoice", schema_version="abcdefghij")
+
+
+class Queue:
+    """An SQS queue failing the sends and messages it is told to"""
+
+    def __init__(self, raises: int = 0, failures: int = 0, failing: set = frozenset()):
+        self.raises = raises  # calls that raise before any succeeds
+        self.failures = failures  # calls that fail every message of `failing`
+        self.failing = failing
+        self.messages: list[dict] = []
+        self.calls = 0
+
+    def send_messages(self, Entries: list[dict]) -> dict:
+        self.calls += 1
+        assert len(Entries) <= c.SQS_BATCH_SIZE
+        if self.raises:
+            self.raises -= 1
+            raise EndpointConnectionError(endpoint_url="https://sqs")
+        failed, sent = [], []
+        for entry in Entries:
+            body = json.loads(entry["MessageBody"])
+            if body["request_id"] in self.failing and self.failures:
+                failed.append({"Id": entry["Id"], "SenderFault": False})
+            else:
+                sent.append({"Id": entry["Id"]})
+                self.messages.append(body)
+        if failed:
+            self.failures -= 1
+        return {"Successful": sent, "Failed": failed}
+
+
+@pytest.fixture
+def app(load_function, monkeypatch):
+    app = load_function(
+        "extract_data_bulk",
+        "FILES_BUCKET_PARAMETER_NAME",
+        "SCHEMA_TABLE_PARAMETER_NAME",
+        "RESULT_TABLE_PARAMETER_NAME",
+        "MONITOR_TABLE_PARAMETER_NAME",
+        "JOB_TABLE_PARAMETER_NAME",
+        "BATCH_DATA_QUEUE_PARAMETER_NAME",
+    )
+    schema_table = fakes.Table("schema_name", "schema_version")
+    schema_table.put_item(
+        Item=dict(KEY, schema_description="Invoices", schema_definition={})
+    )
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(app, "schema_cache", schemas.SchemaCache(schema_table))
+    monkeypatch.setattr(app, "s3_client", fakes.S3())
+    monkeypatch.setattr(app, "result_table", fakes.Table("request_id"))
+    monkeypatch.setattr(app, "monitor_table", fakes.Table("request_id"))
+    tracker = jobs.JobTracker(fakes.Table("job_id", "item_id"))
+    monkeypatch.setattr(app, "job_tracker", tracker)
+    monkeypatch.setattr(app, "batch_queue", Queue())
+    return app
+
+
+def request(app, count: int, **document) -> dict:
+    document = document or dict(
+        s3_key="uploads/invoice.pdf", mime_type="application/pdf"
+    )
+    return app.RequestModel(**KEY, documents=[document] * count).dict()
+
+
+def test_queues_every_document(app):
+    response = app.queue_bulk_extraction("job", request(app, 25))
+    assert response["status"] == "QUEUED"
+    assert (response["total"], response["queued"], response["failed"]) == (25, 25, 0)
+    assert response["request_ids"][:2] == ["job-00000", "job-00001"]
+    assert app.batch_queue.calls == 3
+    assert [m["request_id"] for m in app.batch_queue.messages] == response[
+        "request_ids"
+    ]
+    assert app.batch_queue.messages[0]["document"]["s3_key"] == "uploads/invoice.pdf"
+    statuses = {item["status"] for item in app.monitor_table.items.values()}
+    assert statuses == {"QUEUED"}
+    job = app.job_tracker.get("job")
+    assert (job["status"], job["total"], job["failed"]) == ("RUNNING", 25, 0)
+
+
+def test_stores_inline_documents(app):
+    app.queue_bulk_extraction(
+        "job", request(app, 1, content="hello", mime_type="text/plain")
+    )
+    bucket = app.bucket_name
+    assert app.s3_client.objects[(bucket, "documents/job-00000")] == b"hello"
+    assert app.batch_queue.messages[0]["document"]["s3_key"] == "documents/job-00000"
+
+
+def test_retries_failed_messages(app):
+    app.batch_queue = Queue(failures=2, failing={"job-00003"})
+    response = app.queue_bulk_extraction("job", request(app, 5))
+    assert response["status"] == "QUEUED"
+    assert app.batch_queue.calls == 3
+    assert len(app.batch_queue.messages) == 5
+
+
+def test_retries_sends_that_raise(app):
+    app.batch_queue = Queue(raises=c.BULK_SEND_ATTEMPTS - 1)
+    response = app.queue_bulk_extraction("job", request(app, 5))
+    assert response["status"] == "QUEUED"
+    assert len(app.batch_queue.messages) == 5
+
+
+def test_records_documents_that_could_not_be_queued(app):
+    app.batch_queue = Queue(failures=c.BULK_SEND_ATTEMPTS, failing={"job-00001"})
+    response = app.queue_bulk_extraction("job", request(app, 3))
+    assert response["status"] == "PARTIALLY_QUEUED"
+    assert (response["queued"], response["failed"]) == (2, 1)
+    assert app.result_table.items[("job-00001",)]["error"]["error_name"] == "QueueError"
+    assert app.monitor_table.items[("job-00001",)]["status"] == "FAILED"
+    assert app.monitor_table.items[("job-00000",)]["status"] == "QUEUED"
+    assert app.job_tracker.count("job")["failed"] == 1
+
+
+def test_batch_failing_every_send_fails_its_documents(app):
+    # The first batch is sent, the second raises on every attempt
+    app.batch_queue = Queue()
+    send_messages = app.batch_queue.send_messages
+
+    def flaky(Entries):
+        if json.loads(Entries[0]["MessageBody"])["request_id"] >= "job-00010":
+            error = {"Error": {"Code": "AWS.SimpleQueueService.NonExistentQueue"}}
+            raise ClientError(error, "SendMessageBatch")
+        return send_messages(Entries)
+
+    app.batch_queue.send_messages = flaky
+    response = app.queue_bulk_extraction("job", request(app, 12))
+    assert response["status"] == "PARTIALLY_QUEUED"
+    assert (response["queued"], response["failed"]) == (10, 2)
+    assert sorted(app.result_table.items) == [("job-00010",), ("job-00011",)]
+    job = app.job_tracker.get("job")
+    assert (job["status"], job["failed"]) == ("RUNNING", 2)
+
+
+def test_job_fails_when_nothing_is_queued(app):
+    app.batch_queue = Queue(raises=c.BULK_SEND_ATTEMPTS)
+    response = app.queue_bulk_extraction("job", request(app, 3))
+    assert response["status"] == "FAILED"
+    assert (response["queued"], response["failed"]) == (0, 3)
+    assert app.job_tracker.get("job")["status"] == "COMPLETED"
+
+
+def test_unknown_schema(app):
+    req = dict(request(app, 1), schema_version="jihgfedcba")
+    with pytest.raises(exc.SchemaDoesNotExist):
+        app.queue_bulk_extraction("job", req)
+    assert not app.monitor_table.items
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        dict(mime_type="text/plain"),
+        dict(content="hello", s3_key="uploads/a.txt", mime_type="text/plain"),
+        dict(s3_key="pages/other/0001.png", mime_type="image/png"),
+        dict(s3_key="documents/other-00000", mime_type="application/pdf"),
+        dict(s3_key="manifests/other.json", mime_type="application/json"),
+    ],
+)
+def test_invalid_documents(app, document):
+    with pytest.raises(ValidationError):
+        app.DocumentModel(**document)
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from docai import jobs
+from tests import fakes
+
+
+@pytest.fixture
+def table():
+    return fakes.Table("job_id", "item_id", page_size=2)
+
+
+@pytest.fixture
+def tracker(table):
+    tracker = jobs.JobTracker(table)
+    tracker.create("job", 4, schema_name="invoice", schema_version="v1")
+    return tracker
+
+
+def test_new_job_is_running(tracker):
+    job = tracker.get("job")
+    assert job["status"] == "RUNNING"
+    assert job["total"] == 4
+    assert job["schema_name"] == "invoice"
+    assert (job["completed"], job["failed"], job["retrying"]) == (0, 0, 0)
+    assert "item_id" not in job
+
+
+def test_missing_job(tracker):
+    assert tracker.get("other") is None
+
+
+def test_counts_every_page_of_documents(tracker):
+    for index, status in enumerate(["COMPLETED", "COMPLETED", "FAILED"]):
+        tracker.record("job", f"job-{index}", status)
+    tracker.record("other", "other-0", "COMPLETED")
+    assert tracker.count("job") == {"completed": 2, "failed": 1, "retrying": 0}
+
+
+def test_job_completes_when_every_document_finished(tracker):
+    tracker.record("job", "job-0", "COMPLETED")
+    tracker.record("job", "job-1", "FAILED")
+    tracker.record("job", "job-2", "RETRYING")
+    assert tracker.get("job")["status"] == "RUNNING"
+    tracker.record("job", "job-2", "COMPLETED")
+    tracker.record("job", "job-3", "FAILED")
+    job = tracker.get("job")
+    assert job["status"] == "COMPLETED"
+    assert (job["completed"], job["failed"], job["retrying"]) == (2, 2, 0)
+
+
+def test_redelivered_document_is_counted_once(tracker):
+    tracker.record("job", "job-0", "RETRYING")
+    tracker.record("job", "job-0", "RETRYING")
+    tracker.record("job", "job-0", "COMPLETED")
+    tracker.record("job", "job-0", "COMPLETED")
+    assert tracker.count("job") == {"completed": 1, "failed": 0, "retrying": 0}
+
+
+def test_late_failure_never_overrides_completion(tracker):
+    tracker.record("job", "job-0", "COMPLETED")
+    tracker.record("job", "job-0", "FAILED")
+    assert tracker.count("job") == {"completed": 1, "failed": 0, "retrying": 0}
+
+
+@pytest.fixture
+def failed(load_function, monkeypatch, table, tracker):
+    app = load_function(
+        "extract_data_batch_failed",
+        "RESULT_TABLE_PARAMETER_NAME",
+        "MONITOR_TABLE_PARAMETER_NAME",
+        "JOB_TABLE_PARAMETER_NAME",
+    )
+    monkeypatch.setattr(app, "result_table", fakes.Table("request_id"))
+    monkeypatch.setattr(app, "monitor_table", fakes.Table("request_id"))
+    monkeypatch.setattr(app, "job_tracker", tracker)
+    return app
+
+
+def record_body(request_id: str, **kwargs) -> dict:
+    key = dict(schema_name="invoice", schema_version="v1")
+    return dict(request_id=request_id, key=key, **kwargs)
+
+
+def test_dead_lettered_record_fails_its_document(failed, tracker):
+    tracker.record("job", "job-0", "RETRYING")
+    failed.fail_extraction(**record_body("job-0", job_id="job", payload=None))
+    result = failed.result_table.items[("job-0",)]
+    assert result["error"]["error_name"] == "ExtractionFailed"
+    assert result["schema_name"] == "invoice"
+    assert failed.monitor_table.items[("job-0",)]["status"] == "FAILED"
+    assert tracker.count("job") == {"completed": 0, "failed": 1, "retrying": 0}
+
+
+def test_dead_lettered_record_keeps_the_error_of_its_last_attempt(failed):
+    error = dict(error_name="InvalidData", error_message="Data does not match schema")
+    failed.result_table.put_item(Item=dict(request_id="job-0", error=error))
+    failed.fail_extraction(**record_body("job-0", job_id="job"))
+    assert failed.result_table.items[("job-0",)]["error"] == error
+
+
+def test_dead_lettered_record_of_completed_document(failed, tracker):
+    tracker.record("job", "job-0", "COMPLETED")
+    failed.fail_extraction(**record_body("job-0", job_id="job"))
+    assert tracker.count("job") == {"completed": 1, "failed": 0, "retrying": 0}
+
+
+def test_dead_lettered_record_without_job(failed, table):
+    failed.fail_extraction(**record_body("request"))
+    assert failed.monitor_table.items[("request",)]["status"] == "FAILED"
+    assert list(table.items) == [("job", jobs.JOB_ITEM)]
+
+
+def test_dead_letter_handler_reports_failed_records(failed, monkeypatch):
+    def fail_extraction(request_id, **kwargs):
+        if request_id == "bad":
+            raise RuntimeError("Table unavailable")
+
+    monkeypatch.setattr(failed, "fail_extraction", fail_extraction)
+    records = [
+        {"messageId": str(index), "body": json.dumps(record_body(request_id))}
+        for index, request_id in enumerate(["good", "bad"])
+    ]
+    # Without the metrics and logging decorators, which expect a Lambda context
+    handler = failed.lambda_handler.__wrapped__.__wrapped__
+    assert handler({"Records": records}, None) == {
+        "batchItemFailures": [{"itemIdentifier": "1"}]
+    }
@@ -0,0 +1,169 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+from docai import deadline as dl
+from docai import exceptions as exc
+from docai import llm, ratelimit, retry
+
+LIMITS = ratelimit.Limits(requests=60, tokens=6000)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.time, "sleep", slept.append)
+    return slept
+
+
+def test_reserve_takes_from_bucket():
+    bucket = ratelimit.full_bucket(LIMITS, now=0)
+    bucket, wait = ratelimit.reserve(bucket, LIMITS, 1000, now=0)
+    assert bucket == ratelimit.Bucket(59, 5000, 0)
+    assert wait == 0
+
+
+def test_reserve_waits_for_debt_to_be_paid_back():
+    bucket = ratelimit.Bucket(60, 500, 0)
+    bucket, wait = ratelimit.reserve(bucket, LIMITS, 1100, now=0)
+    assert bucket.tokens == -600
+    # 6000 tokens a minute pay back 600 in 6 seconds
+    assert wait == pytest.approx(6)
+
+
+def test_reserve_refills_with_time():
+    bucket = ratelimit.Bucket(0, 0, 0)
+    bucket, wait = ratelimit.reserve(bucket, LIMITS, 3000, now=30)
+    assert bucket == ratelimit.Bucket(29, 0, 30)
+    assert wait == 0
+
+
+def test_release_gives_back_up_to_the_limits():
+    bucket = ratelimit.full_bucket(LIMITS, now=0)
+    bucket, _ = ratelimit.reserve(bucket, LIMITS, 1000, now=0)
+    bucket, _ = ratelimit.reserve(bucket, LIMITS, -1000, now=0, requests=-1)
+    assert bucket == ratelimit.full_bucket(LIMITS, now=0)
+    bucket, wait = ratelimit.reserve(bucket, LIMITS, -1000, now=0, requests=-1)
+    assert bucket == ratelimit.full_bucket(LIMITS, now=0)
+    assert wait == 0
+
+
+def test_disabled_limit_never_waits():
+    limits = ratelimit.Limits(requests=0, tokens=100)
+    bucket, wait = ratelimit.reserve(
+        ratelimit.full_bucket(limits, 0), limits, 10, now=0, requests=5
+    )
+    assert wait == 0
+
+
+def test_in_memory_store_queues_callers():
+    store = ratelimit.InMemoryStore()
+    assert store.reserve("m", LIMITS, 6000) == 0
+    assert store.reserve("m", LIMITS, 600) == pytest.approx(6, abs=0.1)
+    assert store.reserve("other", LIMITS, 600) == 0
+
+
+def test_acquire_sleeps_for_the_wait(no_sleep):
+    limiter = ratelimit.RateLimiter(ratelimit.InMemoryStore(), LIMITS)
+    assert limiter.acquire("m", 6000) == 0
+    wait = limiter.acquire("m", 600)
+    assert wait == pytest.approx(6, abs=0.1)
+    assert no_sleep == [0, wait]
+
+
+def test_acquire_past_deadline_releases_reservation(no_sleep):
+    store = ratelimit.InMemoryStore()
+    limiter = ratelimit.RateLimiter(store, LIMITS)
+    limiter.acquire("m", 6000)
+    with pytest.raises(exc.DeadlineExceeded):
+        limiter.acquire("m", 600, dl.Deadline.after(1))
+    assert no_sleep == [0]
+    # Only the first call holds capacity, so the next one waits as long as before
+    assert store.reserve("m", LIMITS, 600) == pytest.approx(6, abs=0.1)
+
+
+def test_acquire_async_past_deadline_releases_reservation():
+    store = ratelimit.InMemoryStore()
+    limiter = ratelimit.RateLimiter(store, LIMITS)
+    limiter.acquire("m", 6000)
+    with pytest.raises(exc.DeadlineExceeded):
+        asyncio.run(limiter.acquire_async("m", 600, dl.Deadline.after(1)))
+    assert store.reserve("m", LIMITS, 600) == pytest.approx(6, abs=0.1)
+
+
+def test_disabled_limiter_does_not_reserve():
+    store = ratelimit.InMemoryStore()
+    limiter = ratelimit.RateLimiter(store, ratelimit.Limits(0, 0))
+    assert limiter.acquire("m", 10**9) == 0
+    limiter.release("m", 10**9)
+
+
+class Table:
+    """A DynamoDB table evaluating the conditions of the store"""
+
+    def __init__(self, conflicts: int = 0) -> None:
+        self.items: dict[str, dict] = {}
+        self.conflicts = conflicts
+        self.puts = 0
+
+    def get_item(self, Key, ConsistentRead):
+        item = self.items.get(Key["limit_key"])
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeValues=None):
+        self.puts += 1
+        current = self.items.get(Item["limit_key"])
+        if ConditionExpression == "attribute_not_exists(limit_key)":
+            ok = current is None
+        else:
+            expected = ExpressionAttributeValues[":updated_at"]
+            ok = current is not None and current["updated_at"] == expected
+        if self.conflicts or not ok:
+            self.conflicts = max(0, self.conflicts - 1)
+            error = {"Error": {"Code": "ConditionalCheckFailedException"}}
+            raise ClientError(error, "PutItem")
+        self.items[Item["limit_key"]] = Item
+
+
+def test_dynamodb_store_reserves_and_releases():
+    table = Table()
+    store = ratelimit.DynamoDBStore(table)
+    assert store.reserve("m", LIMITS, 6000) == 0
+    assert store.reserve("m", LIMITS, 600) == pytest.approx(6, abs=0.1)
+    store.reserve("m", LIMITS, -600, requests=-1)
+    assert float(table.items["m"]["requests"]) == pytest.approx(59, abs=0.1)
+    assert float(table.items["m"]["tokens"]) == pytest.approx(0, abs=10)
+
+
+def test_dynamodb_store_retries_conflicts():
+    table = Table(conflicts=2)
+    store = ratelimit.DynamoDBStore(table, attempts=3)
+    assert store.reserve("m", LIMITS, 100) == 0
+    assert table.puts == 3
+    assert "m" in table.items
+
+
+def image_payload() -> dict:
+    image = {"type": "image_url", "image_url": {"url": "https://example.com/0.png"}}
+    return {
+        "model": "gpt-4o",
+        "max_tokens": 100,
+        "messages": [{"role": "user", "content": [image]}],
+    }
+
+
+@pytest.mark.parametrize("client_class", [llm.LLMClient, llm.AsyncLLMClient])
+def test_client_releases_reservation_when_deadline_stops_call(client_class):
+    store = ratelimit.InMemoryStore()
+    limiter = ratelimit.RateLimiter(store, ratelimit.Limits(10, 10**6))
+    policy = retry.RetryPolicy(min_attempt_time=5)
+    client = client_class("key", rate_limiter=limiter, retry_policy=policy)
+    create = getattr(client, f"_{client_class.__name__}__create")
+    with pytest.raises(exc.DeadlineExceeded):
+        result = create(image_payload(), dl.Deadline.after(1))
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+    bucket = store._InMemoryStore__buckets["gpt-4o"]
+    assert bucket.requests == pytest.approx(10)
+    assert bucket.tokens == pytest.approx(10**6)
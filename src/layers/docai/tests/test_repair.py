@@ -0,0 +1,92 @@
+import decimal
+
+import pytest
+
+from docai import codec, repair, validators
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "amount": {"type": ["number", "null"]},
+        "count": {"type": "integer"},
+        "paid": {"type": "boolean"},
+        "currency": {"enum": ["CAD", "USD"]},
+        "notes": {"type": ["string", "null"]},
+        "due": {"type": ["number", "null"]},
+        "items": {"type": "array", "items": {"$ref": "#/$defs/item"}},
+    },
+    "required": ["name", "amount", "notes"],
+    "additionalProperties": False,
+    "$defs": {"item": {"type": "object", "properties": {"code": {"type": "string"}}}},
+}
+
+
+def run(content: str) -> object:
+    validator = validators.SchemaValidator(SCHEMA)
+    return repair.repair(content, SCHEMA, validator, codec.extract_json)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"a": [1, 2,], "b": 3,}', '{"a": [1, 2], "b": 3}'),
+        ('{"a": True, "b": None, "c": "None"}', '{"a": true, "b": null, "c": "None"}'),
+        ('{"a": "cut sho', '{"a": "cut sho"}'),
+        ('{"a": [{"b": 1},', '{"a": [{"b": 1}]}'),
+        ('{"a": ', '{"a":null}'),
+        ('Sure: {"a": 1} and {"b": 2}', '{"a": 1}'),
+        ('```json\n{"a": {"b": 1\n```', '{"a": {"b": 1}}'),
+    ],
+)
+def test_repair_syntax(text, expected):
+    assert repair.repair_syntax(text) == expected
+
+
+def test_repair_coerces_values():
+    content = (
+        '{"name": "Acme", "amount": "1,250.50", "count": "3", "paid": "TRUE",'
+        ' "currency": "cad", "notes": "n/a", "due": "N/A", "items": {"code": 7}}'
+    )
+    assert run(content) == {
+        "name": "Acme",
+        "amount": decimal.Decimal("1250.50"),
+        "count": 3,
+        "paid": True,
+        "currency": "CAD",
+        "notes": "n/a",
+        "due": None,
+        "items": [{"code": "7"}],
+    }
+
+
+def test_repair_fills_missing_nullable_and_drops_unknown():
+    assert run('{"name": "Acme", "amount": 5, "extra": 1}') == {
+        "name": "Acme",
+        "amount": 5,
+        "notes": None,
+    }
+
+
+def test_repair_fixes_syntax_then_values():
+    assert run('{"name": "Acme", "amount": "12", "notes": None,') == {
+        "name": "Acme",
+        "amount": 12,
+        "notes": None,
+    }
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # Valid already, there is nothing to repair
+        '{"name": "Acme", "amount": 1, "notes": null}',
+        # A required property that is not nullable cannot be made up
+        '{"amount": 1, "notes": null}',
+        # Not a number in any format
+        '{"name": "Acme", "amount": "about ten", "notes": null}',
+        "no json at all",
+    ],
+)
+def test_repair_gives_up(content):
+    assert run(content) is None
@@ -0,0 +1,70 @@
+import base64
+
+import fitz
+import pytest
+
+from docai import exceptions as exc
+from docai import stream
+from tests import fakes
+
+BUCKET = "files"
+TEXT = "Invoice 1234 from Acme Corporation, due on 2024-01-31 for a total of $1,250.00."
+SCHEMA = {"schema_definition": {"type": "object", "properties": {}}}
+
+
+def pdf(*pages: str | None) -> bytes:
+    """Return a PDF with a page of each text, blank where it is None."""
+    with fitz.open() as document:
+        for text in pages:
+            page = document.new_page()
+            if text is not None:
+                page.insert_textbox(fitz.Rect(72, 72, 540, 720), text)
+        return document.tobytes()
+
+
+def pdf_document(*pages: str | None) -> dict:
+    content = base64.b64encode(pdf(*pages)).decode()
+    return dict(content=content, mime_type="application/pdf")
+
+
+def test_page_text():
+    assert stream.load_pdf_text(pdf(TEXT, None, "Page 2")) == [TEXT, None, None]
+
+
+def test_page_text_must_be_readable():
+    assert stream.load_pdf_text(pdf("©¤¬" * 15 + TEXT[:30])) == [None]
+
+
+def prepare(s3: fakes.S3, document: dict, reference: bool = False) -> dict:
+    return stream.prepare_extraction_request(
+        SCHEMA, document, s3, BUCKET, select_pages=False, reference=reference
+    )
+
+
+def test_text_pages_are_not_rendered():
+    s3 = fakes.S3()
+    params = prepare(s3, pdf_document(TEXT, None))
+    assert params["text_data"] == stream.format_pages([TEXT, None])
+    assert [key.split("/")[0] for key in params["image_list"]] == ["pages"]
+    pages = [key for _, key in s3.objects if key.startswith(stream.PAGES_PREFIX)]
+    assert pages == params["image_list"]
+
+
+def test_reference_round_trip():
+    s3, document = fakes.S3(), pdf_document(TEXT, None)
+    params = prepare(s3, document, reference=True)
+    assert "text_data" not in params
+    assert stream.load_extraction_request(s3, BUCKET, params) == prepare(s3, document)
+    # A cached document is referenced as well
+    assert prepare(s3, document, reference=True) == params
+
+
+def test_load_request_without_reference():
+    params = dict(text_data="hello", image_list=[], schema_definition={})
+    assert stream.load_extraction_request(fakes.S3(), BUCKET, params) == params
+
+
+def test_expired_manifest():
+    params = dict(manifest="abc/def", schema_definition={}, selected_pages=None)
+    with pytest.raises(exc.ManifestDoesNotExist):
+        stream.load_extraction_request(fakes.S3(), BUCKET, params)
@@ -0,0 +1,112 @@
+import decimal
+
+import pytest
+from jsonschema import Draft202012Validator
+
+from docai import exceptions as exc
+from docai import validators
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "minLength": 2, "pattern": "^[A-Z]"},
+        "age": {"type": ["integer", "null"], "minimum": 0, "exclusiveMaximum": 150},
+        "status": {"enum": ["active", "inactive", None]},
+        "kind": {"const": "person"},
+        "address": {"$ref": "#/$defs/address"},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 2},
+        "score": {"anyOf": [{"type": "number"}, {"type": "null"}]},
+        "flag": {"oneOf": [{"type": "boolean"}, {"type": "integer"}]},
+    },
+    "required": ["name", "age"],
+    "additionalProperties": False,
+    "$defs": {
+        "address": {
+            "type": "object",
+            "properties": {"city": {"type": "string"}},
+            "required": ["city"],
+        }
+    },
+}
+
+INSTANCES = [
+    {"name": "Ada", "age": 36},
+    {"name": "Ada", "age": None, "status": None, "kind": "person"},
+    {"name": "Ada", "age": 36, "address": {"city": "Toronto"}, "tags": ["a", "b"]},
+    {"name": "Ada", "age": 36, "score": decimal.Decimal("1.5"), "flag": True},
+    {},
+    {"name": "a", "age": -1},
+    {"name": 1, "age": "36"},
+    {"name": "Ada", "age": True},
+    {"name": "Ada", "age": 150, "status": "Active", "kind": "animal"},
+    {"name": "Ada", "age": 36, "address": {"town": "Toronto"}},
+    {"name": "Ada", "age": 36, "tags": ["a", 2, "c"]},
+    {"name": "Ada", "age": 36, "score": "high", "flag": "yes"},
+    {"name": "Ada", "age": 36, "extra": 1},
+    [],
+    None,
+]
+
+
+def issues(errors: list[validators.ValidationIssue]) -> list[str]:
+    return sorted(error.path for error in errors)
+
+
+def reference_issues(data: object) -> list[str]:
+    errors = Draft202012Validator(SCHEMA).iter_errors(data)
+    return sorted(validators.format_path(tuple(e.absolute_path)) for e in errors)
+
+
+def test_compiles_supported_schemas():
+    assert validators.SchemaValidator(SCHEMA).compiled
+
+
+@pytest.mark.parametrize("data", INSTANCES)
+def test_compiled_matches_jsonschema(data):
+    validator = validators.SchemaValidator(SCHEMA)
+    assert issues(validator.errors(data)) == reference_issues(data)
+
+
+@pytest.mark.parametrize("data", INSTANCES)
+def test_fallback_matches_jsonschema(data):
+    schema = {**SCHEMA, "patternProperties": {"^x-": {}}}
+    validator = validators.SchemaValidator(schema)
+    assert not validator.compiled
+    assert issues(validator.errors(data)) == reference_issues(data)
+
+
+def test_error_paths_and_messages():
+    validator = validators.SchemaValidator(SCHEMA)
+    errors = validator.errors({"name": "Ada", "age": 36, "tags": ["a", 2]})
+    assert errors == [
+        validators.ValidationIssue(
+            "$.tags[1]", "2 is not of type 'string'", ("tags", 1)
+        )
+    ]
+
+
+def test_validate_raises_invalid_data():
+    validator = validators.SchemaValidator(SCHEMA)
+    validator.validate({"name": "Ada", "age": 36})
+    with pytest.raises(exc.InvalidData):
+        validator.validate({"name": "Ada"})
+
+
+def test_recursive_references():
+    schema = {
+        "type": "object",
+        "properties": {"children": {"type": "array", "items": {"$ref": "#"}}},
+        "required": ["children"],
+    }
+    validator = validators.SchemaValidator(schema)
+    assert validator.compiled
+    assert not validator.errors({"children": [{"children": []}]})
+    assert issues(validator.errors({"children": [{}]})) == ["$.children[0]"]
+
+
+def test_cache_reuses_validators():
+    cache = validators.ValidatorCache(maxsize=1)
+    validator = cache.get(SCHEMA)
+    assert cache.get(dict(SCHEMA)) is validator
+    cache.get({"type": "string"})
+    assert cache.get(SCHEMA) is not validator